@@ -0,0 +1,100 @@
+import argparse
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from harness import fakes
+from src import copier, handler, metrics
+
+"""
+Micro-benchmarks of the load test's own hot paths, run against the fakes with
+a fixed latency per AWS call so the numbers show how well each path overlaps
+its round trips, not how fast AWS was that day:
+
+- copy: copier.copy_objects over the seeded reference bucket, at a few worker counts
+- metrics: metrics.harvest of the pipeline's CloudWatch metrics
+- secrets: handler._replace_secrets, the secret rewrite on every pipeline function
+- cold start: importing src.handler and creating its first (real, boto3) client,
+  in a fresh interpreter each time, which is what a new lambda container pays
+
+    python -m harness.bench --latency 0.02 --objects 1000
+"""
+
+
+def _time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+# Run in a fresh interpreter, prints the seconds the import and the first client took
+COLD_START = """
+import time
+started_at = time.perf_counter()
+import src.handler
+imported_at = time.perf_counter()
+src.handler.rds_client.meta
+print(imported_at - started_at, time.perf_counter() - imported_at)
+"""
+
+
+def _cold_start(repeat):
+    """
+    :return: median seconds to import src.handler, and to create the first client after that
+    """
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', COLD_START], capture_output=True, check=True, text=True,
+                                env=dict(os.environ, AWS_DEPLOYMENT_REGION='us-west-2')).stdout
+        timings.append([float(seconds) for seconds in output.split()])
+    return statistics.median(timing[0] for timing in timings), statistics.median(timing[1] for timing in timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the load test hot paths against in-process fakes')
+    parser.add_argument('--objects', type=int, default=1000, help='files to seed the reference bucket with')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds each fake AWS call takes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the median is reported')
+    parser.add_argument('--workers', default='1,8,32', help='copy worker counts to try, comma separated')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('AWS_DEPLOYMENT_REGION', 'us-west-2')
+    world = fakes.install(fakes.World())
+    world.seed(handler)
+    world.seed_reference_bucket(handler.SRC_BUCKET, args.objects)
+    world.latency = args.latency
+    objects = list(copier.list_objects(world.client('s3'), handler.SRC_BUCKET))
+
+    print(f"{'benchmark':<28}{'seconds':>10}{'per second':>14}")
+    for max_workers in [int(workers) for workers in args.workers.split(',')]:
+        seconds = _time(lambda: copier.copy_objects(world.client('s3'), handler.SRC_BUCKET, handler.TEST_BUCKET,
+                                                    objects, max_workers=max_workers), args.repeat)
+        print(f"{f'copy ({max_workers} workers)':<28}{seconds:>10.3f}{len(objects) / seconds:>14.1f}")
+
+    end_time = datetime.datetime.now()
+    seconds = _time(lambda: metrics.harvest(world.client('cloudwatch'), handler.LAMBDA_FUNCTIONS,
+                                            handler.DB_INSTANCE_IDENTIFIER,
+                                            [handler.CAPTURE_TRIGGER_QUEUE, handler.ERROR_QUEUE],
+                                            end_time - datetime.timedelta(hours=1), end_time), args.repeat)
+    print(f"{'metrics harvest':<28}{seconds:>10.3f}{1 / seconds:>14.1f}")
+
+    def _rewrite():
+        handler._replace_secrets(handler.NWCAPTURE_LOAD)
+        handler._replace_secrets(handler.NWCAPTURE_REAL)
+    seconds = _time(_rewrite, args.repeat) / 2
+    print(f"{'secret rewrite':<28}{seconds:>10.3f}{len(handler.LAMBDA_FUNCTIONS) / seconds:>14.1f}")
+
+    imported, first_client = _cold_start(args.repeat)
+    print(f"{'cold start: import':<28}{imported:>10.3f}")
+    print(f"{'cold start: first client':<28}{first_client:>10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
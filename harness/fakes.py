@@ -0,0 +1,605 @@
+import datetime
+import functools
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from psycopg2 import sql
+
+from src import clients
+
+"""
+In-process stand-ins for the AWS services and the database the load test talks
+to, just enough of each for the handlers to run end to end offline.
+
+Everything lives in one World.  Files that land in a bucket with a queue
+notification on it are "captured" straight away: a row per file is added to
+the fake capture.json_data, so the completion, throughput and latency code has
+something to measure.  Every API call sleeps for World.latency seconds, to
+stand in for the round trip when benchmarking.
+"""
+
+
+def _api(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.world.latency:
+            time.sleep(self.world.latency)
+        with self.world.lock:
+            self.world.calls[f"{self.service}.{method.__name__}"] = \
+                self.world.calls.get(f"{self.service}.{method.__name__}", 0) + 1
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class _Exceptions:
+    """
+    Stands in for client.exceptions: every attribute is a ClientError subclass of that name.
+    """
+
+    def __init__(self):
+        self._classes = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._classes:
+            self._classes[name] = type(name, (ClientError,), {})
+        return self._classes[name]
+
+
+class _Paginator:
+
+    def __init__(self, method):
+        self._method = method
+
+    def paginate(self, **kwargs):
+        yield self._method(**kwargs)
+
+
+class _Waiter:
+
+    def wait(self, **kwargs):
+        pass
+
+
+class _FakeClient:
+    service = None
+
+    def __init__(self, world):
+        self.world = world
+        self.exceptions = _Exceptions()
+
+    def _error(self, code, operation):
+        return getattr(self.exceptions, code)({'Error': {'Code': code, 'Message': code}}, operation)
+
+    def get_paginator(self, operation):
+        return _Paginator(getattr(self, operation))
+
+    def get_waiter(self, name):
+        return _Waiter()
+
+
+class FakeS3(_FakeClient):
+    service = 's3'
+
+    def _bucket(self, name):
+        return self.world.buckets.setdefault(name, {})
+
+    def _store(self, bucket, key, body, last_modified=None):
+        self._bucket(bucket)[key] = {
+            'Key': key,
+            'Body': body,
+            'Size': len(body),
+            'ETag': f'"{hashlib.md5(body).hexdigest()}"',
+            'LastModified': last_modified or datetime.datetime.now(datetime.timezone.utc)
+        }
+        if self.world.notifications.get(bucket, {}).get('QueueConfigurations'):
+            self.world.database.capture(bucket, key)
+
+    @_api
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter=None, **kwargs):
+        keys = sorted(key for key in self._bucket(Bucket) if key.startswith(Prefix) and key > (StartAfter or ''))
+        return {'Contents': [
+            {name: value for name, value in self._bucket(Bucket)[key].items() if name != 'Body'} for key in keys
+        ]}
+
+    @_api
+    def get_object(self, Bucket, Key):
+        if Key not in self._bucket(Bucket):
+            raise self._error('NoSuchKey', 'GetObject')
+        return {'Body': io.BytesIO(self._bucket(Bucket)[Key]['Body'])}
+
+    @_api
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._store(Bucket, Key, Body.encode('utf-8') if isinstance(Body, str) else Body)
+        return {}
+
+    @_api
+    def delete_object(self, Bucket, Key):
+        self._bucket(Bucket).pop(Key, None)
+        return {}
+
+    @_api
+    def copy_object(self, CopySource, Bucket, Key, **kwargs):
+        source = self._bucket(CopySource['Bucket'])[CopySource['Key']]
+        self._store(Bucket, Key, source['Body'])
+        return {}
+
+    @_api
+    def copy(self, CopySource, Bucket, Key, Config=None, **kwargs):
+        source = self._bucket(CopySource['Bucket'])[CopySource['Key']]
+        self._store(Bucket, Key, source['Body'])
+
+    @_api
+    def put_bucket_notification_configuration(self, Bucket, NotificationConfiguration):
+        self.world.notifications[Bucket] = NotificationConfiguration
+        return {}
+
+    @_api
+    def get_bucket_notification_configuration(self, Bucket):
+        return dict(self.world.notifications.get(Bucket, {}))
+
+
+class FakeSQS(_FakeClient):
+    service = 'sqs'
+
+    @_api
+    def get_queue_url(self, QueueName):
+        if QueueName not in self.world.queues:
+            raise self._error('AWS.SimpleQueueService.NonExistentQueue', 'GetQueueUrl')
+        return {'QueueUrl': f"https://sqs.local/{QueueName}"}
+
+    @_api
+    def list_queues(self, **kwargs):
+        return {'QueueUrls': [f"https://sqs.local/{name}" for name in self.world.queues]}
+
+    @_api
+    def get_queue_attributes(self, QueueUrl, AttributeNames):
+        name = QueueUrl.rsplit('/', 1)[-1]
+        attributes = {
+            'ApproximateNumberOfMessages': str(self.world.queues[name]),
+            'ApproximateNumberOfMessagesNotVisible': '0',
+            'ApproximateNumberOfMessagesDelayed': '0',
+            'QueueArn': f"arn:aws:sqs:local:000000000000:{name}"
+        }
+        if 'All' in AttributeNames:
+            return {'Attributes': attributes}
+        return {'Attributes': {name: attributes[name] for name in AttributeNames}}
+
+    @_api
+    def purge_queue(self, QueueUrl):
+        self.world.queues[QueueUrl.rsplit('/', 1)[-1]] = 0
+        return {}
+
+
+class FakeLambda(_FakeClient):
+    service = 'lambda'
+
+    def _function(self, name):
+        if name not in self.world.functions:
+            raise self._error('ResourceNotFoundException', 'GetFunction')
+        return self.world.functions[name]
+
+    @_api
+    def get_function_configuration(self, FunctionName, Qualifier=None):
+        function = self._function(FunctionName)
+        environment = function['Environment']
+        if Qualifier not in (None, '$LATEST'):
+            # 'Versions' holds the environment each published version or alias was published with
+            if Qualifier not in function.get('Versions', {}):
+                raise self._error('ResourceNotFoundException', 'GetFunctionConfiguration')
+            environment = function['Versions'][Qualifier]
+        return {
+            'FunctionName': FunctionName,
+            'MemorySize': function['MemorySize'],
+            'Environment': {'Variables': dict(environment)},
+            'LastUpdateStatus': 'Successful'
+        }
+
+    @_api
+    def update_function_configuration(self, FunctionName, Environment=None, MemorySize=None):
+        function = self._function(FunctionName)
+        if Environment is not None:
+            function['Environment'] = dict(Environment['Variables'])
+        if MemorySize is not None:
+            function['MemorySize'] = MemorySize
+        return {'FunctionName': FunctionName, 'LastUpdateStatus': 'InProgress'}
+
+    @_api
+    def get_function_concurrency(self, FunctionName):
+        reserved = self._function(FunctionName).get('ReservedConcurrency')
+        return {} if reserved is None else {'ReservedConcurrentExecutions': reserved}
+
+    @_api
+    def put_function_concurrency(self, FunctionName, ReservedConcurrentExecutions):
+        self._function(FunctionName)['ReservedConcurrency'] = ReservedConcurrentExecutions
+        return {'ReservedConcurrentExecutions': ReservedConcurrentExecutions}
+
+    @_api
+    def delete_function_concurrency(self, FunctionName):
+        self._function(FunctionName).pop('ReservedConcurrency', None)
+        return {}
+
+    @_api
+    def get_provisioned_concurrency_config(self, FunctionName, Qualifier):
+        provisioned = self._function(FunctionName).get('Provisioned', {}).get(Qualifier)
+        if provisioned is None:
+            raise self._error('ProvisionedConcurrencyConfigNotFoundException', 'GetProvisionedConcurrencyConfig')
+        return {'RequestedProvisionedConcurrentExecutions': provisioned, 'Status': 'READY'}
+
+    @_api
+    def put_provisioned_concurrency_config(self, FunctionName, Qualifier, ProvisionedConcurrentExecutions):
+        self._function(FunctionName).setdefault('Provisioned', {})[Qualifier] = ProvisionedConcurrentExecutions
+        return {'Status': 'IN_PROGRESS'}
+
+    @_api
+    def delete_provisioned_concurrency_config(self, FunctionName, Qualifier):
+        if self._function(FunctionName).get('Provisioned', {}).pop(Qualifier, None) is None:
+            raise self._error('ProvisionedConcurrencyConfigNotFoundException', 'DeleteProvisionedConcurrencyConfig')
+        return {}
+
+    @_api
+    def list_event_source_mappings(self, FunctionName):
+        return {'EventSourceMappings': [
+            {'UUID': uuid, 'State': 'Enabled' if enabled else 'Disabled'}
+            for uuid, enabled in self.world.event_source_mappings.items()
+        ]}
+
+    @_api
+    def update_event_source_mapping(self, UUID, Enabled):
+        self.world.event_source_mappings[UUID] = Enabled
+        return {'UUID': UUID}
+
+
+class FakeRDS(_FakeClient):
+    service = 'rds'
+
+    def _cluster(self, identifier, operation):
+        if identifier not in self.world.clusters:
+            raise self._error('DBClusterNotFoundFault', operation)
+        return self.world.clusters[identifier]
+
+    def _describe(self, identifier, cluster):
+        return dict(cluster, DBClusterIdentifier=identifier, DBClusterMembers=[
+            {'DBInstanceIdentifier': name, 'IsClusterWriter': instance['writer']}
+            for name, instance in self.world.instances.items() if instance['cluster'] == identifier
+        ])
+
+    @_api
+    def describe_db_clusters(self, DBClusterIdentifier=None):
+        if DBClusterIdentifier is not None:
+            return {'DBClusters': [self._describe(DBClusterIdentifier,
+                                                  self._cluster(DBClusterIdentifier, 'DescribeDBClusters'))]}
+        return {'DBClusters': [self._describe(name, cluster) for name, cluster in self.world.clusters.items()]}
+
+    def _restore(self, identifier, operation, **kwargs):
+        if identifier in self.world.clusters:
+            raise self._error('DBClusterAlreadyExistsFault', operation)
+        self.world.clusters[identifier] = {
+            'Status': 'available',
+            'ClusterCreateTime': datetime.datetime.now(datetime.timezone.utc),
+            'EngineVersion': kwargs.get('EngineVersion', '11.7')
+        }
+        return {'DBCluster': self._describe(identifier, self.world.clusters[identifier])}
+
+    @_api
+    def restore_db_cluster_from_snapshot(self, DBClusterIdentifier, **kwargs):
+        return self._restore(DBClusterIdentifier, 'RestoreDBClusterFromSnapshot', **kwargs)
+
+    @_api
+    def restore_db_cluster_to_point_in_time(self, DBClusterIdentifier, SourceDBClusterIdentifier, **kwargs):
+        self._cluster(SourceDBClusterIdentifier, 'RestoreDBClusterToPointInTime')
+        return self._restore(DBClusterIdentifier, 'RestoreDBClusterToPointInTime', **kwargs)
+
+    @_api
+    def modify_db_cluster(self, DBClusterIdentifier, **kwargs):
+        return {'DBCluster': self._describe(DBClusterIdentifier, self._cluster(DBClusterIdentifier, 'ModifyDBCluster'))}
+
+    @_api
+    def delete_db_cluster(self, DBClusterIdentifier, **kwargs):
+        self._cluster(DBClusterIdentifier, 'DeleteDBCluster')
+        if any(instance['cluster'] == DBClusterIdentifier for instance in self.world.instances.values()):
+            raise self._error('InvalidDBClusterStateFault', 'DeleteDBCluster')
+        del self.world.clusters[DBClusterIdentifier]
+        return {}
+
+    @_api
+    def create_db_instance(self, DBInstanceIdentifier, DBInstanceClass, DBClusterIdentifier, **kwargs):
+        self._cluster(DBClusterIdentifier, 'CreateDBInstance')
+        if DBInstanceIdentifier in self.world.instances:
+            raise self._error('DBInstanceAlreadyExistsFault', 'CreateDBInstance')
+        self.world.instances[DBInstanceIdentifier] = {
+            'cluster': DBClusterIdentifier,
+            'class': DBInstanceClass,
+            'created': datetime.datetime.now(datetime.timezone.utc),
+            'writer': not any(instance['cluster'] == DBClusterIdentifier for instance in self.world.instances.values())
+        }
+        return {}
+
+    @_api
+    def delete_db_instance(self, DBInstanceIdentifier, **kwargs):
+        if self.world.instances.pop(DBInstanceIdentifier, None) is None:
+            raise self._error('DBInstanceNotFoundFault', 'DeleteDBInstance')
+        return {}
+
+    @_api
+    def describe_db_instances(self, Filters=None, **kwargs):
+        clusters = set()
+        for db_filter in Filters or []:
+            if db_filter['Name'] == 'db-cluster-id':
+                clusters.update(db_filter['Values'])
+        return {'DBInstances': [
+            {'DBInstanceIdentifier': name, 'DBInstanceStatus': 'available', 'DBInstanceClass': instance['class'],
+             'InstanceCreateTime': instance['created']}
+            for name, instance in self.world.instances.items() if not clusters or instance['cluster'] in clusters
+        ]}
+
+
+class FakeSecretsManager(_FakeClient):
+    service = 'secretsmanager'
+
+    @_api
+    def get_secret_value(self, SecretId):
+        if SecretId not in self.world.secrets:
+            raise self._error('ResourceNotFoundException', 'GetSecretValue')
+        return {'SecretString': json.dumps(self.world.secrets[SecretId])}
+
+
+class FakeCloudWatch(_FakeClient):
+    service = 'cloudwatch'
+
+    @_api
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, **kwargs):
+        return {'MetricDataResults': [
+            {'Id': query['Id'], 'Values': [self._value(query, StartTime, EndTime)]} for query in MetricDataQueries
+        ]}
+
+    def _value(self, query, start_time, end_time):
+        if self.world.capacity is None:
+            return round(self.world.random.uniform(0, 100), 3)
+        # a pipeline that keeps up with 'capacity' files a second, and not one more
+        start, end = (moment.replace(tzinfo=datetime.timezone.utc).timestamp() for moment in (start_time, end_time))
+        captured = sum(1 for _, inserted_at in self.world.database.json_data if start <= inserted_at <= end)
+        seconds = max(end - start, 1)
+        load = captured / seconds / self.world.capacity
+        return {
+            'CPUUtilization': round(min(load, 1) * 100, 3),
+            'CommitLatency': round(2 + 10 * load, 3),
+            'ApproximateAgeOfOldestMessage': round(60 * max(load - 1, 0), 3),
+            'Throttles': round(max(load - 1, 0) * self.world.capacity * seconds),
+            'Errors': 0
+        }.get(query['MetricStat']['Metric']['MetricName'], round(self.world.random.uniform(0, 100), 3))
+
+    @_api
+    def describe_alarm_history(self, **kwargs):
+        return {'AlarmHistoryItems': []}
+
+    @_api
+    def describe_alarms(self, AlarmNames=None, **kwargs):
+        return {'MetricAlarms': [{'AlarmName': name, 'StateValue': 'OK'} for name in AlarmNames or []]}
+
+
+class FakeStepFunctions(_FakeClient):
+    service = 'stepfunctions'
+
+    @_api
+    def list_state_machines(self, **kwargs):
+        return {'stateMachines': [
+            {'name': name, 'stateMachineArn': f"arn:aws:states:local:000000000000:stateMachine:{name}"}
+            for name in self.world.state_machines
+        ]}
+
+    @_api
+    def list_executions(self, stateMachineArn, statusFilter=None, **kwargs):
+        running = self.world.running_executions.get(stateMachineArn.rsplit(':', 1)[-1], set())
+        if statusFilter not in (None, 'RUNNING'):
+            return {'executions': []}
+        return {'executions': [{'name': name, 'status': 'RUNNING'} for name in sorted(running)]}
+
+
+def statement_text(query):
+    """
+    The text of a statement, psycopg2.sql compositions rendered the way the
+    server would see them (without a connection to quote with).
+    """
+    if isinstance(query, str):
+        return query
+    if isinstance(query, sql.Composed):
+        return ''.join(statement_text(part) for part in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return '.'.join(f'"{name}"' for name in query.strings)
+    if isinstance(query, sql.Placeholder):
+        return '%s'
+    return repr(query.wrapped)
+
+
+class FakeDatabase:
+    """
+    Stands in for src.rds.RDS.  capture.json_data is a list of (source key,
+    insert time) rows, one per captured file, whose json_data_id is their
+    position from 1; it is the one capture table.  The statements the load test
+    runs are answered from it, anything else raises, so a new query has to be
+    taught to the fake rather than quietly getting no rows.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.json_data = []
+        self.baseline_rows = 1000000
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def capture(self, bucket, key):
+        with self.world.lock:
+            self.json_data.append((f"s3://{bucket}/{key}", time.time()))
+
+    def _answer(self, query):
+        text = statement_text(query)
+        inserts = len(self.json_data)
+        if 'json_data' in text and 'n_tup_ins' in text:
+            return [{"inserts": inserts, "estimated_rows": self.baseline_rows + inserts}]
+        if 'information_schema.columns' in text:
+            return [{"column_name": column} for column in ('json_data_id', 'source_key', 'create_date')]
+        if text == 'select max("json_data_id") from capture.json_data':
+            return [{"max": inserts or None}]
+        if 'i.indisprimary' in text:
+            return [{"table_name": "json_data", "key_column": "json_data_id"}]
+        if "relkind in ('r', 'p')" in text:
+            return [{"table_name": "json_data", "estimated_rows": self.baseline_rows + inserts}]
+        if text == ('select max("json_data_id") as max_key, max("json_data_id") is null as empty '
+                    'from "capture"."json_data"'):
+            return [{"max_key": inserts or None, "empty": not inserts}]
+        if 'pg_extension' in text:
+            return [{"installed": True}]
+        if 'pg_stat_statements_reset()' in text:
+            return [{"pg_stat_statements_reset": None}]
+        if 'from pg_stat_statements' in text:
+            return [{"userid": 10, "queryid": 1, "query": "insert into capture.json_data values ($1, $2)",
+                     "calls": inserts, "total_time": inserts * 1.5, "rows": inserts, "shared_blks_hit": inserts * 4,
+                     "shared_blks_read": inserts}]
+        if 'pg_statio_user_tables' in text:
+            return [{"table_name": "capture.json_data", "seq_scan": 1, "seq_tup_read": 0, "idx_scan": inserts,
+                     "idx_tup_fetch": inserts, "n_tup_ins": inserts, "n_tup_upd": 0, "n_tup_del": 0,
+                     "n_live_tup": self.baseline_rows + inserts, "n_dead_tup": 0, "vacuums": 0, "analyzes": 0,
+                     "heap_blks_hit": inserts * 4, "heap_blks_read": inserts, "idx_blks_hit": inserts,
+                     "idx_blks_read": 0}]
+        if 'pg_stat_bgwriter' in text:
+            return [{"checkpoints_timed": 0, "checkpoints_req": 0, "buffers_checkpoint": inserts,
+                     "buffers_backend": 0, "buffers_alloc": inserts}]
+        if 'pg_stat_user_tables' in text:
+            return [{"table_name": "json_data", "live_rows": self.baseline_rows + inserts, "inserts": inserts,
+                     "updates": 0, "deletes": 0, "dead_rows": 0}]
+        raise NotImplementedError(f"the fake database can't answer {text}")
+
+    def execute_sql(self, sql, params=None):
+        return tuple(self._answer(sql)[0].values())
+
+    def execute_batch(self, queries):
+        return {name: self._answer(query) for name, query in queries.items()}
+
+    def execute_update(self, sql, params=None):
+        text = statement_text(sql)
+        if text == 'create extension if not exists pg_stat_statements' or text == 'analyze "capture"."json_data"':
+            return 0
+        if text == 'delete from "capture"."json_data" where "json_data_id" > %s':
+            with self.world.lock:
+                deleted = max(len(self.json_data) - (params[0] or 0), 0)
+                del self.json_data[len(self.json_data) - deleted:]
+            return deleted
+        if text == 'delete from "capture"."json_data"':
+            with self.world.lock:
+                deleted = len(self.json_data)
+                self.json_data.clear()
+            return deleted
+        raise NotImplementedError(f"the fake database can't run {text}")
+
+    def stream(self, sql, params=None, itersize=None):
+        text = statement_text(sql)
+        if not text.startswith('select "source_key", extract(epoch from min("create_date")) from capture.json_data '
+                               'where "json_data_id" > %s'):
+            raise NotImplementedError(f"the fake database can't stream {text}")
+        first_seen = {}
+        for key, inserted_at in list(self.json_data)[params[0]:]:
+            if key not in first_seen:
+                first_seen[key] = inserted_at
+        yield from first_seen.items()
+
+    def alter_permissions(self, sql):
+        if not sql.startswith('alter user '):
+            raise NotImplementedError(f"the fake database can't run {sql}")
+
+
+class World:
+    """
+    The state behind all the fakes.
+    """
+
+    def __init__(self, latency=0.0, seed=0):
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.buckets = {}
+        self.notifications = {}
+        self.queues = {}
+        self.functions = {}
+        self.event_source_mappings = {}
+        self.clusters = {}
+        self.instances = {}
+        self.secrets = {}
+        self.state_machines = set()
+        # files a second the pipeline can take, None for random metrics
+        self.capacity = None
+        # state machine name -> names of its running executions
+        self.running_executions = {}
+        self.database = FakeDatabase(self)
+        self._clients = {
+            fake.service: fake(self)
+            for fake in [FakeS3, FakeSQS, FakeLambda, FakeRDS, FakeSecretsManager, FakeCloudWatch, FakeStepFunctions]
+        }
+
+    def client(self, service, config=None):
+        return self._clients[service]
+
+    def connect(self, db_host, db_user, db_name, db_password):
+        return self.database
+
+    def seed_reference_bucket(self, bucket, objects=200, max_size=256 * 1024):
+        """
+        Fill the reference bucket with synthetic files named like the real ones.
+        """
+        names = ['TimeSeriesDescriptionList', 'TimeSeriesCorrectedData', 'FieldVisitDescriptionList',
+                 'FieldVisitReadings', 'FieldVisitData']
+        start = datetime.datetime(2020, 10, 1, tzinfo=datetime.timezone.utc)
+        for index in range(objects):
+            size = int(self.random.paretovariate(1.5) * 1024) % max_size + 1
+            body = self.random.getrandbits(8 * size).to_bytes(size, 'big')
+            key = f"{index:06d}/{self.random.choice(names)}.json"
+            self._clients['s3']._store(bucket, key, body, start + datetime.timedelta(seconds=index * 30))
+
+    def seed(self, handler):
+        """
+        Create the functions, queues, secrets, clusters and state machines the handlers expect.
+        """
+        for name in handler.LAMBDA_FUNCTIONS:
+            self.functions[name] = {'MemorySize': 512, 'Environment': {
+                'DB_HOST': 'nwcapture-qa.local', 'DB_PASSWORD': 'real-password'}}
+        self.functions[handler.CAPTURE_TRIGGER] = {'MemorySize': 128, 'Environment': {}}
+        self.event_source_mappings['trigger-mapping'] = False
+        for queue_name in [handler.CAPTURE_TRIGGER_QUEUE, handler.ERROR_QUEUE]:
+            self.queues[queue_name] = 0
+        real = {'DATABASE_ADDRESS': 'nwcapture-qa.local', 'SCHEMA_OWNER_PASSWORD': 'real-password',
+                'SCHEMA_OWNER_USERNAME': 'capture_owner', 'DATABASE_NAME': 'nwcapture-qa',
+                'KMS_KEY_ID': 'local-key', 'DB_SUBGROUP_NAME': 'local-subnets', 'VPC_SECURITY_GROUP_ID': 'sg-local'}
+        self.secrets[handler.NWCAPTURE_REAL] = real
+        self.secrets[handler.NWCAPTURE_LOAD] = dict(real, DATABASE_ADDRESS='nwcapture-load.local',
+                                                    SCHEMA_OWNER_PASSWORD='Password123', DATABASE_NAME='nwcapture-load')
+        self.clusters[handler.DB[handler.stage]] = {
+            'Status': 'available', 'ClusterCreateTime': datetime.datetime(2020, 1, 1), 'EngineVersion': '11.7'}
+        self.notifications[handler.REAL_BUCKET] = {'QueueConfigurations': [{
+            'QueueArn': f"arn:aws:sqs:local:000000000000:{handler.CAPTURE_TRIGGER_QUEUE}",
+            'Events': ['s3:ObjectCreated:*'],
+            'Filter': {'Key': {'FilterRules': [{'Name': 'suffix', 'Value': '.json'}]}}
+        }]}
+        self.state_machines.update([handler.CAPTURE_STATE_MACHINE, handler.LOAD_TEST_STATE_MACHINE])
+
+
+def install(world=None):
+    """
+    Point src.clients at a World.  Call before the handlers first use a client.
+    :return: the world
+    """
+    world = world or World()
+    clients.set_factories(world.client, world.connect)
+    return world
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from harness import fakes
+from src import handler
+
+"""
+Run the load test end to end on this machine, against the in-process fakes in
+harness/fakes.py, stepping through the handlers in the order the aqtsLoadTest
+state machine does (serverless.yml).  Useful for trying out a change to the
+handlers, or the profiles in an input, without deploying or restoring a cluster.
+
+    python -m harness.run_local --objects 500 --input '{"dataset": {"fraction": 0.5}}'
+
+Prints how long each step took and the stored results.
+"""
+
+# Guard against a poll loop that never settles
+MAX_POLLS = 50
+
+
+class FakeContext:
+
+    def __init__(self, timeout_seconds=900):
+        self._deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self._deadline - time.time()) * 1000), 0)
+
+
+class Execution:
+    """
+    The execution's input, which steps add their results to, and the time each step took.
+    """
+
+    def __init__(self, handler, state):
+        self.handler = handler
+        self.state = state
+        self.timings = []
+
+    def task(self, name, function_name, result_path=None, event=None):
+        started_at = time.time()
+        result = getattr(self.handler, function_name)(dict(event or self.state), FakeContext())
+        self.timings.append((name, time.time() - started_at))
+        if result_path is not None:
+            self.state[result_path] = result
+        return result
+
+    def poll(self, name, function_name, result_path, done, wait=None):
+        for _ in range(MAX_POLLS):
+            result = self.task(name, function_name, result_path)
+            if done(result):
+                return
+            if wait is not None:
+                time.sleep(wait(result))
+        raise Exception(f"{name} did not settle after {MAX_POLLS} polls")
+
+
+def _delete_db(execution):
+    execution.task('DeleteDbInstance', 'delete_db_instance')
+    execution.poll('CheckDbInstancesDeleted', 'check_load_db', 'loadDb', lambda status: status["instancesDeleted"])
+    execution.task('DeleteDbCluster', 'delete_db_cluster')
+    execution.task('ReleasePipelineAfterDelete', 'release_pipeline')
+
+
+def _failure(error):
+    # what a Catch with ResultPath $.failure adds to the state
+    return {"Error": type(error).__name__, "Cause": str(error)}
+
+
+def _test(execution):
+    state = execution.state
+    if "dbRestore" not in state:
+        execution.task('ResetToBaseline', 'reset_to_baseline', 'baselineReset')
+    execution.task('FalsifySecrets', 'falsify_secrets')
+    execution.task('ModifySchemaOwnerPassword', 'modify_schema_owner_password')
+    execution.task('AddNotificationToTestBucket', 'add_notification_to_test_bucket')
+    execution.task('PurgeQueues', 'purge_queues', 'queuePurge')
+    execution.poll('CheckQueuesDrained', 'check_queues_drained', 'queueDrain', lambda drain: drain["drained"])
+    execution.task('EnableTrigger', 'enable_trigger')
+    execution.task('ApplyConcurrencyProfile', 'apply_concurrency_profile', 'concurrencyProfile')
+    execution.poll('CheckConcurrencyProfile', 'check_concurrency_profile', 'concurrencyReady',
+                   lambda status: status["ready"])
+    execution.task('PreTest', 'pre_test')
+    # RunLoad's branches each start from a copy of the state, the sampler's results stay in its own
+    sampler = dict(state)
+
+    if state.get("saturation") is not None:
+        execution.poll('SaturationStep', 'saturation_step', 'saturationState', lambda search: search["done"])
+    elif state.get("replay") is not None:
+        execution.poll('ReplayS3', 'replay_s3', 'replayState', lambda progress: progress["done"],
+                       wait=lambda progress: progress["waitSeconds"])
+    else:
+        plan = execution.task('PlanCopyShards', 'plan_copy_shards', 'copy')
+        for shard in plan["shards"]:
+            execution.task('CopyS3', 'copy_s3', event={
+                "shard": shard,
+                "copyId": plan["copyId"],
+                "createdAt": plan["createdAt"],
+                "dataset": plan["dataset"],
+                "maxWorkers": state.get("maxWorkers"),
+                "run": state["run"],
+                "namespace": state["loadDb"]["namespace"]
+            })
+        execution.task('SummarizeCopy', 'summarize_copy', 'copy')
+
+    def _finished(completion):
+        sampler["sampling"] = execution.task('SampleThroughput', 'sample_throughput', event=sampler)
+        return completion["complete"]
+
+    execution.poll('WaitForTestToFinish', 'wait_for_test_to_finish', 'completion', _finished)
+    execution.task('RunIntegrationTests', 'run_integration_tests')
+    execution.task('CompareResults', 'compare_results', 'comparison')
+
+
+def _clean_up(execution):
+    execution.task('RemoveNotificationFromTestBucket', 'remove_notification_from_test_bucket')
+    execution.task('RestoreSecrets', 'restore_secrets')
+    execution.task('RestoreConcurrencyProfile', 'restore_concurrency_profile')
+    execution.task('DisableTrigger', 'disable_trigger_if_real_db_is_off')
+    execution.task('ReleasePipeline', 'release_pipeline')
+    if execution.state["loadDb"]["keepWarm"]:
+        execution.task('KeepWarm', 'keep_warm')
+    else:
+        _delete_db(execution)
+
+
+def run(handler, state):
+    """
+    :raises: the failure of a step the state machine catches, once the run is cleaned up after it
+    """
+    execution = Execution(handler, state)
+    if state.get("teardown") is not None:
+        execution.poll('AcquirePipelineForTeardown', 'acquire_pipeline', 'pipelineLease',
+                       lambda lease: lease["acquired"])
+        _delete_db(execution)
+        return execution
+    loaded = execution.task('CheckExistingDb', 'check_load_db', 'loadDb')
+    if not loaded["reusable"]:
+        execution.task('RestoreDbCluster', 'restore_db_cluster', 'dbRestore')
+        try:
+            execution.poll('CheckDbCluster', 'check_load_db', 'loadDb', lambda status: status["clusterAvailable"])
+            execution.task('ModifyDbCluster', 'modify_db_cluster')
+            execution.task('CreateDbInstance', 'create_db_instance')
+            execution.poll('CheckDbInstances', 'check_load_db', 'loadDb',
+                           lambda status: status["instancesAvailable"])
+        except Exception as error:
+            state["failure"] = _failure(error)
+            _delete_db(execution)
+            raise
+    execution.poll('AcquirePipeline', 'acquire_pipeline', 'pipelineLease', lambda lease: lease["acquired"])
+    try:
+        _test(execution)
+    except Exception as error:
+        state["failure"] = _failure(error)
+        _clean_up(execution)
+        raise
+    _clean_up(execution)
+    return execution
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the load test against in-process fakes')
+    parser.add_argument('--objects', type=int, default=200, help='files to seed the reference bucket with')
+    parser.add_argument('--input', default='{}', help='the state machine input, as JSON')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each fake AWS call takes')
+    parser.add_argument('--capacity', type=float, help='files a second the fake pipeline keeps up with')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('AWS_DEPLOYMENT_REGION', 'us-west-2')
+    world = fakes.install(fakes.World(latency=args.latency))
+    world.capacity = args.capacity
+    world.seed(handler)
+    world.seed_reference_bucket(handler.SRC_BUCKET, args.objects)
+
+    state = json.loads(args.input)
+    state["run"] = {"id": f"local-{time.strftime('%Y%m%dT%H%M%S')}", "startedAt": time.strftime('%Y-%m-%dT%H:%M:%SZ')}
+    world.running_executions[handler.LOAD_TEST_STATE_MACHINE] = {state["run"]["id"]}
+    execution = run(handler, state)
+
+    for name, seconds in execution.timings:
+        print(f"{name:<36}{seconds:>10.3f}s")
+    results = world.buckets.get(handler.STATE_BUCKET, {}).get(handler._resources(state)["resultsKey"])
+    if results is not None:
+        print(json.dumps(json.loads(results['Body']), indent=2, default=str))
+    print(f"{sum(world.calls.values())} fake AWS calls")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import json
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Alarm history for the results report.  The history of every alarm is swept
+once for the whole test window and filtered down to our alarms locally, rather
+than asking for each alarm in turn.
+"""
+ALARM_STATE = 'ALARM'
+
+# describe_alarms takes at most this many alarm names per call
+MAX_ALARM_NAMES_PER_CALL = 100
+
+
+def get_alarm_history(cloudwatch_client, alarm_names, start_time, end_time):
+    """
+    :return: dict of alarm name -> state update history items, oldest first
+    """
+    history = {alarm_name: [] for alarm_name in alarm_names}
+    paginator = cloudwatch_client.get_paginator('describe_alarm_history')
+    pages = paginator.paginate(
+        AlarmTypes=[
+            'MetricAlarm',
+        ],
+        HistoryItemType='StateUpdate',
+        StartDate=start_time,
+        EndDate=end_time,
+        ScanBy='TimestampAscending'
+    )
+    swept = 0
+    for page in pages:
+        for item in page['AlarmHistoryItems']:
+            swept += 1
+            if item['AlarmName'] in history:
+                history[item['AlarmName']].append(item)
+    logger.info(f"swept {swept} alarm history items for {len(alarm_names)} alarms")
+    return history
+
+
+def get_alarm_states(cloudwatch_client, alarm_names):
+    """
+    :return: dict of alarm name -> current state value
+    """
+    alarm_names = list(alarm_names)
+    states = {}
+    paginator = cloudwatch_client.get_paginator('describe_alarms')
+    for index in range(0, len(alarm_names), MAX_ALARM_NAMES_PER_CALL):
+        for page in paginator.paginate(AlarmNames=alarm_names[index:index + MAX_ALARM_NAMES_PER_CALL],
+                                       AlarmTypes=['MetricAlarm']):
+            for alarm in page['MetricAlarms']:
+                states[alarm['AlarmName']] = alarm['StateValue']
+    return states
+
+
+def _states(item):
+    """
+    :return: (old state, new state) of a state update history item
+    """
+    try:
+        data = json.loads(item['HistoryData'])
+        return data['oldState']['stateValue'], data['newState']['stateValue']
+    except (KeyError, TypeError, ValueError):
+        # fall back on the summary, 'Alarm updated from OK to ALARM'
+        words = item['HistorySummary'].split()
+        return words[-3], words[-1]
+
+
+def summarize(items, current_state, start_time, end_time):
+    """
+    Work out how long the alarm spent in ALARM during the window.  The state at
+    the start of the window is the old state of the first update, or the
+    current state if the alarm never changed during the window.
+    :return: the alarm's result for the report
+    """
+    state = _states(items[0])[0] if items else current_state
+    since = start_time
+    seconds_in_alarm = 0.0
+    went_to_alarm = False
+    for item in items:
+        timestamp = item['Timestamp'].replace(tzinfo=None)
+        new_state = _states(item)[1]
+        if state == ALARM_STATE:
+            seconds_in_alarm += (timestamp - since).total_seconds()
+        if new_state == ALARM_STATE:
+            went_to_alarm = True
+        state = new_state
+        since = max(timestamp, start_time)
+    if state == ALARM_STATE:
+        seconds_in_alarm += (end_time - since).total_seconds()
+    return {
+        "result": "FAIL" if went_to_alarm or seconds_in_alarm > 0 else "PASS",
+        "secondsInAlarm": round(max(seconds_in_alarm, 0), 3),
+        "transitions": len(items),
+        "history": [item['HistorySummary'] for item in items]
+    }
+
+
+def collect(cloudwatch_client, alarm_names, start_time, end_time):
+    """
+    :param start_time: naive UTC datetime
+    :param end_time: naive UTC datetime
+    :return: dict of alarm name -> result for the report
+    """
+    history = get_alarm_history(cloudwatch_client, alarm_names, start_time, end_time)
+    current_states = get_alarm_states(cloudwatch_client, alarm_names)
+    return {
+        alarm_name: summarize(items, current_states.get(alarm_name), start_time, end_time)
+        for alarm_name, items in history.items()
+    }
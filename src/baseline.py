@@ -0,0 +1,127 @@
+from psycopg2 import sql
+from psycopg2 import IntegrityError
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Baseline of the capture tables for a load test cluster that is kept warm
+between runs.  The baseline records, for every capture table, the highest
+value of its integer primary key (and the planner's row count), so a reset can
+delete exactly the rows a run added instead of restoring the cluster again.
+Tables without a single column integer primary key can only be reset if they
+were empty at the baseline, in which case everything in them is deleted; a
+reset refuses to go on if one of them had rows.
+
+A reset only deletes: rows from before the baseline that a run updated stay the
+way the run left them.  The updates counted on each table since the baseline
+are reported with every reset, so a run on a cluster that has drifted can be
+told apart.
+"""
+SCHEMA = 'capture'
+
+KEY_COLUMNS_SQL = """
+select c.relname as table_name, a.attname as key_column
+from pg_index i
+join pg_class c on c.oid = i.indrelid
+join pg_namespace n on n.oid = c.relnamespace
+join pg_attribute a on a.attrelid = i.indrelid and a.attnum = i.indkey[0]
+where n.nspname = 'capture' and i.indisprimary and i.indnatts = 1
+and a.atttypid in ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+"""
+
+TABLES_SQL = """
+select c.relname as table_name, c.reltuples::bigint as estimated_rows
+from pg_class c
+join pg_namespace n on n.oid = c.relnamespace
+where n.nspname = 'capture' and c.relkind in ('r', 'p')
+"""
+
+UPDATES_SQL = """
+select relname as table_name, n_tup_upd as updates
+from pg_stat_user_tables
+where schemaname = 'capture'
+"""
+
+# A delete blocked by a foreign key is tried again after the other tables, this many passes at most
+MAX_RESET_PASSES = 5
+
+
+def record(rds):
+    """
+    :return: dict of table -> {keyColumn, maxKey, empty, estimatedRows, updates}
+    """
+    catalog = rds.execute_batch({"keys": KEY_COLUMNS_SQL, "tables": TABLES_SQL, "updates": UPDATES_SQL})
+    key_columns = {row["table_name"]: row["key_column"] for row in catalog["keys"]}
+    updates = {row["table_name"]: row["updates"] for row in catalog["updates"]}
+    tables = {row["table_name"]: {"keyColumn": key_columns.get(row["table_name"]), "maxKey": None,
+                                  "estimatedRows": row["estimated_rows"], "updates": updates.get(row["table_name"])}
+              for row in catalog["tables"]}
+    # max of a primary key is an index lookup, so this is cheap even on capture.json_data,
+    # and the tables without one only need to say whether they are empty
+    queries = {}
+    for name, table in tables.items():
+        if table["keyColumn"] is not None:
+            query = sql.SQL("select max({}) as max_key, max({}) is null as empty from {}").format(
+                sql.Identifier(table["keyColumn"]), sql.Identifier(table["keyColumn"]), sql.Identifier(SCHEMA, name))
+        else:
+            query = sql.SQL("select null as max_key, not exists (select 1 from {}) as empty").format(
+                sql.Identifier(SCHEMA, name))
+        queries[name] = query
+    if queries:
+        for name, rows in rds.execute_batch(queries).items():
+            tables[name]["maxKey"] = rows[0]["max_key"]
+            tables[name]["empty"] = rows[0]["empty"]
+    logger.info(f"recorded the baseline of {len(tables)} tables")
+    return tables
+
+
+def reset(rds, tables):
+    """
+    Delete the rows added since the baseline.  Deletes that a foreign key blocks
+    are retried after the other tables have been reset.
+    :raises: if a table had rows at the baseline but no key to tell the rows added since by
+    :return: dict of table -> rows deleted, and of table -> updates since the baseline
+    """
+    unresettable = sorted(name for name, table in tables.items() if not table["empty"] and table["keyColumn"] is None)
+    if unresettable:
+        raise Exception(f"Can't reset {unresettable} to the baseline, they had rows then and no integer primary key, "
+                        f"tear the warm environment down")
+    pending = {}
+    for name, table in tables.items():
+        if table["empty"]:
+            pending[name] = (sql.SQL("delete from {}").format(sql.Identifier(SCHEMA, name)), None)
+        else:
+            pending[name] = (sql.SQL("delete from {} where {} > %s").format(
+                sql.Identifier(SCHEMA, name), sql.Identifier(table["keyColumn"])), (table["maxKey"],))
+
+    deleted = {}
+    for reset_pass in range(1, MAX_RESET_PASSES + 1):
+        blocked = {}
+        for name, (statement, params) in pending.items():
+            try:
+                deleted[name] = rds.execute_update(statement, params)
+            except IntegrityError as e:
+                logger.info(f"reset of {name} is blocked by a foreign key, pass {reset_pass}: {repr(e)}")
+                blocked[name] = (statement, params)
+        if not blocked or len(blocked) == len(pending):
+            pending = blocked
+            break
+        pending = blocked
+    if pending:
+        raise Exception(f"Could not reset {sorted(pending)} to the baseline, they are blocked by foreign keys")
+
+    # refresh the planner's statistics, the results read reltuples
+    for name in deleted:
+        rds.execute_update(sql.SQL("analyze {}").format(sql.Identifier(SCHEMA, name)))
+    updated = {}
+    for row in rds.execute_batch({"updates": UPDATES_SQL})["updates"]:
+        # baselines recorded before updates were counted have none to compare with
+        since = tables.get(row["table_name"], {}).get("updates")
+        if since is not None and row["updates"] > since:
+            updated[row["table_name"]] = row["updates"] - since
+    logger.info(f"reset to the baseline {deleted}, updated since the baseline {updated}")
+    return {"deleted": deleted, "updatedSinceBaseline": updated}
@@ -0,0 +1,75 @@
+import os
+import threading
+import weakref
+
+import boto3
+
+from src.rds import get_rds
+
+"""
+Where the handlers get their AWS clients and database connections from.  By
+default these are real boto3 clients and pooled psycopg2 connections; the local
+harness (see harness/) swaps in in-process stand-ins with set_factories, so the
+whole load test can run offline.  The handlers hold lazy clients, which are only
+created (by whichever factory is set then) when first used, and are dropped
+again whenever the factories change.
+"""
+
+
+def _boto3_client(service, config=None):
+    return boto3.client(service, os.getenv('AWS_DEPLOYMENT_REGION', 'us-west-2'), config=config)
+
+
+_client_factory = _boto3_client
+_database_factory = get_rds
+_lazy_clients = weakref.WeakSet()
+
+
+def set_factories(client_factory=None, database_factory=None):
+    """
+    :param client_factory: callable taking (service name, botocore Config or None) and returning a client
+    :param database_factory: callable taking (host, user, database name, password) and returning an RDS
+    """
+    global _client_factory, _database_factory
+    _client_factory = client_factory or _boto3_client
+    _database_factory = database_factory or get_rds
+    for lazy_client in list(_lazy_clients):
+        lazy_client.reset()
+
+
+def client(service, config=None):
+    return _client_factory(service, config)
+
+
+def database(db_host, db_user, db_name, db_password):
+    return _database_factory(db_host, db_user, db_name, db_password)
+
+
+class LazyClient:
+    """
+    Stands in for a client that isn't created until something is first looked
+    up on it, and is kept from then on.
+    """
+
+    def __init__(self, service, config=None):
+        self._service = service
+        self._config = config
+        self._client = None
+        self._lock = threading.Lock()
+        _lazy_clients.add(self)
+
+    def reset(self):
+        with self._lock:
+            self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            # the copy threads share one s3 client, only one of them should create it
+            with self._lock:
+                if self._client is None:
+                    self._client = client(self._service, self._config)
+        return getattr(self._client, name)
+
+
+def lazy(service, config=None):
+    return LazyClient(service, config)
@@ -0,0 +1,197 @@
+from botocore.exceptions import ClientError
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Concurrency profiles set the memory size, reserved concurrency and provisioned
+concurrency of the pipeline functions for a run, so runs can compare settings
+against the same data set and steady state isn't mixed up with cold starts.
+The profile is passed in the step function event as 'concurrency', either the
+name of one of PROFILES or a profile of its own, for example:
+
+    "large-memory"
+    {"name": "large-memory", "functions": {"aqts-capture-raw-load": {"memorySize": 4096}}}
+    {"qualifier": "live", "default": {"provisionedConcurrency": 10},
+     "functions": {"aqts-capture-ts-loader": {"reservedConcurrency": 20}}}
+
+'default' applies to every function and 'functions' overrides it per pipeline
+stage (the function name without the -<stage>-<handler> suffix).  Provisioned
+concurrency can only be put on a published version or alias, named by
+'qualifier', so it only warms what the triggers actually invoke if they invoke
+that qualifier.  falsifySecrets points $LATEST at the load test database, a
+version published before that still has the real database's environment, so a
+qualifier has to point at a version published after falsifySecrets (and the
+triggers have to invoke it); applyConcurrencyProfile refuses one that doesn't.
+A setting of None removes it (no reserved/provisioned concurrency), a setting
+that is left out is left as deployed.
+"""
+SETTINGS = ('memorySize', 'reservedConcurrency', 'provisionedConcurrency')
+
+PROFILES = {
+    # leave everything as deployed
+    "baseline": {},
+    # double the memory (and with it the cpu) of the stages that do the transforming and loading
+    "large-memory": {
+        "functions": {
+            "aqts-capture-raw-load": {"memorySize": 1024},
+            "aqts-capture-ts-corrected": {"memorySize": 2048},
+            "aqts-capture-ts-field-visit": {"memorySize": 2048},
+            "aqts-capture-ts-loader": {"memorySize": 2048},
+            "aqts-capture-discrete-loader": {"memorySize": 2048}
+        }
+    },
+    # cap how hard each stage can hit the database
+    "throttled": {
+        "default": {"reservedConcurrency": 10}
+    }
+}
+
+
+def resolve(profile):
+    """
+    :return: the profile, with a named profile looked up and any overrides applied on top
+    """
+    if not profile:
+        return {}
+    if isinstance(profile, str):
+        profile = {"name": profile}
+    resolved = {}
+    if profile.get("name") is not None:
+        if profile["name"] not in PROFILES:
+            raise Exception(f"Unknown concurrency profile {profile['name']}, expected one of {sorted(PROFILES)}")
+        resolved = dict(PROFILES[profile["name"]], name=profile["name"])
+    for name in ('qualifier', 'default'):
+        if name in profile:
+            resolved[name] = profile[name]
+    functions = dict(resolved.get("functions") or {})
+    for stage_name, settings in (profile.get("functions") or {}).items():
+        functions[stage_name] = dict(functions.get(stage_name) or {}, **settings)
+    if functions:
+        resolved["functions"] = functions
+    return resolved
+
+
+def settings_for(profile, stage_name):
+    """
+    :return: the settings the profile asks for on one pipeline stage
+    """
+    settings = dict(profile.get("default") or {})
+    settings.update((profile.get("functions") or {}).get(stage_name) or {})
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise Exception(f"Unknown concurrency settings {sorted(unknown)} for {stage_name}, expected {SETTINGS}")
+    if 'provisionedConcurrency' in settings and not profile.get("qualifier"):
+        raise Exception(f"Provisioned concurrency for {stage_name} needs a 'qualifier' (version or alias)")
+    return settings
+
+
+def snapshot(lambda_client, function_name, qualifier=None):
+    """
+    :return: the function's current settings, so they can be put back after the run
+    """
+    configuration = lambda_client.get_function_configuration(FunctionName=function_name)
+    reserved = lambda_client.get_function_concurrency(FunctionName=function_name)
+    settings = {
+        "memorySize": configuration['MemorySize'],
+        "reservedConcurrency": reserved.get('ReservedConcurrentExecutions')
+    }
+    if qualifier:
+        settings["provisionedConcurrency"] = _provisioned_concurrency(lambda_client, function_name, qualifier)
+    return settings
+
+
+def apply(lambda_client, function_name, settings, qualifier=None, wait_for_update=None):
+    """
+    Apply the settings to one function.  Memory size is a configuration update,
+    so it waits (with wait_for_update) for any other update of the function to
+    finish first, and for its own to finish after.
+    :return: the settings that were changed
+    """
+    changed = {}
+    if 'memorySize' in settings and settings['memorySize'] is not None:
+        update_function_configuration(lambda_client, function_name, wait_for_update,
+                                      MemorySize=settings['memorySize'])
+        changed['memorySize'] = settings['memorySize']
+    if 'reservedConcurrency' in settings:
+        if settings['reservedConcurrency'] is None:
+            lambda_client.delete_function_concurrency(FunctionName=function_name)
+        else:
+            lambda_client.put_function_concurrency(
+                FunctionName=function_name,
+                ReservedConcurrentExecutions=settings['reservedConcurrency']
+            )
+        changed['reservedConcurrency'] = settings['reservedConcurrency']
+    if 'provisionedConcurrency' in settings and qualifier:
+        if not settings['provisionedConcurrency']:
+            try:
+                lambda_client.delete_provisioned_concurrency_config(FunctionName=function_name, Qualifier=qualifier)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ProvisionedConcurrencyConfigNotFoundException':
+                    raise
+        else:
+            lambda_client.put_provisioned_concurrency_config(
+                FunctionName=function_name,
+                Qualifier=qualifier,
+                ProvisionedConcurrentExecutions=settings['provisionedConcurrency']
+            )
+        changed['provisionedConcurrency'] = settings['provisionedConcurrency']
+    logger.info(f"applied {changed} to {function_name}")
+    return changed
+
+
+def provisioned_status(lambda_client, function_name, qualifier):
+    """
+    :return: READY, IN_PROGRESS or FAILED, or None if the function has no provisioned concurrency
+    """
+    try:
+        response = lambda_client.get_provisioned_concurrency_config(FunctionName=function_name, Qualifier=qualifier)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ProvisionedConcurrencyConfigNotFoundException':
+            return None
+        raise
+    if response['Status'] == 'FAILED':
+        logger.info(f"provisioned concurrency of {function_name}:{qualifier} failed {response.get('StatusReason')}")
+    return response['Status']
+
+
+def same_environment(lambda_client, function_name, qualifier):
+    """
+    :return: whether the qualifier runs with the environment $LATEST has now
+    """
+    latest = lambda_client.get_function_configuration(FunctionName=function_name)
+    qualified = lambda_client.get_function_configuration(FunctionName=function_name, Qualifier=qualifier)
+    return latest.get('Environment') == qualified.get('Environment')
+
+
+def _provisioned_concurrency(lambda_client, function_name, qualifier):
+    try:
+        response = lambda_client.get_provisioned_concurrency_config(FunctionName=function_name, Qualifier=qualifier)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ProvisionedConcurrencyConfigNotFoundException':
+            return None
+        raise
+    return response['RequestedProvisionedConcurrentExecutions']
+
+
+def update_function_configuration(lambda_client, function_name, wait_for_update=None, attempts=5, **configuration):
+    """
+    update_function_configuration that waits for any update already in progress
+    (restoreSecrets and restoreConcurrencyProfile run alongside each other) and
+    for its own update to finish.
+    """
+    for attempt in range(1, attempts + 1):
+        if wait_for_update is not None:
+            wait_for_update(function_name)
+        try:
+            lambda_client.update_function_configuration(FunctionName=function_name, **configuration)
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceConflictException' or attempt == attempts:
+                raise
+            logger.info(f"{function_name} is being updated by someone else, attempt {attempt}")
+    if wait_for_update is not None:
+        wait_for_update(function_name)
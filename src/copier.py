@@ -0,0 +1,238 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+import time
+
+from boto3.s3.transfer import TransferConfig
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Copy tuning.  The s3 client handed to copy_objects should allow at least
+MAX_WORKERS pooled connections, otherwise the threads just queue up on urllib3.
+"""
+MAX_WORKERS = int(os.getenv('COPY_MAX_WORKERS', 32))
+MULTIPART_THRESHOLD = int(os.getenv('COPY_MULTIPART_THRESHOLD', 64 * 1024 * 1024))
+MULTIPART_CHUNKSIZE = int(os.getenv('COPY_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+MULTIPART_CONCURRENCY = int(os.getenv('COPY_MULTIPART_CONCURRENCY', 4))
+
+# Cap on how many failed keys we echo back in the copy statistics
+MAX_REPORTED_FAILURES = 20
+
+# Default size of one shard when the copy is fanned out over a Map state
+KEYS_PER_SHARD = int(os.getenv('COPY_KEYS_PER_SHARD', 5000))
+
+# How often (seconds) the copy progress is handed to the checkpoint callback
+CHECKPOINT_INTERVAL = 30
+
+
+def transfer_config():
+    return TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=MULTIPART_CONCURRENCY
+    )
+
+
+def list_objects(s3_client, bucket, prefix='', start_after=None, exclude_prefix=None):
+    """
+    Lazily page through a bucket listing, following continuation tokens,
+    and yield the objects one at a time.
+    :param s3_client:
+    :param bucket:
+    :param prefix: only list keys under this prefix
+    :param start_after: only list keys that sort after this key
+    :param exclude_prefix: skip keys under this prefix (e.g. our own bookkeeping objects)
+    :return: generator of list_objects_v2 'Contents' entries
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    for page in paginator.paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            if exclude_prefix and obj['Key'].startswith(exclude_prefix):
+                continue
+            yield obj
+
+
+def plan_shards(objects, keys_per_shard=KEYS_PER_SHARD):
+    """
+    Split a key-ordered stream of objects into contiguous key ranges.  Each shard
+    is described by the key it starts after and the last key it contains, so a
+    worker can list just its own range with StartAfter.
+    :param objects: iterable of objects sorted by key (listing order)
+    :param keys_per_shard:
+    :return: list of shards
+    """
+    shards = []
+    start_after = ''
+    iterator = iter(objects)
+    while True:
+        chunk = list(itertools.islice(iterator, keys_per_shard))
+        if not chunk:
+            break
+        shards.append({
+            "shardId": len(shards),
+            "startAfter": start_after,
+            "lastKey": chunk[-1]['Key'],
+            "keys": len(chunk),
+            "bytes": sum(obj.get('Size', 0) for obj in chunk)
+        })
+        start_after = chunk[-1]['Key']
+    return shards
+
+
+def shard_objects(objects, shard):
+    """
+    Trim a key-ordered stream of objects down to the keys that belong to the shard.
+    """
+    objects = itertools.dropwhile(lambda obj: obj['Key'] <= shard['startAfter'], objects)
+    return itertools.takewhile(lambda obj: obj['Key'] <= shard['lastKey'], objects)
+
+
+def is_already_copied(src_obj, dest_obj):
+    """
+    Decide if a destination object is a copy of the source object.  Multipart
+    copies get a different ETag than the source, so in that case only the size
+    can be compared.
+    """
+    if dest_obj is None:
+        return False
+    if dest_obj['Size'] != src_obj.get('Size'):
+        return False
+    if '-' in dest_obj['ETag'] or '-' in src_obj.get('ETag', ''):
+        return True
+    return dest_obj['ETag'] == src_obj.get('ETag')
+
+
+def copy_object(s3_client, src_bucket, dest_bucket, obj, config):
+    """
+    Server side copy of a single object, to 'DestKey' if the object has one and
+    to the same key otherwise.  Anything at or over the multipart
+    threshold goes through the managed transfer so it is copied with
+    UploadPartCopy instead of a single CopyObject (which tops out at 5GB).
+    :return: when the copy finished, epoch seconds
+    """
+    copy_source = {
+        'Bucket': src_bucket,
+        'Key': obj['Key']
+    }
+    dest_key = obj.get('DestKey', obj['Key'])
+    if obj.get('Size', 0) >= config.multipart_threshold:
+        s3_client.copy(copy_source, dest_bucket, dest_key, Config=config)
+    else:
+        s3_client.copy_object(CopySource=copy_source, Bucket=dest_bucket, Key=dest_key)
+    return time.time()
+
+
+def copy_objects(s3_client, src_bucket, dest_bucket, objects, max_workers=MAX_WORKERS,
+                 deadline=None, checkpoint=None, on_copied=None):
+    """
+    Copy objects through a bounded thread pool that shares one s3 client.
+
+    The objects iterable is consumed lazily, with at most twice max_workers
+    copies queued at a time, so a paginated listing can be streamed straight in
+    without holding the whole bucket in memory.
+
+    Progress is tracked as a watermark: the last key such that it and every key
+    handed in before it copied successfully, to each of their destination keys
+    (the copies of one key have to be handed in next to each other).  The
+    watermark is passed to the checkpoint callback every CHECKPOINT_INTERVAL
+    seconds and once at the end.
+    :param s3_client:
+    :param src_bucket:
+    :param dest_bucket:
+    :param objects: iterable of dicts with at least 'Key' and 'Size', and optionally 'DestKey'
+    :param max_workers:
+    :param deadline: epoch seconds after which no new copies are started
+    :param checkpoint: callable taking the stats, called with the current watermark in stats['lastKey']
+    :param on_copied: callable taking an object and the epoch seconds its copy finished, for every successful copy
+    :return: copy statistics (keys, bytes, keys/sec, bytes/sec, failures, lastKey, complete)
+    """
+    config = transfer_config()
+    stats = {
+        "keys": 0,
+        "bytes": 0,
+        "failedKeys": 0,
+        "failures": [],
+        "lastKey": None,
+        "complete": True
+    }
+    start = time.time()
+    last_checkpoint = start
+    in_flight = set()
+    in_flight_objects = {}
+    # destination key -> (key, copied successfully), in submission order, for the watermark; the copies
+    # dataset.multiply makes of one key share its 'Key', only their 'DestKey's tell them apart
+    pending = collections.OrderedDict()
+    # the key of the last copy behind the watermark, the key itself only is once none of its copies are pending
+    behind = None
+
+    def _collect(done):
+        nonlocal behind
+        for future in done:
+            obj = in_flight_objects.pop(future)
+            dest_key = obj.get('DestKey', obj['Key'])
+            try:
+                finished_at = future.result()
+                if on_copied is not None:
+                    on_copied(obj, finished_at)
+                stats["keys"] += 1
+                stats["bytes"] += obj.get('Size', 0)
+                pending[dest_key] = (obj['Key'], True)
+            except Exception as e:
+                logger.warning(f"failed to copy {obj['Key']} to {dest_key}: {repr(e)}")
+                stats["failedKeys"] += 1
+                if len(stats["failures"]) < MAX_REPORTED_FAILURES:
+                    stats["failures"].append({"key": dest_key, "error": repr(e)})
+        while pending:
+            key, copied = next(iter(pending.values()))
+            if behind is not None and key != behind:
+                stats["lastKey"] = behind
+            if not copied:
+                break
+            pending.popitem(last=False)
+            behind = key
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for obj in objects:
+            if deadline is not None and time.time() > deadline:
+                logger.info(f"deadline reached, stopping before {obj['Key']}")
+                stats["complete"] = False
+                break
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                _collect(done)
+            if checkpoint is not None and time.time() - last_checkpoint > CHECKPOINT_INTERVAL:
+                checkpoint(stats)
+                last_checkpoint = time.time()
+            future = executor.submit(copy_object, s3_client, src_bucket, dest_bucket, obj, config)
+            in_flight_objects[future] = obj
+            pending[obj.get('DestKey', obj['Key'])] = (obj['Key'], False)
+            in_flight.add(future)
+        done, in_flight = concurrent.futures.wait(in_flight)
+        _collect(done)
+    if not pending and behind is not None:
+        # every copy handed in went through
+        stats["lastKey"] = behind
+    if stats["failedKeys"] > 0:
+        stats["complete"] = False
+
+    elapsed = time.time() - start
+    stats["seconds"] = round(elapsed, 3)
+    stats["keysPerSecond"] = round(stats["keys"] / elapsed, 2) if elapsed > 0 else 0
+    stats["bytesPerSecond"] = round(stats["bytes"] / elapsed, 2) if elapsed > 0 else 0
+    stats["maxWorkers"] = max_workers
+    logger.info(f"copied {stats['keys']} keys ({stats['bytes']} bytes) in {stats['seconds']}s "
+                f"{stats['keysPerSecond']} keys/sec {stats['bytesPerSecond']} bytes/sec "
+                f"with {max_workers} workers, {stats['failedKeys']} failures")
+    if checkpoint is not None:
+        checkpoint(stats)
+    return stats
@@ -0,0 +1,142 @@
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+What a run cost and what it got through for the money, so runs with different
+database sizes and concurrency profiles can be compared on throughput per unit
+of capacity rather than on throughput alone.
+
+Prices come from the local table below (on demand, us-west-2, USD), not the
+pricing API, so the figures can be worked out offline and the same way for every
+run.  A run can override any of them with 'prices' in its input, for example
+{"auroraInstanceHour": {"db.r6g.4xlarge": 2.08}, "lambdaGbSecond": 0.0000133334}.
+
+The database is counted from when each instance was created, or from the start
+of the run for a warm cluster that was already up, to the results step; the
+teardown after it isn't.  Aurora I/O is estimated from the writer's average
+read and write IOPS over the run.
+"""
+PRICES = {
+    "auroraInstanceHour": {
+        "db.t3.medium": 0.082,
+        "db.r5.large": 0.29,
+        "db.r5.xlarge": 0.58,
+        "db.r5.2xlarge": 1.16,
+        "db.r5.4xlarge": 2.32,
+        "db.r5.8xlarge": 4.64,
+        "db.r5.12xlarge": 6.96,
+        "db.r5.16xlarge": 9.28,
+        "db.r5.24xlarge": 13.92,
+        "db.r6g.large": 0.26,
+        "db.r6g.xlarge": 0.519,
+        "db.r6g.2xlarge": 1.038,
+        "db.r6g.4xlarge": 2.076,
+        "db.r6g.8xlarge": 4.152,
+        "db.r6g.12xlarge": 6.228,
+        "db.r6g.16xlarge": 8.304
+    },
+    "auroraIoPerMillion": 0.20,
+    "lambdaGbSecond": 0.0000166667,
+    "lambdaPerMillionRequests": 0.20
+}
+
+
+def price_table(overrides=None):
+    """
+    :return: PRICES with the overrides on top, instance prices are overridden per instance class
+    """
+    overrides = dict(overrides or {})
+    table = dict(PRICES, auroraInstanceHour=dict(PRICES["auroraInstanceHour"]))
+    table["auroraInstanceHour"].update(overrides.pop("auroraInstanceHour", None) or {})
+    table.update(overrides)
+    return table
+
+
+def instance_hours(instances, start_time, end_time):
+    """
+    :param instances: describe_db_instances entries of the run's cluster
+    :return: dict of instance identifier -> instance class and hours up during the run
+    """
+    hours = {}
+    for instance in instances:
+        created_at = instance.get('InstanceCreateTime') or start_time
+        up_since = max(created_at, start_time)
+        hours[instance['DBInstanceIdentifier']] = {
+            "instanceClass": instance['DBInstanceClass'],
+            "hours": round(max((end_time - up_since).total_seconds(), 0) / 3600, 4)
+        }
+    return hours
+
+
+def lambda_usage(harvested, memory_sizes):
+    """
+    :param harvested: metrics.harvest results
+    :param memory_sizes: dict of function name -> memory size (MB) during the run
+    :return: dict of function name -> invocations and GB-seconds
+    """
+    usage = {}
+    for function_name, memory_size in memory_sizes.items():
+        metrics = harvested.get('lambda', {}).get(function_name, {})
+        usage[function_name] = {
+            "memorySize": memory_size,
+            "invocations": metrics.get('Invocations') or 0,
+            "gbSeconds": round((metrics.get('DurationSum') or 0) / 1000 * memory_size / 1024, 3)
+        }
+    return usage
+
+
+def _per(value, divisor, digits=3):
+    return round(value / divisor, digits) if value is not None and divisor else None
+
+
+def efficiency(elapsed_seconds, objects, rows, instances, functions, io_per_second, prices):
+    """
+    :param elapsed_seconds: how long the run took, from preTest to the results step
+    :param objects: objects the run put through the pipeline
+    :param rows: rows the run inserted
+    :param instances: instance_hours of the run's cluster
+    :param functions: lambda_usage of the pipeline functions
+    :param io_per_second: the writer's average read plus write IOPS, None if it wasn't reported
+    :param prices: price_table
+    :return: the run's rates, capacity used, cost and the efficiency figures that follow from them
+    """
+    db_hours = round(sum(instance["hours"] for instance in instances.values()), 4)
+    unpriced = sorted({instance["instanceClass"] for instance in instances.values()
+                       if instance["instanceClass"] not in prices["auroraInstanceHour"]})
+    database_cost = None
+    if not unpriced:
+        database_cost = sum(instance["hours"] * prices["auroraInstanceHour"][instance["instanceClass"]]
+                            for instance in instances.values())
+    else:
+        logger.info(f"no price for {unpriced}, the run's cost is left out")
+    io_requests = io_per_second * elapsed_seconds if io_per_second is not None else 0
+    gb_seconds = sum(function["gbSeconds"] for function in functions.values())
+    requests = sum(function["invocations"] for function in functions.values())
+    cost = {
+        "database": database_cost,
+        "databaseIo": io_requests / 1000000 * prices["auroraIoPerMillion"],
+        "lambda": gb_seconds * prices["lambdaGbSecond"] + requests / 1000000 * prices["lambdaPerMillionRequests"]
+    }
+    cost["total"] = sum(cost.values()) if database_cost is not None else None
+    cost = {name: round(value, 4) if value is not None else None for name, value in cost.items()}
+    return {
+        "objects": objects,
+        "rows": rows,
+        "objectsPerSecond": _per(objects, elapsed_seconds),
+        "rowsPerSecond": _per(rows, elapsed_seconds),
+        "dbHours": db_hours,
+        "instances": instances,
+        "unpricedInstanceClasses": unpriced,
+        "lambdaGbSeconds": round(gb_seconds, 3),
+        "lambdaRequests": round(requests),
+        "ioRequestsEstimate": round(io_requests),
+        "cost": cost,
+        "costPer10kObjects": _per(cost["total"] * 10000 if cost["total"] is not None else None,
+                                  objects, 4),
+        "objectsPerDollar": _per(objects, cost["total"], 1),
+        "objectsPerDbHour": _per(objects, db_hours, 1),
+        "rowsPerDbHour": _per(rows, db_hours, 1)
+    }
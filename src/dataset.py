@@ -0,0 +1,79 @@
+import hashlib
+
+"""
+Dataset profiles pick what part of the reference data set a run copies.  The
+profile is passed in the step function event as 'dataset', for example:
+
+    {"fraction": 0.01}
+    {"types": ["ts-corrected", "ts-description"], "maxSize": 10485760}
+    {"fraction": 0.1, "multiplier": 5}
+
+'fraction' is a deterministic sample: the same key is always in or out for a
+given 'seed', so every shard (and every rerun) agrees on the subset.  'types'
+are manifest object types, 'minSize'/'maxSize' are bytes.  'multiplier' copies
+each selected key N times, the extra copies under MULTIPLIER_PREFIX<n>/, to
+produce more load than production.
+"""
+DEFAULT_SEED = 'aqts-capture-load-test'
+MULTIPLIER_PREFIX = 'load-test-copy-'
+
+
+def select(entries, dataset=None):
+    """
+    Filter manifest entries down to the ones the dataset profile asks for.
+    """
+    dataset = dataset or {}
+    types = dataset.get('types')
+    min_size = dataset.get('minSize')
+    max_size = dataset.get('maxSize')
+    fraction = dataset.get('fraction')
+    seed = str(dataset.get('seed', DEFAULT_SEED))
+    for entry in entries:
+        if types is not None and entry['Type'] not in types:
+            continue
+        if min_size is not None and entry['Size'] < min_size:
+            continue
+        if max_size is not None and entry['Size'] > max_size:
+            continue
+        if fraction is not None and not _sampled(seed, entry['Key'], float(fraction)):
+            continue
+        yield entry
+
+
+def _sampled(seed, key, fraction):
+    digest = hashlib.sha1(f"{seed}/{key}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') < fraction * 2 ** 64
+
+
+def multiplier(dataset=None):
+    return int((dataset or {}).get('multiplier', 1))
+
+
+def copy_prefix(copy_number):
+    """
+    Prefix the destination keys of the n-th copy of the data set with.  The
+    first copy keeps the original keys.
+    """
+    if copy_number == 0:
+        return ''
+    return f"{MULTIPLIER_PREFIX}{copy_number}/"
+
+
+def as_copy(entries, copy_number):
+    """
+    Point the entries at the destination keys of the n-th copy of the data set.
+    """
+    prefix = copy_prefix(copy_number)
+    for entry in entries:
+        yield dict(entry, DestKey=prefix + entry['Key']) if prefix else entry
+
+
+def multiply(entries, dataset=None):
+    """
+    Yield every entry once per copy asked for by the dataset profile, the copies
+    of one key next to each other.
+    """
+    copies = multiplier(dataset)
+    for entry in entries:
+        for copy_number in range(copies):
+            yield dict(entry, DestKey=copy_prefix(copy_number) + entry['Key']) if copy_number else entry
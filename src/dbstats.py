@@ -0,0 +1,195 @@
+import psycopg2
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+What the load test database spent its time on during a run, from the
+cumulative statistics views: pg_stat_statements (per statement), the table
+statistics (scans, tuples and buffer hits per table) and pg_stat_bgwriter
+(checkpoints and buffer writes).
+
+The views only ever count up, so a snapshot is taken before the run and the
+run's share is the difference with a snapshot taken after it.  pg_stat_statements
+is also reset before the run, when the user is allowed to, which keeps the
+statements the run didn't use from crowding out the ones it did.
+
+pg_stat_statements renamed total_time/mean_time to total_exec_time/mean_exec_time
+in Postgres 13, both are read.
+"""
+
+EXTENSION_SQL = "select exists (select 1 from pg_extension where extname = 'pg_stat_statements') as installed"
+
+STATEMENTS_SQL = """
+select s.* from pg_stat_statements s
+join pg_database d on d.oid = s.dbid
+where d.datname = current_database()
+"""
+
+TABLES_SQL = """
+select s.schemaname || '.' || s.relname as table_name, s.seq_scan, s.seq_tup_read,
+       coalesce(s.idx_scan, 0) as idx_scan, coalesce(s.idx_tup_fetch, 0) as idx_tup_fetch,
+       s.n_tup_ins, s.n_tup_upd, s.n_tup_del, s.n_live_tup, s.n_dead_tup,
+       s.vacuum_count + s.autovacuum_count as vacuums, s.analyze_count + s.autoanalyze_count as analyzes,
+       coalesce(io.heap_blks_hit, 0) as heap_blks_hit, coalesce(io.heap_blks_read, 0) as heap_blks_read,
+       coalesce(io.idx_blks_hit, 0) as idx_blks_hit, coalesce(io.idx_blks_read, 0) as idx_blks_read
+from pg_stat_user_tables s
+join pg_statio_user_tables io on io.relid = s.relid
+"""
+
+BGWRITER_SQL = "select * from pg_stat_bgwriter"
+
+# Counters of a statement, and the names they go by in the results
+STATEMENT_COUNTERS = {
+    "calls": "calls",
+    "totalTimeMs": ("total_exec_time", "total_time"),
+    "rows": "rows",
+    "sharedBlocksHit": "shared_blks_hit",
+    "sharedBlocksRead": "shared_blks_read",
+    "sharedBlocksDirtied": "shared_blks_dirtied",
+    "tempBlocksWritten": "temp_blks_written",
+    "blockReadTimeMs": "blk_read_time"
+}
+
+# Table statistics that count up, the rest (live and dead tuples) are as of the snapshot
+TABLE_COUNTERS = ('seq_scan', 'seq_tup_read', 'idx_scan', 'idx_tup_fetch', 'n_tup_ins', 'n_tup_upd', 'n_tup_del',
+                  'vacuums', 'analyzes', 'heap_blks_hit', 'heap_blks_read', 'idx_blks_hit', 'idx_blks_read')
+
+TOP_STATEMENTS = 10
+
+# Statement text is cut to this many characters in the results
+MAX_QUERY_LENGTH = 500
+
+
+def reset(rds):
+    """
+    Install pg_stat_statements if it isn't, and reset it.
+    :return: whether the statistics were reset
+    """
+    try:
+        rds.execute_update("create extension if not exists pg_stat_statements")
+        rds.execute_sql("select pg_stat_statements_reset()")
+        return True
+    except psycopg2.Error as e:
+        logger.info(f"could not reset pg_stat_statements, the run's statements will be diffed instead: {repr(e)}")
+        return False
+
+
+def _statement_counters(row):
+    counters = {}
+    for name, columns in STATEMENT_COUNTERS.items():
+        columns = columns if isinstance(columns, tuple) else (columns,)
+        counters[name] = next((row[column] for column in columns if row.get(column) is not None), 0)
+    return counters
+
+
+def _statements(rds):
+    if not rds.execute_batch({"extension": EXTENSION_SQL})["extension"][0]["installed"]:
+        return None
+    try:
+        rows = rds.execute_batch({"statements": STATEMENTS_SQL})["statements"]
+    except psycopg2.Error as e:
+        # installed but not loaded through shared_preload_libraries
+        logger.info(f"could not read pg_stat_statements: {repr(e)}")
+        return None
+    return {
+        f"{row['userid']}:{row['queryid']}": dict(_statement_counters(row), queryId=str(row['queryid']),
+                                                  query=row['query'][:MAX_QUERY_LENGTH])
+        for row in rows
+    }
+
+
+def snapshot(rds):
+    """
+    :return: the statement, table and background writer statistics as of now
+    """
+    views = rds.execute_batch({"tables": TABLES_SQL, "bgwriter": BGWRITER_SQL})
+    return {
+        "statements": _statements(rds),
+        "tables": {row["table_name"]: row for row in views["tables"]},
+        "bgwriter": views["bgwriter"][0] if views["bgwriter"] else {}
+    }
+
+
+def _hit_ratio(hits, reads):
+    return round(hits / (hits + reads), 4) if hits + reads > 0 else None
+
+
+def _statement_deltas(start, end):
+    deltas = []
+    for key, counters in end.items():
+        before = start.get(key, {})
+        delta = {name: counters[name] - before.get(name, 0) for name in STATEMENT_COUNTERS}
+        if delta["calls"] <= 0:
+            continue
+        delta["totalTimeMs"] = round(delta["totalTimeMs"], 3)
+        delta["blockReadTimeMs"] = round(delta["blockReadTimeMs"], 3)
+        delta["meanTimeMs"] = round(delta["totalTimeMs"] / delta["calls"], 3)
+        delta["hitRatio"] = _hit_ratio(delta["sharedBlocksHit"], delta["sharedBlocksRead"])
+        deltas.append(dict(delta, queryId=counters["queryId"], query=counters["query"]))
+    return deltas
+
+
+def _table_deltas(start, end):
+    deltas = []
+    for name, row in end.items():
+        before = start.get(name, {})
+        delta = {column: row[column] - before.get(column, 0) for column in TABLE_COUNTERS}
+        if not any(delta.values()):
+            continue
+        deltas.append({
+            "table_name": name,
+            "seqScans": delta["seq_scan"],
+            "seqTuplesRead": delta["seq_tup_read"],
+            "indexScans": delta["idx_scan"],
+            "indexTuplesFetched": delta["idx_tup_fetch"],
+            "inserts": delta["n_tup_ins"],
+            "updates": delta["n_tup_upd"],
+            "deletes": delta["n_tup_del"],
+            "liveTuples": row["n_live_tup"],
+            "deadTuples": row["n_dead_tup"],
+            "deadTuplesAdded": row["n_dead_tup"] - before.get("n_dead_tup", 0),
+            "deadTupleRatio": _hit_ratio(row["n_dead_tup"], row["n_live_tup"]),
+            "vacuums": delta["vacuums"],
+            "analyzes": delta["analyzes"],
+            "heapHitRatio": _hit_ratio(delta["heap_blks_hit"], delta["heap_blks_read"]),
+            "indexHitRatio": _hit_ratio(delta["idx_blks_hit"], delta["idx_blks_read"])
+        })
+    # the tables read the most by sequential scans are the likeliest to be missing an index
+    return sorted(deltas, key=lambda table: table["seqTuplesRead"], reverse=True)
+
+
+def compare(start, end, top=TOP_STATEMENTS):
+    """
+    The run's share of the statistics, from the snapshots taken before and after it.
+    :param start: snapshot from before the run, with 'statementsReset' if pg_stat_statements was reset
+    :param end: snapshot from after the run
+    :param top: how many statements to report by total and by mean time
+    :return: the top statements, per table scans/tuples/hit ratios, and the background writer deltas
+    """
+    statements = None
+    if end["statements"] is not None:
+        deltas = _statement_deltas(start["statements"] or {}, end["statements"])
+        hits = sum(delta["sharedBlocksHit"] for delta in deltas)
+        reads = sum(delta["sharedBlocksRead"] for delta in deltas)
+        statements = {
+            "reset": bool(start.get("statementsReset")),
+            "statements": len(deltas),
+            "calls": sum(delta["calls"] for delta in deltas),
+            "totalTimeMs": round(sum(delta["totalTimeMs"] for delta in deltas), 3),
+            "hitRatio": _hit_ratio(hits, reads),
+            "topByTotalTime": sorted(deltas, key=lambda delta: delta["totalTimeMs"], reverse=True)[:top],
+            "topByMeanTime": sorted(deltas, key=lambda delta: delta["meanTimeMs"], reverse=True)[:top]
+        }
+    bgwriter = {
+        name: value - start["bgwriter"].get(name, 0) for name, value in end["bgwriter"].items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+    return {
+        "statements": statements,
+        "tables": _table_deltas(start["tables"], end["tables"]),
+        "bgwriter": bgwriter
+    }
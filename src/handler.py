@@ -1,10 +1,31 @@
+import concurrent.futures
+import hashlib
 import json
 import os
-import boto3
+import re
+import time
 import datetime
 import logging
 
-from src.rds import RDS
+from botocore.config import Config
+import psycopg2
+
+from src import alarms
+from src import baseline
+from src import clients
+from src import concurrency
+from src import copier
+from src import cost
+from src import dataset
+from src import dbstats
+from src import latency
+from src import manifest
+from src import metrics
+from src import replay
+from src import results
+from src import saturation
+from src import switchover
+from src import throughput
 
 """
 As of right now, the plan is to always deploy and run on QA.  However,
@@ -25,6 +46,9 @@ DB = {
 
 CAPTURE_TRIGGER = 'aqts-capture-trigger-QA-aqtsCaptureTrigger'
 
+# Secrets are cached per lambda container for this long
+SECRET_TTL_SECONDS = int(os.getenv('SECRET_TTL_SECONDS', 300))
+
 """
 This is supposed to be all lambda functions invoked by the state machine.
 """
@@ -42,32 +66,62 @@ LAMBDA_FUNCTIONS = [
     f"aqts-capture-error-handler-{stage}-aqtsErrorHandler"
 ]
 
-# Default snapshot identifier, may be overridden by passing a custom
-# snapshot identifier in the step function event
-two_days_ago = datetime.datetime.now() - datetime.timedelta(2)
-month = str(two_days_ago.month)
-if len(month) == 1:
-    month = f"0{month}"
-day = str(two_days_ago.day)
-if len(day) == 1:
-    day = f"0{day}"
-SNAPSHOT_IDENTIFIER = f"rds:nwcapture-prod-external-{two_days_ago.year}-{month}-{day}-10-08"
-
 """
 DB Info
 """
 DB_INSTANCE_IDENTIFIER = 'nwcapture-load-instance1'
 DB_INSTANCE_CLASS = 'db.r5.8xlarge'
 ENGINE = 'aurora-postgresql'
+ENGINE_VERSION = '11.7'
+DB_CLUSTER_PARAMETER_GROUP = 'aqts-capture'
+# Cloned instead of restoring the snapshot when the event asks for a 'clone'
+CLONE_SOURCE_CLUSTER = os.getenv('CLONE_SOURCE_CLUSTER', DB[stage])
+DB_FAILED_STATUSES = {'failed', 'incompatible-restore', 'incompatible-parameters',
+                      'inaccessible-encryption-credentials'}
 DB_CLUSTER_IDENTIFIER = 'nwcapture-load'
 NWCAPTURE_REAL = f"NWCAPTURE-DB-{stage}"
 NWCAPTURE_LOAD = 'NWCAPTURE-DB-LOAD'
 
+"""
+The size of the load test database can be chosen per run by passing a
+'database' profile in the step function event, for example
+{"instanceClass": "db.r5.4xlarge", "readerCount": 1}.  Anything left out
+comes from here.
+"""
+DATABASE_DEFAULTS = {
+    "instanceClass": DB_INSTANCE_CLASS,
+    "readerCount": 0,
+    "parameterGroup": DB_CLUSTER_PARAMETER_GROUP,
+    "engineVersion": ENGINE_VERSION
+}
+
 """
 SQS Queues
 """
 CAPTURE_TRIGGER_QUEUE = f"aqts-capture-trigger-queue-{stage}"
 ERROR_QUEUE = f"aqts-capture-error-queue-{stage}"
+PIPELINE_QUEUES = [CAPTURE_TRIGGER_QUEUE, ERROR_QUEUE]
+
+"""
+Completion detection.  The run is done once the queues are empty, no capture
+state machine executions are running and capture.json_data has stopped growing,
+for REQUIRED_SETTLED_POLLS polls in a row.
+"""
+CAPTURE_STATE_MACHINE = f"aqts-capture-state-machine-{stage}"
+
+# Row counts and churn of every capture table, from the statistics rather than counting
+CAPTURE_TABLES_SQL = """
+select relname as table_name, n_live_tup as live_rows, n_tup_ins as inserts,
+       n_tup_upd as updates, n_tup_del as deletes, n_dead_tup as dead_rows
+from pg_stat_user_tables
+where schemaname = 'capture'
+order by relname
+"""
+REQUIRED_SETTLED_POLLS = 2
+MAX_WAIT_SECONDS = 6 * 60 * 60
+
+# How long the queues get to drain before the run starts, once the pipeline has been switched over
+MAX_DRAIN_SECONDS = 15 * 60
 
 """
 Buckets
@@ -77,15 +131,84 @@ SRC_BUCKET = 'iow-retriever-capture-reference'
 REAL_BUCKET = f"iow-retriever-capture-{stage.lower()}"
 
 """
-Boto clients
+Load test bookkeeping (copy checkpoints, etc.) is kept under STATE_PREFIX in the
+reference bucket.  That bucket has no notification on it, so writing there never
+feeds the capture pipeline, and the prefix is skipped whenever it is copied.
+"""
+STATE_BUCKET = SRC_BUCKET
+STATE_PREFIX = 'load-test-state/'
+CHECKPOINT_PREFIX = f"{STATE_PREFIX}checkpoints/"
+MANIFEST_KEY = f"{STATE_PREFIX}manifest.jsonl.gz"
+THROUGHPUT_SAMPLES_KEY = f"{STATE_PREFIX}throughput-samples.json"
+COMPLETION_KEY = f"{STATE_PREFIX}completion.json"
+CONCURRENCY_ORIGINALS_KEY = f"{STATE_PREFIX}concurrency-originals.json"
+BASELINE_KEY = f"{STATE_PREFIX}baseline.json"
+WARM_ENVIRONMENT_KEY = f"{STATE_PREFIX}warm-environment.json"
+RESULTS_PREFIX = f"{STATE_PREFIX}results/"
+COPY_LOG_PREFIX = f"{STATE_PREFIX}copy-logs/"
+DB_STATS_KEY = f"{STATE_PREFIX}db-stats-start.json"
+# The run's report, not in the test bucket, where it would be one more object for the trigger queue
+TEST_RESULTS_KEY = f"{STATE_PREFIX}TEST_RESULTS"
+# Trigger queue notifications taken off a bucket, to put back as they were
+NOTIFICATION_STASH_PREFIX = f"{STATE_PREFIX}notifications/"
+
+"""
+Per object latency.  The column of capture.json_data that holds the S3 key a
+row was loaded from, the column with the time it was inserted, and its
+(indexed, increasing) id column.  The capture schema isn't in this repo, so
+they are checked against information_schema before they are used.
+"""
+JSON_DATA_KEY_COLUMN = os.getenv('JSON_DATA_KEY_COLUMN', 'source_key')
+JSON_DATA_TIME_COLUMN = os.getenv('JSON_DATA_TIME_COLUMN', 'create_date')
+JSON_DATA_ID_COLUMN = os.getenv('JSON_DATA_ID_COLUMN', 'json_data_id')
+RESULTS_INDEX_KEY = f"{RESULTS_PREFIX}index.jsonl"
+
+"""
+Keep warm.  A run started with 'keepWarm': true leaves the load test cluster up
+afterwards, and the next keepWarm run resets it to the baseline recorded by the
+first one instead of restoring it again.  A warm cluster is torn down by a run
+started with 'teardown': true, or by expireWarmEnvironment once nothing has used
+it for 'warmTtlHours' (default WARM_TTL_HOURS).
+"""
+LOAD_TEST_STATE_MACHINE = f"aqts-capture-load-test-{stage}"
+WARM_TTL_HOURS = int(os.getenv('WARM_TTL_HOURS', 8))
+
+"""
+Runs side by side.  Each run's cluster, instances, test bucket prefix, results
+object and bookkeeping are named after its namespace, a cleaned up run id, so
+several runs can restore, load and tear down their own databases at the same
+time.  keepWarm and teardown runs share the one warm environment, which keeps
+the plain names, as do lambdas invoked by hand.  A 'namespace' in the event
+overrides all of that, e.g. to tear down what a failed run left behind.
+
+The pipeline functions can only point at one database at a time, so a run
+waits its turn for the pipeline lease before switching them over, and gives
+the lease up once they are back to normal.  The lease goes to the run that
+asked first, among those still running.
 """
-secrets_client = boto3.client('secretsmanager', os.environ['AWS_DEPLOYMENT_REGION'])
-rds_client = boto3.client('rds', os.environ['AWS_DEPLOYMENT_REGION'])
-lambda_client = boto3.client('lambda', os.getenv('AWS_DEPLOYMENT_REGION'))
-sqs_client = boto3.client('sqs', os.getenv('AWS_DEPLOYMENT_REGION'))
-s3_client = boto3.client('s3', os.getenv('AWS_DEPLOYMENT_REGION'))
-cloudwatch_client = boto3.client('cloudwatch', os.getenv('AWS_DEPLOYMENT_REGION', 'us-west-2'))
-s3 = boto3.resource('s3', os.getenv('AWS_DEPLOYMENT_REGION'))
+MAX_NAMESPACE_LENGTH = 36
+PIPELINE_LEASE_PREFIX = f"{STATE_PREFIX}pipeline-lease/"
+
+# Stop starting new copies this many seconds before the lambda would time out
+COPY_DEADLINE_MARGIN = 60
+
+# A saturation step that releases less than this share of its rate is limited by the copy, not the pipeline
+MIN_INJECTED_SHARE = 0.8
+
+# The longest saturation step: saturationStep's 15 minute timeout, less the copy margin and the time to judge the step
+MAX_SATURATION_STEP_SECONDS = 15 * 60 - 2 * COPY_DEADLINE_MARGIN
+
+"""
+Boto clients.  Each one is created the first time it is used and then kept for
+the life of the container, so a lambda only pays for the clients it needs.
+"""
+secrets_client = clients.lazy('secretsmanager')
+rds_client = clients.lazy('rds')
+lambda_client = clients.lazy('lambda', Config(max_pool_connections=len(LAMBDA_FUNCTIONS)))
+sqs_client = clients.lazy('sqs')
+s3_client = clients.lazy('s3', Config(max_pool_connections=copier.MAX_WORKERS + copier.MULTIPART_CONCURRENCY))
+cloudwatch_client = clients.lazy('cloudwatch')
+sfn_client = clients.lazy('stepfunctions')
 
 ALARMS = {
     f"aqts-capture-dvstat-transform-{stage}-error-alarm",
@@ -105,10 +228,18 @@ ALARMS = {
 
 def delete_db_cluster(event, context):
     logger.info(event)
-    rds_client.delete_db_cluster(
-        DBClusterIdentifier=DB_CLUSTER_IDENTIFIER,
-        SkipFinalSnapshot=True
-    )
+    resources = _resources(event)
+    try:
+        rds_client.delete_db_cluster(
+            DBClusterIdentifier=resources["cluster"],
+            SkipFinalSnapshot=True
+        )
+    except rds_client.exceptions.DBClusterNotFoundFault:
+        logger.info(f"{resources['cluster']} is already gone")
+    if not resources["namespace"]:
+        # the baseline and the warm environment went with the cluster
+        for key in [BASELINE_KEY, WARM_ENVIRONMENT_KEY]:
+            s3_client.delete_object(Bucket=STATE_BUCKET, Key=key)
 
 
 def modify_db_cluster(event, context):
@@ -122,7 +253,7 @@ def modify_db_cluster(event, context):
     """
     logger.info(event)
     rds_client.modify_db_cluster(
-        DBClusterIdentifier=DB_CLUSTER_IDENTIFIER,
+        DBClusterIdentifier=_resources(event)["cluster"],
         ApplyImmediately=True,
         MasterUserPassword='Password123'
     )
@@ -130,46 +261,531 @@ def modify_db_cluster(event, context):
 
 def delete_db_instance(event, context):
     logger.info(event)
-    rds_client.delete_db_instance(
-        DBInstanceIdentifier=DB_INSTANCE_IDENTIFIER,
-        SkipFinalSnapshot=True
-    )
+    """
+    Delete every instance in the load test cluster, the writer and any readers
+    the 'database' profile asked for.
+    """
+    cluster = _resources(event)["cluster"]
+    try:
+        response = rds_client.describe_db_clusters(DBClusterIdentifier=cluster)
+    except rds_client.exceptions.DBClusterNotFoundFault:
+        logger.info(f"{cluster} is already gone")
+        return []
+    members = [member['DBInstanceIdentifier'] for member in response['DBClusters'][0]['DBClusterMembers']]
+    logger.info(f"deleting instances {members}")
+    for db_instance_identifier in members:
+        try:
+            rds_client.delete_db_instance(
+                DBInstanceIdentifier=db_instance_identifier,
+                SkipFinalSnapshot=True
+            )
+        except rds_client.exceptions.InvalidDBInstanceStateFault as e:
+            # already being deleted by an earlier attempt
+            logger.info(f"not deleting {db_instance_identifier}: {repr(e)}")
+    return members
 
 
 def create_db_instance(event, context):
     logger.info(event)
-    rds_client.create_db_instance(
-        DBInstanceIdentifier=DB_INSTANCE_IDENTIFIER,
-        DBInstanceClass=DB_INSTANCE_CLASS,
-        DBClusterIdentifier=DB_CLUSTER_IDENTIFIER,
-        Engine=ENGINE
-    )
+    """
+    Create the writer, and the readers if the 'database' profile asks for any,
+    with the profile's instance class.  An instance that already exists (from an
+    earlier attempt, this step is retried until the cluster is available) is left alone.
+    """
+    profile = _database_profile(event)
+    cluster = _resources(event)["cluster"]
+    instances = _db_instance_identifiers(profile, cluster)
+    for db_instance_identifier in instances:
+        try:
+            rds_client.create_db_instance(
+                DBInstanceIdentifier=db_instance_identifier,
+                DBInstanceClass=profile["instanceClass"],
+                DBClusterIdentifier=cluster,
+                Engine=ENGINE,
+                # the writer has to be the first to be promoted if there is a failover
+                PromotionTier=0 if db_instance_identifier == instances[0] else 15
+            )
+        except rds_client.exceptions.DBInstanceAlreadyExistsFault:
+            logger.info(f"{db_instance_identifier} already exists")
+    return profile
+
+
+def _database_profile(event):
+    """
+    :return: the event's 'database' profile with the defaults filled in
+    """
+    profile = dict(DATABASE_DEFAULTS)
+    profile.update((event or {}).get("database") or {})
+    profile["readerCount"] = int(profile["readerCount"])
+    if profile["readerCount"] < 0:
+        raise Exception(f"A database profile can't have {profile['readerCount']} readers")
+    return profile
+
+
+def _db_instance_identifiers(profile, cluster):
+    """
+    The writer (instance1, DB_INSTANCE_IDENTIFIER in the warm environment) then the readers, instance2, instance3...
+    """
+    return [f"{cluster}-instance{n}" for n in range(1, profile["readerCount"] + 2)]
+
+
+def _namespace(event):
+    """
+    The run's namespace (see above MAX_NAMESPACE_LENGTH), '' for the warm environment.  It is
+    the run id lower cased with anything but letters and digits turned into
+    dashes, cut short (with a hash of the run id, to keep it unique) if it
+    would make the instance identifiers too long for RDS.
+    """
+    event = event or {}
+    if event.get("namespace") is not None:
+        return event["namespace"]
+    run_id = (event.get("run") or {}).get("id")
+    if event.get("keepWarm") or event.get("teardown") or not run_id:
+        return ''
+    namespace = re.sub(r'[^a-z0-9]+', '-', run_id.lower()).strip('-')
+    if len(namespace) > MAX_NAMESPACE_LENGTH:
+        digest = hashlib.sha1(run_id.encode('utf-8')).hexdigest()[:8]
+        namespace = f"{namespace[:MAX_NAMESPACE_LENGTH - len(digest) - 1].rstrip('-')}-{digest}"
+    return namespace
+
+
+def _resources(event):
+    """
+    The names of the run's cluster, test bucket prefix and results object (in the state bucket).
+    """
+    namespace = _namespace(event)
+    if not namespace:
+        return {"namespace": namespace, "cluster": DB_CLUSTER_IDENTIFIER, "testPrefix": '',
+                "resultsKey": TEST_RESULTS_KEY}
+    return {
+        "namespace": namespace,
+        "cluster": f"{DB_CLUSTER_IDENTIFIER}-{namespace}",
+        "testPrefix": f"runs/{namespace}/",
+        "resultsKey": _run_state_key(event, TEST_RESULTS_KEY)
+    }
+
+
+def _run_state_key(event, key):
+    """
+    Where the run keeps one of its own state objects (throughput samples and the like).
+    """
+    namespace = _namespace(event)
+    if not namespace:
+        return key
+    return f"{STATE_PREFIX}runs/{namespace}/{key[len(STATE_PREFIX):]}"
+
+
+def _under(objects, test_prefix):
+    """
+    Point the objects at destination keys under the run's test bucket prefix.
+    """
+    if not test_prefix:
+        return objects
+    return (dict(obj, DestKey=test_prefix + obj.get('DestKey', obj['Key'])) for obj in objects)
+
+
+def plan_copy_shards(event, context):
+    logger.info(event)
+    """
+    Split the reference data set into contiguous key ranges so the copy can be
+    fanned out over the CopyS3 Map state, one invocation per shard.  The shard
+    size can be overridden by passing 'keysPerShard' in the event, and passing
+    'refreshManifest': true rebuilds the manifest before planning.  Only the
+    part of the data set picked by the event's 'dataset' profile (see
+    src/dataset.py) is planned.
+    :param event:
+    :param context:
+    :return: the copy plan, with a copyId that names the checkpoints and the list of shards
+    """
+    keys_per_shard = copier.KEYS_PER_SHARD
+    if event is not None and event.get("keysPerShard") is not None:
+        keys_per_shard = int(event.get("keysPerShard"))
+    profile = _dataset_profile(event)
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    shards = copier.plan_shards(dataset.select(_reference_objects(event), profile), keys_per_shard)
+    # every extra copy of the data set is its own set of shards, writing under its own prefix
+    shards = [
+        dict(shard, shardId=f"{shard['shardId']}-{copy_number}", copy=copy_number)
+        for copy_number in range(dataset.multiplier(profile))
+        for shard in shards
+    ]
+    plan = {
+        "copyId": created_at.strftime('%Y%m%d%H%M%S%f'),
+        "createdAt": created_at.isoformat(),
+        "dataset": profile,
+        "keys": sum(shard["keys"] for shard in shards),
+        "bytes": sum(shard["bytes"] for shard in shards),
+        "shards": shards
+    }
+    logger.info(f"planned {len(shards)} shards for {plan['keys']} keys ({plan['bytes']} bytes)")
+    return plan
 
 
 def copy_s3(event, context):
     logger.info(event)
     """
     Copy files from the 'reference' bucket to the trigger bucket to simulate
-    a full run.
+    a full run.  The listing is paged through lazily and the keys are copied
+    through a bounded thread pool sharing one s3 client.  The number of copy
+    threads can be overridden by passing 'maxWorkers' in the event.
+
+    When the event carries a 'shard' (from planCopyShards, via the Map state)
+    only that key range is copied, and progress is checkpointed so a retry
+    picks up where the last attempt stopped.
     :param event:
     :param context:
-    :return:
+    :return: copy statistics, including keys/sec and bytes/sec
+    """
+    max_workers = copier.MAX_WORKERS
+    if event is not None and event.get("maxWorkers") is not None:
+        max_workers = int(event.get("maxWorkers"))
+    if event is not None and event.get("shard") is not None:
+        return _copy_shard(event["shard"], event["copyId"], event["createdAt"], event.get("dataset"),
+                           max_workers, context, _run_id(event), _resources(event)["testPrefix"])
+
+    logger.info(f"about to copy from SRC_BUCKET {SRC_BUCKET} to TEST_BUCKET {TEST_BUCKET} with {max_workers} workers")
+    profile = _dataset_profile(event)
+    copy_log = latency.CopyLog()
+    stats = copier.copy_objects(
+        s3_client,
+        SRC_BUCKET,
+        TEST_BUCKET,
+        _under(dataset.multiply(dataset.select(_reference_objects(event), profile), profile),
+               _resources(event)["testPrefix"]),
+        max_workers=max_workers,
+        on_copied=copy_log
+    )
+    copy_log.write(s3_client, STATE_BUCKET, f"{COPY_LOG_PREFIX}{_run_id(event)}/bulk.jsonl.gz")
+    if stats["failedKeys"] > 0:
+        raise Exception(f"Failed to copy {stats['failedKeys']} keys from {SRC_BUCKET} to {TEST_BUCKET} {stats}")
+    return stats
+
+
+def _copy_shard(shard, copy_id, created_at, profile, max_workers, context, run_id, test_prefix):
     """
-    logger.info(f"about to copy from SRC_BUCKET {SRC_BUCKET} to TEST_BUCKET {TEST_BUCKET}")
-    resp = s3_client.list_objects_v2(Bucket=SRC_BUCKET)
-    keys = []
-    for obj in resp['Contents']:
-        keys.append(obj['Key'])
-
-    s3_resource = boto3.resource('s3')
-    for key in keys:
-        copy_source = {
-            'Bucket': SRC_BUCKET,
-            'Key': key
+    Copy one shard, resuming from its checkpoint if an earlier attempt got part way.
+    Keys past the checkpoint watermark that an earlier attempt already copied
+    (same size/ETag, written since the plan was made) are skipped.
+    """
+    copy_number = shard.get("copy", 0)
+    prefix = test_prefix + dataset.copy_prefix(copy_number)
+    checkpoint_key = f"{CHECKPOINT_PREFIX}{copy_id}/{shard['shardId']}.json"
+    previous = _read_state_object(checkpoint_key)
+    if previous is not None and previous["complete"]:
+        logger.info(f"shard {shard['shardId']} already complete {previous}")
+        return previous
+
+    start_after = shard["startAfter"]
+    totals = {"keys": 0, "bytes": 0, "skippedKeys": 0, "attempts": 1}
+    copied = {}
+    if previous is not None:
+        logger.info(f"resuming shard {shard['shardId']} from checkpoint {previous}")
+        totals = {name: previous[name] for name in totals}
+        totals["attempts"] += 1
+        if previous["lastKey"]:
+            start_after = previous["lastKey"]
+        since = datetime.datetime.fromisoformat(created_at)
+        copied = {
+            obj['Key']: obj for obj in copier.shard_objects(
+                (dict(obj, Key=obj['Key'][len(prefix):]) for obj in copier.list_objects(
+                    s3_client, TEST_BUCKET, prefix=prefix, start_after=prefix + start_after)), shard)
+            if obj['LastModified'] >= since
         }
-        logger.info(f"key = {key}")
-        bucket = s3_resource.Bucket(TEST_BUCKET)
-        bucket.copy(copy_source, key)
+
+    def _not_yet_copied(objects):
+        for obj in objects:
+            if copier.is_already_copied(obj, copied.get(obj['Key'])):
+                totals["skippedKeys"] += 1
+                continue
+            yield obj
+
+    def _checkpoint(stats):
+        _write_state_object(checkpoint_key, {
+            "copyId": copy_id,
+            "shardId": shard["shardId"],
+            "lastKey": stats["lastKey"] or start_after,
+            "keys": totals["keys"] + stats["keys"],
+            "bytes": totals["bytes"] + stats["bytes"],
+            "skippedKeys": totals["skippedKeys"],
+            "attempts": totals["attempts"],
+            "complete": stats["complete"],
+            "updatedAt": str(datetime.datetime.now())
+        })
+
+    deadline = None
+    if context is not None:
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - COPY_DEADLINE_MARGIN
+    copy_log = latency.CopyLog()
+    stats = copier.copy_objects(
+        s3_client,
+        SRC_BUCKET,
+        TEST_BUCKET,
+        _under(dataset.as_copy(_not_yet_copied(copier.shard_objects(
+            dataset.select(_reference_objects(), profile), dict(shard, startAfter=start_after))), copy_number),
+            test_prefix),
+        max_workers=max_workers,
+        deadline=deadline,
+        checkpoint=_checkpoint,
+        on_copied=copy_log
+    )
+    copy_log.write(s3_client, STATE_BUCKET,
+                   f"{COPY_LOG_PREFIX}{run_id}/shard-{shard['shardId']}-{totals['attempts']}.jsonl.gz")
+    if not stats["complete"]:
+        raise Exception(f"Shard {shard['shardId']} stopped at {stats['lastKey']} with {stats['failedKeys']} failures, "
+                        f"a retry will resume from the checkpoint {stats}")
+    stats["shardId"] = shard["shardId"]
+    stats["keys"] += totals["keys"]
+    stats["bytes"] += totals["bytes"]
+    stats["skippedKeys"] = totals["skippedKeys"]
+    stats["attempts"] = totals["attempts"]
+    return stats
+
+
+def summarize_copy(event, context):
+    logger.info(event)
+    """
+    Add up the CopyS3 shards from their checkpoints once the Map state is
+    through.  The summary replaces the plan in the execution state ('copy'),
+    and the Map's own results are dropped, so the state stays small however
+    many shards the copy was split into.
+    :param event:
+    :param context:
+    :return: the copy's totals, and the shards that didn't complete
+    """
+    plan = event["copy"]
+
+    def _checkpoint(shard):
+        return _read_state_object(f"{CHECKPOINT_PREFIX}{plan['copyId']}/{shard['shardId']}.json")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=copier.MAX_WORKERS) as executor:
+        checkpoints = dict(zip([shard["shardId"] for shard in plan["shards"]],
+                               executor.map(_checkpoint, plan["shards"])))
+    done = [checkpoint for checkpoint in checkpoints.values() if checkpoint is not None]
+    summary = {
+        "copyId": plan["copyId"],
+        "dataset": plan["dataset"],
+        "shards": len(plan["shards"]),
+        "plannedKeys": plan["keys"],
+        "plannedBytes": plan["bytes"],
+        "keys": sum(checkpoint["keys"] for checkpoint in done),
+        "bytes": sum(checkpoint["bytes"] for checkpoint in done),
+        "skippedKeys": sum(checkpoint["skippedKeys"] for checkpoint in done),
+        "retriedShards": sum(1 for checkpoint in done if checkpoint["attempts"] > 1),
+        "incompleteShards": sorted(shard_id for shard_id, checkpoint in checkpoints.items()
+                                   if checkpoint is None or not checkpoint["complete"])
+    }
+    logger.info(f"copy summary {summary}")
+    return summary
+
+
+def refresh_manifest(event, context):
+    logger.info(event)
+    """
+    Rebuild the manifest of the reference bucket (key, size, ETag, LastModified
+    and object type of every file) that the copy and replay steps read instead
+    of listing the bucket.  Entries for unchanged keys are carried over from the
+    previous manifest, and the manifest is only rewritten if something changed.
+    Runs once a day on a schedule; the reference bucket also holds the load test
+    state, which is written constantly, so it isn't triggered by S3 events.
+    :param event:
+    :param context:
+    :return: the manifest header and the counts of added/changed/removed keys
+    """
+    previous = manifest.read(s3_client, STATE_BUCKET, MANIFEST_KEY)
+    previous_entries = None
+    if previous is not None:
+        previous_entries = {entry['Key']: entry for entry in previous}
+    entries, changes = manifest.build(
+        copier.list_objects(s3_client, SRC_BUCKET, exclude_prefix=STATE_PREFIX),
+        previous_entries
+    )
+    logger.info(f"manifest changes {changes}")
+    if previous is not None and changes["added"] + changes["changed"] + changes["removed"] == 0:
+        header = previous.header
+    else:
+        header = manifest.write(s3_client, STATE_BUCKET, MANIFEST_KEY, SRC_BUCKET, entries)
+    return {"manifest": header, "changes": changes}
+
+
+def _reference_objects(event=None):
+    """
+    The reference data set, in key order, read from the manifest.  The manifest
+    is built first if it doesn't exist yet or the event asks for 'refreshManifest'.
+    """
+    if event is not None and event.get("refreshManifest"):
+        refresh_manifest(event, None)
+    entries = manifest.read(s3_client, STATE_BUCKET, MANIFEST_KEY)
+    if entries is None:
+        logger.info(f"no manifest at s3://{STATE_BUCKET}/{MANIFEST_KEY}, building it")
+        refresh_manifest(event, None)
+        entries = manifest.read(s3_client, STATE_BUCKET, MANIFEST_KEY)
+    return entries
+
+
+def _run_id(event):
+    """
+    The run id (the step function execution name), or 'manual' when a lambda is invoked by hand.
+    """
+    return ((event or {}).get("run") or {}).get("id") or 'manual'
+
+
+def _dataset_profile(event):
+    if event is None:
+        return {}
+    return event.get("dataset") or {}
+
+
+def replay_s3(event, context):
+    logger.info(event)
+    """
+    Copy files from the 'reference' bucket to the trigger bucket at the rate
+    described by the 'replay' profile in the event (see src/replay.py) instead of
+    all at once.  One invocation replays until it nears its timeout and returns
+    its progress in 'replayState'; the state machine loops back here until
+    'done' is true, waiting 'waitSeconds' first when nothing is due before then,
+    so slow rates and long gaps in a 'replay' don't spin on empty invocations.
+    :param event:
+    :param context:
+    :return: replay progress, including where and when the next invocation should resume
+    """
+    profile = event["replay"]
+    state = event.get("replayState") or {
+        "startedAt": time.time(),
+        "offset": 0,
+        "keys": 0,
+        "bytes": 0,
+        "failedKeys": 0,
+        "maxLagSeconds": 0
+    }
+    subset = _dataset_profile(event)
+    objects = _under(dataset.multiply(dataset.select(_reference_objects(), subset), subset),
+                     _resources(event)["testPrefix"])
+    if profile.get("type") == "replay":
+        objects = sorted(objects, key=lambda obj: obj['LastModified'])
+
+    deadline = float('inf')
+    if context is not None:
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - COPY_DEADLINE_MARGIN
+    progress = {"released": 0, "maxLagSeconds": state["maxLagSeconds"], "done": False}
+    copy_log = latency.CopyLog()
+    stats = copier.copy_objects(
+        s3_client,
+        SRC_BUCKET,
+        TEST_BUCKET,
+        replay.paced(
+            replay.resume(replay.schedule(profile, objects), state["offset"]),
+            state["startedAt"],
+            deadline,
+            progress
+        ),
+        on_copied=copy_log
+    )
+    copy_log.write(s3_client, STATE_BUCKET, f"{COPY_LOG_PREFIX}{_run_id(event)}/replay-{state['offset']}.jsonl.gz")
+    state = {
+        "startedAt": state["startedAt"],
+        "offset": state["offset"] + progress["released"],
+        "keys": state["keys"] + stats["keys"],
+        "bytes": state["bytes"] + stats["bytes"],
+        "failedKeys": state["failedKeys"] + stats["failedKeys"],
+        "maxLagSeconds": progress["maxLagSeconds"],
+        "elapsedSeconds": round(time.time() - state["startedAt"], 3),
+        "waitSeconds": max(int(progress.get("nextDueAt", 0) - time.time()), 0),
+        "done": progress["done"]
+    }
+    logger.info(f"replay progress {state}")
+    return state
+
+
+def saturation_step(event, context):
+    logger.info(event)
+    """
+    One step of the saturation search (see src/saturation.py).  Release the
+    reference data set into the trigger bucket at the step's rate for
+    'stepSeconds', judge the step on the pipeline's metrics and ALARMS over its
+    window, and work out the next rate.  The state machine loops back here with
+    'saturationState' until 'done' is true.
+    :param event:
+    :param context:
+    :return: the steps so far, where the next one resumes and at what rate, and
+    the summary once the search is done
+    """
+    profile = saturation.resolve(event["saturation"], MAX_SATURATION_STEP_SECONDS)
+    state = event.get("saturationState") or {
+        "rate": float(profile["startRate"]),
+        "offset": 0,
+        "steps": []
+    }
+    resources = _resources(event)
+    subset = _dataset_profile(event)
+    objects = _under(dataset.multiply(dataset.select(_reference_objects(), subset), subset), resources["testPrefix"])
+
+    started_at = time.time()
+    deadline = started_at + float(profile["stepSeconds"])
+    if context is not None:
+        deadline = min(deadline, started_at + context.get_remaining_time_in_millis() / 1000 - COPY_DEADLINE_MARGIN)
+    progress = {"released": 0, "maxLagSeconds": 0, "done": False}
+    copy_log = latency.CopyLog()
+    stats = copier.copy_objects(
+        s3_client,
+        SRC_BUCKET,
+        TEST_BUCKET,
+        replay.paced(
+            replay.schedule({"type": "constant", "rate": state["rate"]}, replay.resume(objects, state["offset"])),
+            started_at,
+            deadline,
+            progress
+        ),
+        on_copied=copy_log
+    )
+    ended_at = time.time()
+    copy_log.write(s3_client, STATE_BUCKET, f"{COPY_LOG_PREFIX}{_run_id(event)}/saturation-{state['offset']}.jsonl.gz")
+
+    window = datetime.datetime.utcfromtimestamp(started_at), datetime.datetime.utcfromtimestamp(ended_at)
+    writer = _db_instance_identifiers(_database_profile(event), resources["cluster"])[0]
+    harvested = metrics.harvest(cloudwatch_client, LAMBDA_FUNCTIONS, writer, [CAPTURE_TRIGGER_QUEUE], *window)
+    alarm_results = alarms.collect(cloudwatch_client, ALARMS, *window)
+    observations, breaches = saturation.evaluate(
+        metrics.stage_table(harvested, LAMBDA_FUNCTIONS, stage),
+        harvested["rds"][writer],
+        CAPTURE_TRIGGER_QUEUE,
+        harvested["sqs"][CAPTURE_TRIGGER_QUEUE],
+        [name for name, result in alarm_results.items() if result["result"] == "FAIL"],
+        profile["slo"]
+    )
+    seconds = ended_at - started_at
+    steps = state["steps"] + [{
+        "rate": state["rate"],
+        "seconds": round(seconds, 3),
+        "released": progress["released"],
+        # ran for the whole of stepSeconds, rather than running out of data set or invocation time
+        "complete": not progress["done"] and deadline >= started_at + float(profile["stepSeconds"]),
+        "achievedRate": round(stats["keys"] / seconds, 3) if seconds > 0 else None,
+        "failedKeys": stats["failedKeys"],
+        "maxLagSeconds": progress["maxLagSeconds"],
+        "observations": observations,
+        "breaches": breaches
+    }]
+
+    rate = saturation.next_rate(profile, state["rate"])
+    stop_reason = None
+    if breaches:
+        stop_reason = "SLO_BREACHED"
+    elif progress["done"]:
+        stop_reason = "DATASET_EXHAUSTED"
+    elif steps[-1]["achievedRate"] is not None and steps[-1]["achievedRate"] < state["rate"] * MIN_INJECTED_SHARE:
+        stop_reason = "INJECTION_LIMITED"
+    elif rate > float(profile["maxRate"]):
+        stop_reason = "MAX_RATE"
+    state = {
+        "rate": rate,
+        "offset": state["offset"] + progress["released"],
+        "steps": steps,
+        "done": stop_reason is not None
+    }
+    if state["done"]:
+        state["summary"] = saturation.summarize(steps, stop_reason)
+    logger.info(f"saturation search {state}")
+    return state
 
 
 def restore_db_cluster(event, context):
@@ -179,42 +795,41 @@ def restore_db_cluster(event, context):
     is two days old.  If a specific snapshot needs to be used
     for the test, it can be passed in as part of an event when
     the step function is invoked with the key 'snapshotIdentifier'.
+    The engine version and cluster parameter group come from the 'database'
+    profile in the event.
 
     Restoring an aurora db cluster from snapshot takes one to two hours.
+    Passing 'clone': true (or the identifier of the cluster to clone) makes a
+    copy-on-write clone of CLONE_SOURCE_CLUSTER instead, which takes minutes.
+    A clone keeps the source's engine version.  If the clone can't be made the
+    snapshot is restored instead.
+    :return: how the cluster was created, and from what
     """
 
-    original = secrets_client.get_secret_value(
-        SecretId=NWCAPTURE_REAL
-    )
-    secret_string = json.loads(original['SecretString'])
+    secret_string = _get_secret_string(NWCAPTURE_REAL)
     kms_key = str(secret_string['KMS_KEY_ID'])
     subnet_name = str(secret_string['DB_SUBGROUP_NAME'])
     vpc_security_group_id = str(secret_string['VPC_SECURITY_GROUP_ID'])
     if not kms_key or not subnet_name or not vpc_security_group_id:
         raise Exception(f"Missing db configuration data {secret_string}")
-    my_snapshot_identifier = SNAPSHOT_IDENTIFIER
+    my_snapshot_identifier = _default_snapshot_identifier()
     if event is not None:
         if event.get("snapshotIdentifier") is not None:
             my_snapshot_identifier = event.get("snapshotIdentifier")
 
-    rds_client.restore_db_cluster_from_snapshot(
-        DBClusterIdentifier=DB_CLUSTER_IDENTIFIER,
-        SnapshotIdentifier=my_snapshot_identifier,
-        Engine=ENGINE,
-        EngineVersion='11.7',
-        Port=5432,
-        DBSubnetGroupName=subnet_name,
-        DatabaseName='nwcapture-load',
-        EnableIAMDatabaseAuthentication=False,
-        EngineMode='provisioned',
-        DBClusterParameterGroupName='aqts-capture',
-        DeletionProtection=False,
-        CopyTagsToSnapshot=False,
-        KmsKeyId=kms_key,
-        VpcSecurityGroupIds=[
+    profile = _database_profile(event)
+    cluster_settings = {
+        'DBClusterIdentifier': _resources(event)["cluster"],
+        'Port': 5432,
+        'DBSubnetGroupName': subnet_name,
+        'EnableIAMDatabaseAuthentication': False,
+        'DBClusterParameterGroupName': profile["parameterGroup"],
+        'DeletionProtection': False,
+        'CopyTagsToSnapshot': False,
+        'VpcSecurityGroupIds': [
             vpc_security_group_id
         ],
-        Tags=[
+        'Tags': [
             {
                 'Key': 'Name',
                 'Value': 'NWISWEB-CAPTURE-RDS-AURORA-LOAD-TEST'
@@ -236,7 +851,82 @@ def restore_db_cluster(event, context):
                 'Value': 'NWISWeb - Capture'
             }
         ]
+    }
+
+    clone = (event or {}).get("clone")
+    if clone:
+        source_cluster = clone if isinstance(clone, str) else CLONE_SOURCE_CLUSTER
+        try:
+            # no KmsKeyId, a clone has to stay on the source's key or it becomes a full copy
+            rds_client.restore_db_cluster_to_point_in_time(
+                SourceDBClusterIdentifier=source_cluster,
+                RestoreType='copy-on-write',
+                UseLatestRestorableTime=True,
+                **cluster_settings
+            )
+            return {"restoreType": "clone", "source": source_cluster}
+        except (rds_client.exceptions.DBClusterNotFoundFault,
+                rds_client.exceptions.InvalidDBClusterStateFault,
+                rds_client.exceptions.InvalidRestoreFault) as e:
+            logger.info(f"could not clone {source_cluster}, restoring {my_snapshot_identifier} instead: {repr(e)}")
+
+    rds_client.restore_db_cluster_from_snapshot(
+        SnapshotIdentifier=my_snapshot_identifier,
+        Engine=ENGINE,
+        EngineVersion=profile["engineVersion"],
+        DatabaseName='nwcapture-load',
+        EngineMode='provisioned',
+        KmsKeyId=kms_key,
+        **cluster_settings
     )
+    return {"restoreType": "snapshot", "source": my_snapshot_identifier}
+
+
+def check_load_db(event, context):
+    logger.info(event)
+    """
+    Where the load test cluster and its instances are at, so the state machine
+    can poll every few seconds for the cluster to become available, the
+    instances the 'database' profile asks for to become available, or all the
+    instances to be deleted, instead of retrying the next step every ten minutes.
+    :param event:
+    :param context:
+    :return: the cluster and instance statuses, whether each of those points has
+    been reached, and whether a keepWarm run can reuse the cluster as it is
+    """
+    resources = _resources(event)
+    try:
+        cluster = rds_client.describe_db_clusters(DBClusterIdentifier=resources["cluster"])['DBClusters'][0]
+    except rds_client.exceptions.DBClusterNotFoundFault:
+        cluster = None
+    instances = {}
+    if cluster is not None:
+        paginator = rds_client.get_paginator('describe_db_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'db-cluster-id', 'Values': [resources["cluster"]]}]):
+            for instance in page['DBInstances']:
+                instances[instance['DBInstanceIdentifier']] = instance['DBInstanceStatus']
+    failed = {name: status for name, status in instances.items() if status in DB_FAILED_STATUSES}
+    if cluster is not None and cluster['Status'] in DB_FAILED_STATUSES:
+        failed[resources["cluster"]] = cluster['Status']
+    # a run that already failed is tearing the cluster down, a failed cluster is no news then
+    if failed and "failure" not in (event or {}):
+        raise Exception(f"Load test db is in a failed state {failed}")
+    status = {
+        "namespace": resources["namespace"],
+        "cluster": resources["cluster"],
+        "clusterStatus": cluster['Status'] if cluster is not None else None,
+        "instances": instances,
+        "clusterAvailable": cluster is not None and cluster['Status'] == 'available',
+        "instancesAvailable": cluster is not None and all(
+            instances.get(name) == 'available'
+            for name in _db_instance_identifiers(_database_profile(event), resources["cluster"])),
+        "instancesDeleted": not instances,
+        "keepWarm": bool((event or {}).get("keepWarm"))
+    }
+    # a keepWarm run reuses the cluster a previous run left up
+    status["reusable"] = status["keepWarm"] and status["clusterAvailable"] and status["instancesAvailable"]
+    logger.info(f"load db status {status}")
+    return status
 
 
 def enable_trigger(event, context):
@@ -250,8 +940,9 @@ def enable_trigger(event, context):
     """
     active_dbs = _describe_db_clusters('stop')
     logger.info(f"active_dbs {active_dbs}")
-    if DB["LOAD"] in active_dbs:
-        logger.info(f"DB {DB['LOAD']} Active, going to enable trigger")
+    cluster = _resources(event)["cluster"]
+    if cluster in active_dbs:
+        logger.info(f"DB {cluster} Active, going to enable trigger")
         response = lambda_client.list_event_source_mappings(FunctionName=CAPTURE_TRIGGER)
         logger.info(f"Response from listing event source mappings trigger queue {response}")
         if len(response['EventSourceMappings']) == 0:
@@ -259,7 +950,7 @@ def enable_trigger(event, context):
         for item in response['EventSourceMappings']:
             lambda_client.update_event_source_mapping(UUID=item['UUID'], Enabled=True)
     else:
-        raise Exception("nwcapture-load db was off")
+        raise Exception(f"{cluster} db was off")
 
 
 def disable_trigger_if_real_db_is_off(event, context):
@@ -289,38 +980,224 @@ def add_notification_to_test_bucket(event, context):
     logger.info(f"real bucket response {response}")
 
 
+def purge_queues(event, context):
+    logger.info(event)
+    """
+    Purge the trigger and error queues, once the real bucket no longer feeds
+    them, so nothing left over from before is counted as the run's throughput.
+    The purge finishes in the background, checkQueuesDrained waits for it.
+    :param event:
+    :param context:
+    :return: which queues a purge was started on, and when
+    """
+    purged = {queue_name: switchover.purge(sqs_client, queue_name) for queue_name in PIPELINE_QUEUES}
+    return {"purged": purged, "purgedAt": time.time()}
+
+
+def check_queues_drained(event, context):
+    logger.info(event)
+    """
+    Check that the trigger and error queues are empty (visible, in flight and
+    delayed) and that no capture state machine executions are left running,
+    before the trigger is enabled and preTest starts the clock.  Both have to
+    read empty REQUIRED_SETTLED_POLLS times in a row, since the queue counts are
+    approximate.  A queue that still has messages a minute after it was purged
+    is purged again.  The previous poll is read from 'queueDrain' in the event,
+    and the last purge from 'queuePurge'.
+    :param event:
+    :param context:
+    :return: the queue depths and running executions, 'drained' is true when the run can start
+    """
+    previous = event.get("queueDrain") or {}
+    now = time.time()
+    wait_started_at = previous.get("waitStartedAt", now)
+    purged_at = previous.get("purgedAt") or (event.get("queuePurge") or {}).get("purgedAt") or 0
+    queues = {queue_name: switchover.queue_depth(sqs_client, queue_name) for queue_name in PIPELINE_QUEUES}
+    # an execution started before the switch would still be writing to capture.json_data during the run
+    running_executions = _running_capture_executions()
+    empty = sum(queues.values()) == 0 and running_executions == 0
+    empty_polls = previous.get("emptyPolls", 0) + 1 if empty else 0
+    if empty_polls == 0 and now - purged_at > switchover.PURGE_INTERVAL_SECONDS:
+        for queue_name, depth in queues.items():
+            if depth > 0:
+                switchover.purge(sqs_client, queue_name)
+        purged_at = now
+    if empty_polls == 0 and now - wait_started_at > MAX_DRAIN_SECONDS:
+        raise Exception(f"Queues still had messages or capture executions were still running after "
+                        f"{MAX_DRAIN_SECONDS}s, not starting the run {queues} {running_executions}")
+    drain = {
+        "drained": empty_polls >= REQUIRED_SETTLED_POLLS,
+        "queues": queues,
+        "runningExecutions": running_executions,
+        "emptyPolls": empty_polls,
+        "purgedAt": purged_at,
+        "waitStartedAt": wait_started_at
+    }
+    logger.info(f"queue drain {drain}")
+    return drain
+
+
 def wait_for_test_to_finish(event, context):
-    response = cloudwatch_client.get_metric_data(
-        MetricDataQueries=[
-            {
-                'Id': 'loadTestCpuUtilization',
-                'MetricStat': {
-                    'Metric': {
-                        'Namespace': 'AWS/RDS',
-                        'MetricName': 'CPUUtilization',
-                        'Dimensions': [
-                            {
-                                "Name": "DBInstanceIdentifier",
-                                "Value": DB_INSTANCE_IDENTIFIER
-                            }]
-                    },
-                    'Period': 60,
-                    'Stat': 'Maximum',
-                }
-            }
-        ],
-        StartTime=(datetime.datetime.now() - datetime.timedelta(seconds=300)).timestamp(),
-        EndTime=datetime.datetime.now().timestamp()
+    logger.info(event)
+    """
+    Check whether the capture pipeline has drained the test data.  Instead of
+    raising until the db goes idle, this returns a status that the state
+    machine loops on.  Three signals have to settle:
+    1. the trigger and error queues are empty (visible, in flight and delayed)
+    2. no capture state machine executions are running
+    3. capture.json_data has stopped growing since the previous poll
+    The previous poll's result is read from 'completion' in the event.  The wait
+    gives up (status TIMED_OUT) after 'maxWaitSeconds' (default MAX_WAIT_SECONDS).
+    :param event:
+    :param context:
+    :return: the completion status, 'complete' is true when the run is over
+    """
+    previous = (event or {}).get("completion") or {}
+    now = time.time()
+    wait_started_at = previous.get("waitStartedAt", now)
+    max_wait = int((event or {}).get("maxWaitSeconds", MAX_WAIT_SECONDS))
+
+    queues = {queue_name: switchover.queue_depth(sqs_client, queue_name) for queue_name in PIPELINE_QUEUES}
+    running_executions = _running_capture_executions()
+    with _connect_to_load_db(event) as rds:
+        json_data_inserts = throughput.sample(rds)["inserts"]
+
+    settled = (
+        sum(queues.values()) == 0
+        and running_executions == 0
+        and json_data_inserts == previous.get("jsonDataInserts")
+    )
+    settled_polls = previous.get("settledPolls", 0) + 1 if settled else 0
+    status = "RUNNING"
+    if settled_polls >= REQUIRED_SETTLED_POLLS:
+        status = "COMPLETE"
+    elif now - wait_started_at > max_wait:
+        status = "TIMED_OUT"
+    completion = {
+        "status": status,
+        "complete": status != "RUNNING",
+        "queues": queues,
+        "runningExecutions": running_executions,
+        "jsonDataInserts": json_data_inserts,
+        "settledPolls": settled_polls,
+        "waitStartedAt": wait_started_at,
+        "checkedAt": now
+    }
+    logger.info(f"completion {completion}")
+    if completion["complete"]:
+        # tells the throughput sampler to stop
+        _write_state_object(_run_state_key(event, COMPLETION_KEY), completion)
+    return completion
+
+
+def sample_throughput(event, context):
+    logger.info(event)
+    """
+    Take one sample of the capture.json_data insert count (from the table
+    statistics, not a count) and append it to the run's samples.  The state
+    machine calls this on a fixed interval alongside the load, until
+    waitForTestToFinish has declared the run complete.
+    :param event:
+    :param context:
+    :return: whether sampling should stop
+    """
+    with _connect_to_load_db(event) as rds:
+        current = throughput.sample(rds)
+    samples = _read_state_object(_run_state_key(event, THROUGHPUT_SAMPLES_KEY)) or {"samples": []}
+    samples["samples"].append(current)
+    _write_state_object(_run_state_key(event, THROUGHPUT_SAMPLES_KEY), samples)
+    completion = _read_state_object(_run_state_key(event, COMPLETION_KEY))
+    stop = completion is not None and completion["complete"]
+    if current["time"] - samples["samples"][0]["time"] > MAX_WAIT_SECONDS * 2:
+        logger.info("giving up on sampling, the run has gone on too long")
+        stop = True
+    return {"stop": stop, "samples": len(samples["samples"])}
+
+
+def _running_capture_executions():
+    """
+    Number of running capture state machine executions (capped at one page, we
+    only care whether it is zero).
+    """
+    response = sfn_client.list_executions(
+        stateMachineArn=_state_machine_arn(CAPTURE_STATE_MACHINE),
+        statusFilter='RUNNING',
+        maxResults=100
+    )
+    return len(response['executions'])
+
+
+_state_machine_arns = {}
+
+
+def _state_machine_arn(name):
+    if name not in _state_machine_arns:
+        paginator = sfn_client.get_paginator('list_state_machines')
+        for page in paginator.paginate():
+            for state_machine in page['stateMachines']:
+                if state_machine['name'] == name:
+                    _state_machine_arns[name] = state_machine['stateMachineArn']
+        if name not in _state_machine_arns:
+            raise Exception(f"Couldnt find state machine {name}")
+    return _state_machine_arns[name]
+
+
+def _load_db_address(event):
+    """
+    The run's cluster endpoint.  Cluster endpoints only differ in the cluster
+    identifier they start with, so it is worked out from the warm environment's
+    address in the secret, and is known before the cluster exists.  A run with a
+    namespace can't go on if the secret holds some other address, it would load
+    into the warm cluster, or whatever database that is, instead of its own.
+    """
+    address = str(_get_secret_string(NWCAPTURE_LOAD)['DATABASE_ADDRESS'])
+    cluster = _resources(event)["cluster"]
+    if address.startswith(f"{DB_CLUSTER_IDENTIFIER}."):
+        return cluster + address[len(DB_CLUSTER_IDENTIFIER):]
+    if cluster != DB_CLUSTER_IDENTIFIER:
+        raise Exception(f"The {NWCAPTURE_LOAD} DATABASE_ADDRESS {address} isn't a {DB_CLUSTER_IDENTIFIER} cluster "
+                        f"endpoint, {cluster}'s endpoint can't be worked out from it")
+    return address
+
+
+def _connect_to_load_db(event=None):
+    secret_string = _get_secret_string(NWCAPTURE_LOAD)
+    return clients.database(
+        _load_db_address(event),
+        secret_string['SCHEMA_OWNER_USERNAME'],
+        secret_string['DATABASE_NAME'],
+        secret_string['SCHEMA_OWNER_PASSWORD']
+    )
+
+
+def _connect_to_load_db_as_postgres(event=None):
+    """
+    The master user, whose password modifyDbCluster set, for what capture_owner
+    isn't allowed to do.
+    """
+    secret_string = _get_secret_string(NWCAPTURE_LOAD)
+    return clients.database(
+        _load_db_address(event),
+        'postgres',
+        secret_string['DATABASE_NAME'],
+        'Password123'
     )
-    for value in response['MetricDataResults'][0]['Values']:
-        if value > 0:
-            raise Exception(f"db is still busy at {datetime.datetime.now()}")
 
 
 def remove_notification_from_test_bucket(event, context):
     logger.info(event)
+    """
+    Switch the trigger queue back from the test bucket to the real bucket.  This
+    is also the first step of the cleanup after a failed run, which may not have
+    got as far as the switch, so the real bucket is only given back what was taken
+    off it, or the default notification if it has none.
+    """
     response = _remove_notification_from_bucket(TEST_BUCKET)
     logger.info(f"test bucket response {response}")
+    if (_read_state_object(f"{NOTIFICATION_STASH_PREFIX}{REAL_BUCKET}.json") is None
+            and switchover.notifies(s3_client, REAL_BUCKET, switchover.queue_arn(sqs_client, CAPTURE_TRIGGER_QUEUE))):
+        logger.info(f"{REAL_BUCKET} still notifies {CAPTURE_TRIGGER_QUEUE}")
+        return
     response = _add_notification_to_bucket(REAL_BUCKET)
     logger.info(f"real bucket response {response}")
 
@@ -337,83 +1214,394 @@ def run_integration_tests(event, context):
     :return:
     """
 
-    original = secrets_client.get_secret_value(
-        SecretId=NWCAPTURE_LOAD,
-    )
-    secret_string = json.loads(original['SecretString'])
-    db_host = secret_string['DATABASE_ADDRESS']
-    db_user = secret_string['SCHEMA_OWNER_USERNAME']
-    db_name = secret_string['DATABASE_NAME']
-    db_password = secret_string['SCHEMA_OWNER_PASSWORD']
-
-    logger.info(f"{db_host} {db_user} {db_name} {db_password}")
-    rds = RDS(db_host, db_user, db_name, db_password)
-    sql = "select count(1) from capture.json_data"
-    result = rds.execute_sql(sql)
-    logger.info(f"RESULT: {result}")
-
-    obj = s3.Object('iow-retriever-capture-load', 'TEST_RESULTS')
+    resources = _resources(event)
+    with _connect_to_load_db(event) as rds:
+        validation = rds.execute_batch({
+            "jsonData": throughput.SAMPLE_SQL,
+            "captureTables": CAPTURE_TABLES_SQL
+        })
+    end_sample = throughput.from_rows(validation["jsonData"])
+    logger.info(f"RESULT: {end_sample}")
+
+    obj = s3_client.get_object(Bucket=STATE_BUCKET, Key=resources["resultsKey"])
     logger.info(f"read content from S3: {obj}")
-    content = json.loads(obj.get()['Body'].read().decode('utf-8'))
+    content = json.loads(obj['Body'].read().decode('utf-8'))
     logger.info(f"after json loads {content}")
     content["End Time"] = str(datetime.datetime.now())
-    content["End Count"] = result
+    content["End Count"] = end_sample["estimatedRows"]
+    content["RowsInserted"] = end_sample["inserts"] - content["StartSample"]["inserts"]
+    samples = _read_state_object(_run_state_key(event, THROUGHPUT_SAMPLES_KEY)) or {"samples": [content["StartSample"]]}
+    content["Throughput"] = throughput.curve(samples["samples"] + [end_sample])
+    content["CaptureTables"] = validation["captureTables"]
+    copied = latency.read_copy_logs(s3_client, STATE_BUCKET, f"{COPY_LOG_PREFIX}{_run_id(event)}/")
+    content["CopiedObjects"] = len(copied)
+    content["Latency"], unavailable = _object_latency(event, copied, content.get("JsonDataStartId"))
+    if unavailable is not None:
+        content["LatencyUnavailable"] = unavailable
+    content["DatabaseStatistics"] = _database_statistics(event)
+    reference = manifest.read(s3_client, STATE_BUCKET, MANIFEST_KEY)
+    if reference is not None:
+        content["ReferenceDataSet"] = reference.header
 
     start_date_time_obj = datetime.datetime.strptime(content["StartTime"], '%Y-%m-%d %H:%M:%S.%f')
 
     elapsed_time = datetime.datetime.now().timestamp() - start_date_time_obj.timestamp()
 
-    for alarm in ALARMS:
-        response = _get_cloudwatch_alarm_history(start_date_time_obj, alarm)
-        content = _update_results_for_alarm(response, content, alarm)
+    content["Alarms"] = alarms.collect(cloudwatch_client, ALARMS, start_date_time_obj, datetime.datetime.now())
 
     content["ElapsedTimeInSeconds"] = elapsed_time
 
+    writer = _db_instance_identifiers(_database_profile(event), resources["cluster"])[0]
+    harvested = metrics.harvest(
+        cloudwatch_client,
+        LAMBDA_FUNCTIONS,
+        writer,
+        [CAPTURE_TRIGGER_QUEUE, ERROR_QUEUE],
+        start_date_time_obj,
+        datetime.datetime.now()
+    )
+    content["Pipeline"] = metrics.stage_table(harvested, LAMBDA_FUNCTIONS, stage)
+    content["Database"] = harvested["rds"][writer]
+    content["Queues"] = harvested["sqs"]
+    content["Efficiency"] = _efficiency(event, content, harvested, resources["cluster"])
+    if event is not None and event.get("completion") is not None:
+        content["Completion"] = event["completion"]
+    if event is not None and event.get("baselineReset") is not None:
+        # the run started on a reused warm cluster
+        content["BaselineReset"] = event["baselineReset"]
+    search = (event or {}).get("saturationState") or {}
+    if search.get("summary") is not None:
+        content["Saturation"] = dict(search["summary"], stepResults=search["steps"])
+
     logger.info(f"Writing this to S3 {json.dumps(content)}")
-    s3.Object('iow-retriever-capture-load', 'TEST_RESULTS').put(Body=json.dumps(content))
-
-
-def _update_results_for_alarm(response, content, alarm):
-    is_alarm = False
-    history_list = []
-    for item in response['AlarmHistoryItems']:
-        history_list.append(item['HistorySummary'])
-        if "to ALARM" in item['HistorySummary']:
-            is_alarm = True
-    if is_alarm is True:
-        content[alarm] = f"FAIL {history_list}"
+    s3_client.put_object(Bucket=STATE_BUCKET, Key=resources["resultsKey"], Body=json.dumps(content))
+    _store_results(event, content)
+
+
+def _object_latency(event, copied, start_id):
+    """
+    Match the files the run copied with the first time each one showed up in
+    capture.json_data (the rows after start_id, the last id before the run),
+    streaming the json_data side through a server side cursor.  The latency is
+    left out of the report, rather than failing it, if it can't be worked out.
+    :return: the latency summary, or None and the reason it was left out
+    """
+    if not copied:
+        return None, "the run copied no files"
+    if start_id is None:
+        return None, f"preTest could not record the last capture.json_data {JSON_DATA_ID_COLUMN}"
+    try:
+        with _connect_to_load_db(event) as rds:
+            missing = latency.missing_columns(rds, [JSON_DATA_KEY_COLUMN, JSON_DATA_TIME_COLUMN, JSON_DATA_ID_COLUMN])
+            if missing:
+                return None, f"capture.json_data has no column {missing}, set the JSON_DATA_*_COLUMN variables"
+            latencies, matched = latency.match(
+                copied,
+                rds.stream(latency.first_seen_sql(JSON_DATA_KEY_COLUMN, JSON_DATA_TIME_COLUMN, JSON_DATA_ID_COLUMN),
+                           (start_id,)),
+                TEST_BUCKET
+            )
+    except psycopg2.Error as e:
+        logger.info(f"could not read the first appearance of the copied files: {repr(e)}")
+        return None, repr(e)
+    return latency.summarize(latencies, len(copied), matched), None
+
+
+def _database_statistics(event):
+    """
+    What the database spent the run on, against the snapshot preTest took.
+    """
+    start = _read_state_object(_run_state_key(event, DB_STATS_KEY))
+    if start is None:
+        return None
+    with _connect_to_load_db_as_postgres(event) as rds:
+        end = dbstats.snapshot(rds)
+    return dbstats.compare(start, end)
+
+
+def _efficiency(event, content, harvested, cluster):
+    """
+    Throughput per unit of capacity (see src/cost.py): the cluster's instance
+    hours, the pipeline's GB-seconds and the objects and rows the run put
+    through, priced with the run's 'prices' on top of cost.PRICES.
+    """
+    started_at = ((event or {}).get("run") or {}).get("startedAt")
+    if started_at:
+        start_time = datetime.datetime.fromisoformat(started_at.replace('Z', '+00:00'))
     else:
-        content[alarm] = f"PASS: {history_list}"
-    return content
+        # lambdas run in UTC, so the naive StartTime is UTC
+        start_time = datetime.datetime.strptime(content["StartTime"], '%Y-%m-%d %H:%M:%S.%f').replace(
+            tzinfo=datetime.timezone.utc)
+    paginator = rds_client.get_paginator('describe_db_instances')
+    instances = [
+        instance
+        for page in paginator.paginate(Filters=[{'Name': 'db-cluster-id', 'Values': [cluster]}])
+        for instance in page['DBInstances']
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(LAMBDA_FUNCTIONS)) as executor:
+        memory_sizes = dict(zip(LAMBDA_FUNCTIONS, executor.map(
+            lambda name: lambda_client.get_function_configuration(FunctionName=name)['MemorySize'], LAMBDA_FUNCTIONS)))
+    iops = [content["Database"].get(name) for name in ('ReadIOPSAverage', 'WriteIOPSAverage')]
+    return cost.efficiency(
+        content["ElapsedTimeInSeconds"],
+        content["CopiedObjects"],
+        content["RowsInserted"],
+        cost.instance_hours(instances, start_time, datetime.datetime.now(datetime.timezone.utc)),
+        cost.lambda_usage(harvested, memory_sizes),
+        sum(value for value in iops if value is not None) if any(value is not None for value in iops) else None,
+        cost.price_table((event or {}).get("prices"))
+    )
+
+
+def _store_results(event, content):
+    """
+    Keep the run's results under its run id (the step function execution name)
+    and add it to the index of runs, so runs can be compared with each other.
+    """
+    event = event or {}
+    run_id = (event.get("run") or {}).get("id") or content["StartTime"].replace(' ', 'T')
+    header = {
+        "runId": run_id,
+        "namespace": _namespace(event),
+        "startTime": content["StartTime"],
+        "endTime": content["End Time"],
+        # a warm or cloned cluster isn't a freshly restored snapshot, those runs are only compared with each other
+        "configuration": dict({name: event.get(name)
+                               for name in ("dataset", "database", "concurrency", "replay", "saturation")},
+                              keepWarm=bool(event.get("keepWarm")), clone=event.get("clone") or None)
+    }
+    rows = list(results.metric_rows(content))
+    results.write_run(s3_client, STATE_BUCKET, f"{RESULTS_PREFIX}runs/{run_id}.jsonl.gz", header, rows)
+    results.add_to_index(s3_client, STATE_BUCKET, RESULTS_INDEX_KEY, dict(header, metrics=results.headline(rows)))
+
+
+def compare_results(event, context):
+    logger.info(event)
+    """
+    Compare this run with the previous runs of the same configuration and flag
+    any throughput or latency regressions.  'regressionThreshold' (a share,
+    default 0.1) and 'regressionWindow' (how many earlier runs, default 5) can
+    be passed in the event.  The state machine fails the execution at the end,
+    after cleaning up, if anything regressed.
+    :param event:
+    :param context:
+    :return: the comparison, 'regressed' is true if anything regressed
+    """
+    run_id = event["run"]["id"]
+    index = results.read_index(s3_client, STATE_BUCKET, RESULTS_INDEX_KEY)
+    current = next((entry for entry in index if entry["runId"] == run_id), None)
+    if current is None:
+        raise Exception(f"Run {run_id} is not in the results index s3://{STATE_BUCKET}/{RESULTS_INDEX_KEY}")
+    comparison = results.compare(
+        current,
+        index,
+        threshold=float(event.get("regressionThreshold", results.DEFAULT_THRESHOLD)),
+        window=int(event.get("regressionWindow", results.DEFAULT_WINDOW))
+    )
+    logger.info(f"comparison {comparison}")
+    return comparison
 
 
 def pre_test(event, context):
     logger.info(event)
     """
     This is a place holder that will inspect the beginning state of the load test db
-    and save some data so that it can be compared with the db after the integration tests run
+    and save some data so that it can be compared with the db after the integration tests run.
+    The first keepWarm run on a cluster also records the baseline later runs are reset to.
+    pg_stat_statements is reset and the database statistics are snapshotted, for
+    runIntegrationTests to report the run's share of them.
     :param event:
     :param context:
     :return:
     """
-    original = secrets_client.get_secret_value(
-        SecretId=NWCAPTURE_LOAD,
-    )
-    secret_string = json.loads(original['SecretString'])
-    logger.info(f"retrieving secrets from {NWCAPTURE_LOAD} {secret_string}")
-    db_host = secret_string['DATABASE_ADDRESS']
-    db_user = secret_string['SCHEMA_OWNER_USERNAME']
-    db_name = secret_string['DATABASE_NAME']
-    db_password = secret_string['SCHEMA_OWNER_PASSWORD']
-    logger.info(f"db_host= {db_host} db_password= {db_password}")
-    rds = RDS(db_host, db_user, db_name, db_password)
-    sql = "select count(1) from capture.json_data"
-    result = rds.execute_sql(sql)
-    logger.info(f"RESULT: {result}")
-
-    content = {"StartTime": str(datetime.datetime.now()), "StartCount": result}
+    with _connect_to_load_db(event) as rds:
+        start_sample = throughput.sample(rds)
+        json_data_start_id = _json_data_last_id(rds)
+        if (event or {}).get("keepWarm") and _read_baseline(event) is None:
+            _write_state_object(BASELINE_KEY, {
+                "clusterCreateTime": _cluster_create_time(event),
+                "recordedAt": str(datetime.datetime.now()),
+                "tables": baseline.record(rds)
+            })
+    with _connect_to_load_db_as_postgres(event) as rds:
+        statements_reset = dbstats.reset(rds)
+        _write_state_object(_run_state_key(event, DB_STATS_KEY),
+                            dict(dbstats.snapshot(rds), statementsReset=statements_reset))
+    logger.info(f"RESULT: {start_sample}")
+    _write_state_object(_run_state_key(event, THROUGHPUT_SAMPLES_KEY), {"samples": [start_sample]})
+    s3_client.delete_object(Bucket=STATE_BUCKET, Key=_run_state_key(event, COMPLETION_KEY))
+
+    content = {
+        "StartTime": str(datetime.datetime.now()),
+        "StartCount": start_sample["estimatedRows"],
+        "StartSample": start_sample,
+        "JsonDataStartId": json_data_start_id,
+        "Dataset": _dataset_profile(event),
+        "DatabaseConfiguration": _database_profile(event)
+    }
     logger.info(f"Writing this to S3 {json.dumps(content)}")
-    s3.Object('iow-retriever-capture-load', 'TEST_RESULTS').put(Body=json.dumps(content))
+    s3_client.put_object(Bucket=STATE_BUCKET, Key=_resources(event)["resultsKey"], Body=json.dumps(content))
+
+
+def _json_data_last_id(rds):
+    """
+    The last capture.json_data id before the run, None if the id column isn't there.
+    """
+    if latency.missing_columns(rds, [JSON_DATA_ID_COLUMN]):
+        logger.info(f"capture.json_data has no {JSON_DATA_ID_COLUMN}, the per object latency will be left out")
+        return None
+    return rds.execute_sql(latency.last_id_sql(JSON_DATA_ID_COLUMN))[0] or 0
+
+
+def reset_to_baseline(event, context):
+    logger.info(event)
+    """
+    Delete what earlier runs added to the capture tables of a warm cluster, back
+    to the baseline the first keepWarm run recorded.  Fails the run if a table
+    can't be reset.
+    :param event:
+    :param context:
+    :return: the rows deleted from each table, and the updates to each table since the baseline
+    """
+    recorded = _read_baseline(event)
+    if recorded is None:
+        logger.info("no baseline for this cluster yet, nothing to reset")
+        return {"deleted": {}, "updatedSinceBaseline": {}}
+    with _connect_to_load_db(event) as rds:
+        return baseline.reset(rds, recorded["tables"])
+
+
+def keep_warm(event, context):
+    logger.info(event)
+    """
+    Leave the cluster up after a keepWarm run, until expireWarmEnvironment
+    tears it down 'warmTtlHours' from now.
+    :param event:
+    :param context:
+    :return: when the warm environment expires
+    """
+    ttl_hours = float((event or {}).get("warmTtlHours", WARM_TTL_HOURS))
+    warm = {
+        "clusterCreateTime": _cluster_create_time(event),
+        "ttlHours": ttl_hours,
+        "updatedAt": time.time(),
+        "expiresAt": time.time() + ttl_hours * 60 * 60
+    }
+    _write_state_object(WARM_ENVIRONMENT_KEY, warm)
+    return warm
+
+
+def expire_warm_environment(event, context):
+    logger.info(event)
+    """
+    Runs on a schedule.  Once a warm environment has expired, and no load test
+    is running, delete its instances and then (on a later run, once they are
+    gone) the cluster.
+    :param event:
+    :param context:
+    :return: what was done
+    """
+    warm = _read_state_object(WARM_ENVIRONMENT_KEY)
+    if warm is None or warm["expiresAt"] > time.time():
+        return {"action": "none", "warm": warm}
+    running = sfn_client.list_executions(
+        stateMachineArn=_state_machine_arn(LOAD_TEST_STATE_MACHINE),
+        statusFilter='RUNNING',
+        maxResults=1
+    )
+    if running['executions']:
+        return {"action": "none", "reason": "a load test is running", "warm": warm}
+    instances = delete_db_instance(event, context)
+    if instances:
+        return {"action": "deleteDbInstances", "instances": instances}
+    delete_db_cluster(event, context)
+    return {"action": "deleteDbCluster"}
+
+
+def _read_baseline(event):
+    """
+    The recorded baseline, if it belongs to the cluster that is up now.
+    """
+    recorded = _read_state_object(BASELINE_KEY)
+    if recorded is not None and recorded["clusterCreateTime"] != _cluster_create_time(event):
+        logger.info(f"ignoring the baseline of an earlier cluster {recorded['clusterCreateTime']}")
+        return None
+    return recorded
+
+
+def _cluster_create_time(event):
+    response = rds_client.describe_db_clusters(DBClusterIdentifier=_resources(event)["cluster"])
+    return str(response['DBClusters'][0]['ClusterCreateTime'])
+
+
+def acquire_pipeline(event, context):
+    logger.info(event)
+    """
+    Ask for the pipeline lease, or check whether it has come to this run yet.
+    Requests are kept under PIPELINE_LEASE_PREFIX, named by when they were made,
+    and the lease is held by the earliest request whose execution is still
+    running.  The requests of executions that ended without giving the lease up
+    (failed or aborted) are cleared away here.  Lambdas invoked by hand, which
+    have no run, always get the pipeline.
+    :param event:
+    :param context:
+    :return: whether this run holds the lease, who does, and how many runs are ahead of this one
+    """
+    run_id = ((event or {}).get("run") or {}).get("id")
+    if not run_id:
+        return {"acquired": True, "holder": None, "ahead": 0}
+    requests = _pipeline_lease_requests()
+    if run_id not in requests.values():
+        key = f"{PIPELINE_LEASE_PREFIX}{datetime.datetime.utcnow():%Y%m%dT%H%M%S%f}-{run_id}"
+        _write_state_object(key, {"runId": run_id, "requestedAt": str(datetime.datetime.now())})
+        requests = _pipeline_lease_requests()
+    running = _running_load_test_executions()
+    queue = []
+    for key, requester in requests.items():
+        if requester in running:
+            queue.append(requester)
+        else:
+            logger.info(f"clearing the lease request of {requester}, it is no longer running")
+            s3_client.delete_object(Bucket=STATE_BUCKET, Key=key)
+    lease = {
+        "acquired": bool(queue) and queue[0] == run_id,
+        "holder": queue[0] if queue else None,
+        "ahead": queue.index(run_id) if run_id in queue else len(queue)
+    }
+    logger.info(f"pipeline lease {lease}")
+    return lease
+
+
+def release_pipeline(event, context):
+    logger.info(event)
+    """
+    Give up the pipeline lease (or the request for it), once the pipeline
+    functions are back to normal.
+    """
+    run_id = ((event or {}).get("run") or {}).get("id")
+    for key, requester in _pipeline_lease_requests().items():
+        if requester == run_id:
+            s3_client.delete_object(Bucket=STATE_BUCKET, Key=key)
+
+
+def _pipeline_lease_requests():
+    """
+    :return: dict of request key -> run id, earliest request first
+    """
+    requests = {}
+    for obj in copier.list_objects(s3_client, STATE_BUCKET, prefix=PIPELINE_LEASE_PREFIX):
+        # keys are <request time>-<run id>
+        requests[obj['Key']] = obj['Key'][len(PIPELINE_LEASE_PREFIX):].split('-', 1)[1]
+    return dict(sorted(requests.items()))
+
+
+def _running_load_test_executions():
+    running = set()
+    paginator = sfn_client.get_paginator('list_executions')
+    for page in paginator.paginate(stateMachineArn=_state_machine_arn(LOAD_TEST_STATE_MACHINE),
+                                   statusFilter='RUNNING'):
+        running.update(execution['name'] for execution in page['executions'])
+    return running
 
 
 def falsify_secrets(event, context):
@@ -430,12 +1618,111 @@ def falsify_secrets(event, context):
     :param context:
     :return:
     """
-    _replace_secrets(NWCAPTURE_LOAD)
+    return _replace_secrets(NWCAPTURE_LOAD, _load_db_address(event))
 
 
 def restore_secrets(event, context):
     logger.info(event)
-    _replace_secrets(NWCAPTURE_REAL)
+    return _replace_secrets(NWCAPTURE_REAL)
+
+
+def apply_concurrency_profile(event, context):
+    logger.info(event)
+    """
+    Apply the 'concurrency' profile in the event (see src/concurrency.py) to
+    every function in LAMBDA_FUNCTIONS, after recording the current value of
+    every setting it changes so restoreConcurrencyProfile can put them back.  If the settings of an
+    earlier run were never restored they are kept, so what gets restored is
+    always what was deployed.  A 'qualifier' whose environment isn't the one
+    falsifySecrets gave $LATEST would send the load to the real database, so
+    the profile is refused.
+    :param event:
+    :param context:
+    :return: the resolved profile and what was changed on each function
+    """
+    profile = concurrency.resolve((event or {}).get("concurrency"))
+    if not profile:
+        return {"profile": profile, "functions": {}}
+    qualifier = profile.get("qualifier")
+    settings = {
+        lambda_function: concurrency.settings_for(profile, _stage_name(lambda_function))
+        for lambda_function in LAMBDA_FUNCTIONS
+    }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(LAMBDA_FUNCTIONS)) as executor:
+        if qualifier:
+            stale = [name for name, same in zip(LAMBDA_FUNCTIONS, executor.map(
+                lambda name: concurrency.same_environment(lambda_client, name, qualifier), LAMBDA_FUNCTIONS))
+                if not same]
+            if stale:
+                raise Exception(f"{qualifier} of {stale} doesn't have the load test environment, publish a version "
+                                f"after falsifySecrets and point {qualifier} at it")
+        originals = _read_state_object(CONCURRENCY_ORIGINALS_KEY)
+        if originals is None:
+            originals = {
+                "qualifier": qualifier,
+                "functions": {
+                    name: {setting: value for setting, value in deployed.items() if setting in settings[name]}
+                    for name, deployed in zip(LAMBDA_FUNCTIONS, executor.map(
+                        lambda name: concurrency.snapshot(lambda_client, name, qualifier), LAMBDA_FUNCTIONS))
+                }
+            }
+            _write_state_object(CONCURRENCY_ORIGINALS_KEY, originals)
+        else:
+            logger.info(f"keeping the unrestored settings of an earlier run {originals}")
+        changed = dict(zip(LAMBDA_FUNCTIONS, executor.map(
+            lambda name: concurrency.apply(lambda_client, name, settings[name], qualifier, _wait_for_function_update),
+            LAMBDA_FUNCTIONS
+        )))
+    return {"profile": profile, "functions": changed}
+
+
+def check_concurrency_profile(event, context):
+    logger.info(event)
+    """
+    Provisioned concurrency takes a few minutes to allocate.  The state machine
+    loops on this until every function's provisioned concurrency is READY.
+    :param event:
+    :param context:
+    :return: whether the profile is ready, and the status of each function
+    """
+    profile = concurrency.resolve((event or {}).get("concurrency"))
+    qualifier = profile.get("qualifier")
+    if not qualifier:
+        return {"ready": True, "functions": {}}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(LAMBDA_FUNCTIONS)) as executor:
+        statuses = dict(zip(LAMBDA_FUNCTIONS, executor.map(
+            lambda name: concurrency.provisioned_status(lambda_client, name, qualifier), LAMBDA_FUNCTIONS)))
+    failed = [name for name, status in statuses.items() if status == 'FAILED']
+    if failed:
+        raise Exception(f"Provisioned concurrency failed for {failed}")
+    return {"ready": all(status != 'IN_PROGRESS' for status in statuses.values()), "functions": statuses}
+
+
+def restore_concurrency_profile(event, context):
+    logger.info(event)
+    """
+    Put back the settings apply_concurrency_profile recorded.  Runs alongside
+    restoreSecrets, both update the function configurations, so the memory
+    size updates wait their turn.
+    :param event:
+    :param context:
+    :return: the functions that were restored
+    """
+    originals = _read_state_object(CONCURRENCY_ORIGINALS_KEY)
+    if originals is None:
+        return {"restored": []}
+    qualifier = originals.get("qualifier")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(LAMBDA_FUNCTIONS)) as executor:
+        list(executor.map(
+            lambda item: concurrency.apply(lambda_client, item[0], item[1], qualifier, _wait_for_function_update),
+            originals["functions"].items()
+        ))
+    s3_client.delete_object(Bucket=STATE_BUCKET, Key=CONCURRENCY_ORIGINALS_KEY)
+    return {"restored": sorted(originals["functions"])}
+
+
+def _stage_name(lambda_function):
+    return lambda_function.split(f"-{stage}-")[0]
 
 
 def modify_schema_owner_password(event, context):
@@ -448,65 +1735,94 @@ def modify_schema_owner_password(event, context):
     :param context:
     :return:
     """
-    original = secrets_client.get_secret_value(
-        SecretId=NWCAPTURE_LOAD,
-    )
-    secret_string = json.loads(original['SecretString'])
-    db_host = secret_string['DATABASE_ADDRESS']
-    db_name = secret_string['DATABASE_NAME']
-    rds = RDS(db_host, 'postgres', db_name, 'Password123')
     sql = "alter user capture_owner with password 'Password123'"
-    rds.alter_permissions(sql)
+    with _connect_to_load_db_as_postgres(event) as rds:
+        rds.alter_permissions(sql)
 
-    sqs = boto3.client('sqs', os.getenv('AWS_DEPLOYMENT_REGION'))
-    queue_info = sqs.get_queue_url(QueueName=CAPTURE_TRIGGER_QUEUE)
-    sqs.purge_queue(QueueUrl=queue_info['QueueUrl'])
-    queue_info = sqs.get_queue_url(QueueName=ERROR_QUEUE)
-    sqs.purge_queue(QueueUrl=queue_info['QueueUrl'])
 
-
-def _replace_secrets(secret_id):
-    original = secrets_client.get_secret_value(
-        SecretId=secret_id
-    )
-    secret_string = json.loads(original['SecretString'])
+def _replace_secrets(secret_id, db_address=None):
+    """
+    Point every function in LAMBDA_FUNCTIONS at the database in the secret, or
+    at db_address with the secret's password.
+    All the configurations are read in parallel, only the functions whose
+    environment actually changes are updated (also in parallel), and then we
+    wait for every update to finish so the next step never invokes a function
+    that is still switching over.
+    :return: the functions that were updated and the ones that already matched
+    """
+    secret_string = _get_secret_string(secret_id)
     db_password = str(secret_string['SCHEMA_OWNER_PASSWORD'])
-    db_address = str(secret_string['DATABASE_ADDRESS'])
+    db_address = db_address or str(secret_string['DATABASE_ADDRESS'])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(LAMBDA_FUNCTIONS)) as executor:
+        configurations = dict(zip(
+            LAMBDA_FUNCTIONS,
+            executor.map(lambda name: lambda_client.get_function_configuration(FunctionName=name), LAMBDA_FUNCTIONS)
+        ))
+        changes = {}
+        for lambda_function, configuration in configurations.items():
+            my_env_variables = configuration['Environment']['Variables']
+            new_env_variables = _with_db_secrets(my_env_variables, db_password, db_address)
+            if new_env_variables != my_env_variables:
+                changes[lambda_function] = new_env_variables
+        logger.info(f"updating {sorted(changes)}, already up to date {sorted(set(configurations) - set(changes))}")
+
+        def _update(lambda_function):
+            concurrency.update_function_configuration(
+                lambda_client,
+                lambda_function,
+                _wait_for_function_update,
+                Environment={
+                    'Variables': changes[lambda_function]
+                }
+            )
+
+        list(executor.map(_update, changes))
+    return {"updated": sorted(changes), "unchanged": sorted(set(configurations) - set(changes))}
+
+
+def _with_db_secrets(env_variables, db_password, db_address):
+    my_env_variables = dict(env_variables)
+    if my_env_variables.get("AQTS_SCHEMA_OWNER_PASSWORD") is not None:
+        my_env_variables["AQTS_SCHEMA_OWNER_PASSWORD"] = db_password
+    elif my_env_variables.get("TRANSFORM_SCHEMA_OWNER_PASSWORD") is not None:
+        my_env_variables["TRANSFORM_SCHEMA_OWNER_PASSWORD"] = db_password
+    if my_env_variables.get("AQTS_DATABASE_ADDRESS") is not None:
+        my_env_variables["AQTS_DATABASE_ADDRESS"] = db_address
+    elif my_env_variables.get("TRANSFORM_DATABASE_ADDRESS") is not None:
+        my_env_variables["TRANSFORM_DATABASE_ADDRESS"] = db_address
+    if my_env_variables.get("DB_PASSWORD") is not None:
+        my_env_variables["DB_PASSWORD"] = db_password
+    if my_env_variables.get("DB_HOST") is not None:
+        my_env_variables["DB_HOST"] = db_address
+    return my_env_variables
+
+
+def _wait_for_function_update(lambda_function):
+    """
+    Block until the function's LastUpdateStatus is Successful (raises if it Failed).
+    """
+    lambda_client.get_waiter('function_updated').wait(
+        FunctionName=lambda_function,
+        WaiterConfig={
+            'Delay': 2,
+            'MaxAttempts': 60
+        }
+    )
 
-    for lambda_function in LAMBDA_FUNCTIONS:
 
-        response = lambda_client.get_function_configuration(
-            FunctionName=lambda_function
-        )
-        my_env_variables = response['Environment']['Variables']
-        logger.info(f"BEFORE function {lambda_function} my_env_variables= {my_env_variables}")
-        if my_env_variables.get("AQTS_SCHEMA_OWNER_PASSWORD") is not None:
-            my_env_variables["AQTS_SCHEMA_OWNER_PASSWORD"] = db_password
-        elif my_env_variables.get("TRANSFORM_SCHEMA_OWNER_PASSWORD") is not None:
-            my_env_variables["TRANSFORM_SCHEMA_OWNER_PASSWORD"] = db_password
-        if my_env_variables.get("AQTS_DATABASE_ADDRESS") is not None:
-            my_env_variables["AQTS_DATABASE_ADDRESS"] = db_address
-        elif my_env_variables.get("TRANSFORM_DATABASE_ADDRESS") is not None:
-            my_env_variables["TRANSFORM_DATABASE_ADDRESS"] = db_address
-        if my_env_variables.get("DB_PASSWORD") is not None:
-            my_env_variables["DB_PASSWORD"] = db_password
-        if my_env_variables.get("DB_HOST") is not None:
-            my_env_variables["DB_HOST"] = db_address
-
-        logger.info(f"AFTER function {lambda_function} my_env_variables= {my_env_variables}")
-
-        lambda_client.update_function_configuration(
-            FunctionName=lambda_function,
-            Environment={
-                'Variables': my_env_variables
-            }
-        )
+def _default_snapshot_identifier():
+    """
+    The production snapshot from two days ago, worked out per invocation since
+    a warm container can outlive the day it started on.
+    """
+    two_days_ago = datetime.datetime.now() - datetime.timedelta(2)
+    return f"rds:nwcapture-prod-external-{two_days_ago:%Y-%m-%d}-10-08"
 
 
 def _describe_db_clusters(action):
     # Get all the instances
-    my_rds = boto3.client('rds', os.getenv('AWS_DEPLOYMENT_REGION', 'us-west-2'))
-    response = my_rds.describe_db_clusters()
+    response = rds_client.describe_db_clusters()
     all_dbs = response['DBClusters']
     if action == "stop":
         # Filter on the ones that are running
@@ -515,58 +1831,62 @@ def _describe_db_clusters(action):
 
 
 def _remove_notification_from_bucket(bucket_name):
-    bucket_notification = s3.BucketNotification(bucket_name)
-    bucket_notification.load()
-    response = bucket_notification.put(
-        NotificationConfiguration={
-            'QueueConfigurations': [
-            ]
-        }
-    )
-    bucket_notification.load()
-    return response
+    """
+    Stop the bucket notifying the trigger queue, keeping what was taken out so
+    _add_notification_to_bucket can put it back the way it was.
+    """
+    removed = switchover.remove_queue_notifications(
+        s3_client, bucket_name, switchover.queue_arn(sqs_client, CAPTURE_TRIGGER_QUEUE))
+    if removed:
+        _write_state_object(f"{NOTIFICATION_STASH_PREFIX}{bucket_name}.json", removed)
+    return removed
 
 
 def _add_notification_to_bucket(bucket_name):
-    bucket_notification = s3.BucketNotification(bucket_name)
-    my_queue_url = ""
-    response = sqs_client.list_queues()
-    for url in response['QueueUrls']:
-        if CAPTURE_TRIGGER_QUEUE in url:
-            my_queue_url = url
-            break
-    if len(my_queue_url) == 0:
-        raise Exception(f"Couldnt find queue URL for CAPTURE_TRIGGER_QUEUE {CAPTURE_TRIGGER_QUEUE} response {response}")
-    response = sqs_client.get_queue_attributes(
-        QueueUrl=my_queue_url,
-        AttributeNames=['QueueArn']
-    )
-    my_queue_arn = response['Attributes']['QueueArn']
-    response = bucket_notification.put(
-        NotificationConfiguration={
-            'QueueConfigurations': [
-                {
-                    'QueueArn': my_queue_arn,
-                    'Events': [
-                        's3:ObjectCreated:*'
-                    ]
-                }
+    """
+    Have the bucket notify the trigger queue of new objects, with the
+    notifications _remove_notification_from_bucket took off it if there are any.
+    """
+    stash_key = f"{NOTIFICATION_STASH_PREFIX}{bucket_name}.json"
+    configurations = _read_state_object(stash_key) or [
+        {
+            'QueueArn': switchover.queue_arn(sqs_client, CAPTURE_TRIGGER_QUEUE),
+            'Events': [
+                's3:ObjectCreated:*'
             ]
         }
-    )
-    bucket_notification.load()
-    return response
+    ]
+    changed = switchover.add_queue_notifications(s3_client, bucket_name, configurations)
+    s3_client.delete_object(Bucket=STATE_BUCKET, Key=stash_key)
+    return changed
 
 
-def _get_cloudwatch_alarm_history(start_time, alarm):
-    response = cloudwatch_client.describe_alarm_history(
-        AlarmName=alarm,
-        AlarmTypes=[
-            'MetricAlarm',
-        ],
-        HistoryItemType='StateUpdate',
-        StartDate=start_time,
-        EndDate=datetime.datetime.now(),
-        ScanBy='TimestampDescending'
+_secret_cache = {}
+
+
+def _get_secret_string(secret_id):
+    """
+    Parsed SecretString of a secret, cached for SECRET_TTL_SECONDS so warm
+    invocations don't go back to Secrets Manager every time.
+    """
+    cached = _secret_cache.get(secret_id)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+    original = secrets_client.get_secret_value(
+        SecretId=secret_id
     )
-    return response
+    secret_string = json.loads(original['SecretString'])
+    _secret_cache[secret_id] = (time.time() + SECRET_TTL_SECONDS, secret_string)
+    return secret_string
+
+
+def _read_state_object(key):
+    try:
+        response = s3_client.get_object(Bucket=STATE_BUCKET, Key=key)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+def _write_state_object(key, content):
+    s3_client.put_object(Bucket=STATE_BUCKET, Key=key, Body=json.dumps(content))
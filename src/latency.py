@@ -0,0 +1,184 @@
+import bisect
+import gzip
+import io
+import json
+
+from psycopg2 import sql
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Per object latency through the capture pipeline: from the time the load test
+wrote a file into the test bucket to the time its first row appeared in
+capture.json_data.
+
+Every copy step writes a copy log, a gzipped JSON lines file with one line per
+file it wrote:
+
+    {"Key": "...", "Size": 10, "Type": "ts-corrected", "copiedAt": 1602147600.123}
+
+After the run the logs are joined with the first time each source key shows up
+in capture.json_data, and the latencies are summarized per object type and
+size bucket.
+"""
+
+# Upper bounds (bytes) of the size buckets, the last bucket is everything bigger
+SIZE_BUCKETS = [
+    ('<100KB', 100 * 1024),
+    ('100KB-1MB', 1024 * 1024),
+    ('1MB-10MB', 10 * 1024 * 1024),
+    ('10MB-100MB', 100 * 1024 * 1024),
+    ('>100MB', None),
+]
+
+# Upper bounds (seconds) of the histogram buckets
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+
+class CopyLog:
+    """
+    Collects the files a copy step wrote, to be passed as copy_objects' on_copied.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def __call__(self, obj, copied_at):
+        self.entries.append({
+            "Key": obj.get('DestKey', obj['Key']),
+            "Size": obj.get('Size', 0),
+            "Type": obj.get('Type'),
+            "copiedAt": round(copied_at, 3)
+        })
+
+    def write(self, s3_client, bucket, key):
+        if not self.entries:
+            return
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+            for entry in self.entries:
+                gz.write((json.dumps(entry) + '\n').encode('utf-8'))
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), ContentType='application/gzip')
+        logger.info(f"wrote copy log of {len(self.entries)} files to s3://{bucket}/{key}")
+
+
+def read_copy_logs(s3_client, bucket, prefix):
+    """
+    :return: dict of key -> copy log entry, across every copy log under the prefix
+    """
+    copied = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            body = s3_client.get_object(Bucket=bucket, Key=obj['Key'])['Body']
+            for line in io.TextIOWrapper(gzip.GzipFile(fileobj=body, mode='rb'), encoding='utf-8'):
+                entry = json.loads(line)
+                # a retried shard may have logged a key twice, the first write is the one the pipeline saw
+                if entry["Key"] not in copied or entry["copiedAt"] < copied[entry["Key"]]["copiedAt"]:
+                    copied[entry["Key"]] = entry
+    return copied
+
+
+COLUMNS_SQL = """
+select column_name from information_schema.columns
+where table_schema = 'capture' and table_name = 'json_data'
+"""
+
+
+def missing_columns(rds, columns):
+    """
+    :return: the columns capture.json_data doesn't have, of the ones given
+    """
+    present = {row["column_name"] for row in rds.execute_batch({"columns": COLUMNS_SQL})["columns"]}
+    return [column for column in columns if column not in present]
+
+
+def last_id_sql(id_column):
+    """
+    The highest id in capture.json_data, read off the primary key index.
+    """
+    return sql.SQL("select max({id}) from capture.json_data").format(id=sql.Identifier(id_column))
+
+
+def first_seen_sql(key_column, time_column, id_column):
+    """
+    The first time each source key appeared in capture.json_data, among the rows
+    inserted after the id preTest recorded, so only the run's rows are read (an
+    index range scan) rather than the whole table.
+    """
+    return sql.SQL(
+        "select {key}, extract(epoch from min({time})) from capture.json_data "
+        "where {id} > %s group by {key}"
+    ).format(key=sql.Identifier(key_column), time=sql.Identifier(time_column), id=sql.Identifier(id_column))
+
+
+def size_bucket(size):
+    for name, upper_bound in SIZE_BUCKETS:
+        if upper_bound is None or size < upper_bound:
+            return name
+
+
+def match(copied, first_seen, bucket):
+    """
+    :param copied: dict of key -> copy log entry
+    :param first_seen: iterable of (stored source key, epoch seconds) rows
+    :param bucket: the test bucket, stripped off stored keys like s3://bucket/key
+    :return: dict of (type, size bucket) -> list of latencies in seconds, and how many files were matched
+    """
+    latencies = {}
+    matched = set()
+    for stored_key, seen_at in first_seen:
+        if stored_key is None or seen_at is None:
+            continue
+        key = stored_key.split(f"{bucket}/", 1)[-1]
+        entry = copied.get(key)
+        if entry is None or key in matched:
+            continue
+        matched.add(key)
+        group = (entry["Type"] or 'other', size_bucket(entry["Size"]))
+        latencies.setdefault(group, []).append(max(float(seen_at) - entry["copiedAt"], 0))
+    return latencies, len(matched)
+
+
+def _percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def describe(values):
+    ordered = sorted(values)
+    histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for value in ordered:
+        histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+    return {
+        "objects": len(ordered),
+        "p50Seconds": round(_percentile(ordered, 0.5), 3),
+        "p95Seconds": round(_percentile(ordered, 0.95), 3),
+        "p99Seconds": round(_percentile(ordered, 0.99), 3),
+        "maxSeconds": round(ordered[-1], 3),
+        "histogram": {
+            (f"<={upper_bound}s" if index < len(HISTOGRAM_BUCKETS) else f">{HISTOGRAM_BUCKETS[-1]}s"): count
+            for index, (upper_bound, count) in enumerate(zip(HISTOGRAM_BUCKETS + [None], histogram))
+        }
+    }
+
+
+def summarize(latencies, copied_count, matched_count):
+    """
+    :return: latency percentiles and histogram overall and per object type and size bucket
+    """
+    everything = [value for values in latencies.values() for value in values]
+    groups = [
+        dict(describe(values), type=object_type, sizeBucket=bucket_name)
+        for (object_type, bucket_name), values in sorted(latencies.items())
+    ]
+    return {
+        "copiedObjects": copied_count,
+        "matchedObjects": matched_count,
+        "unmatchedObjects": copied_count - matched_count,
+        "overall": describe(everything) if everything else None,
+        "groups": groups
+    }
@@ -0,0 +1,144 @@
+import datetime
+import gzip
+import io
+import json
+import re
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+A manifest of the reference data set, so the load test does not have to list
+the whole reference bucket on every run.
+
+The manifest is a gzipped JSON lines file.  The first line is a header with
+totals; every other line is one object, in key order, using the same field
+names as list_objects_v2 plus the classified object 'Type':
+
+    {"manifestVersion": 1, "bucket": ..., "generatedAt": ..., "objects": 2, "bytes": 30, "types": {...}}
+    {"Key": "...", "Size": 10, "ETag": "...", "LastModified": "2020-10-01T10:08:00+00:00", "Type": "ts-corrected"}
+"""
+MANIFEST_VERSION = 1
+
+"""
+Object types, matched in order against the key with punctuation removed.  The
+reference files are named after the AQTS Publish API request that produced
+them; anything that doesn't match is 'other'.
+"""
+OBJECT_TYPES = [
+    ('ts-description', 'timeseriesdescription'),
+    ('ts-corrected', 'timeseriescorrected'),
+    ('field-visit-metadata', 'fieldvisitdescription'),
+    ('field-visit-readings', 'fieldvisitreadings'),
+    ('field-visit', 'fieldvisitdata'),
+]
+OTHER_TYPE = 'other'
+
+
+def classify(key):
+    normalized = re.sub('[^a-z0-9]', '', key.lower())
+    for object_type, pattern in OBJECT_TYPES:
+        if pattern in normalized:
+            return object_type
+    return OTHER_TYPE
+
+
+def build(objects, previous=None):
+    """
+    Build manifest entries from a bucket listing.  Entries whose key and ETag
+    are unchanged since the previous manifest are reused as is.
+    :param objects: iterable of list_objects_v2 'Contents' entries, in key order
+    :param previous: dict of key -> entry from the previous manifest, if any
+    :return: (entries, changes) where changes counts added, changed, removed and unchanged keys
+    """
+    # a copy, what is left of it once the listing is done is what was removed
+    previous = dict(previous or {})
+    changes = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    entries = []
+    for obj in objects:
+        old = previous.pop(obj['Key'], None)
+        if old is not None and old['ETag'] == obj['ETag'] and old['Size'] == obj['Size']:
+            changes["unchanged"] += 1
+            entries.append(old)
+            continue
+        changes["changed" if old is not None else "added"] += 1
+        entries.append({
+            'Key': obj['Key'],
+            'Size': obj['Size'],
+            'ETag': obj['ETag'],
+            'LastModified': obj['LastModified'],
+            'Type': classify(obj['Key'])
+        })
+    changes["removed"] = len(previous)
+    return entries, changes
+
+
+def summarize(entries):
+    types = {}
+    total_bytes = 0
+    for entry in entries:
+        summary = types.setdefault(entry['Type'], {"objects": 0, "bytes": 0})
+        summary["objects"] += 1
+        summary["bytes"] += entry['Size']
+        total_bytes += entry['Size']
+    return {"objects": len(entries), "bytes": total_bytes, "types": types}
+
+
+def write(s3_client, bucket, key, source_bucket, entries):
+    header = {
+        "manifestVersion": MANIFEST_VERSION,
+        "bucket": source_bucket,
+        "generatedAt": datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+    header.update(summarize(entries))
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        gz.write((json.dumps(header) + '\n').encode('utf-8'))
+        for entry in entries:
+            line = dict(entry, LastModified=entry['LastModified'].isoformat())
+            gz.write((json.dumps(line) + '\n').encode('utf-8'))
+    s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), ContentType='application/gzip')
+    logger.info(f"wrote manifest s3://{bucket}/{key} {header}")
+    return header
+
+
+def read(s3_client, bucket, key):
+    """
+    Stream the manifest entries without holding the whole file in memory.
+    :return: a generator of entries (with a 'header' attribute), or None if there is no manifest yet
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    lines = io.TextIOWrapper(gzip.GzipFile(fileobj=response['Body'], mode='rb'), encoding='utf-8')
+    header = json.loads(lines.readline())
+    if header.get("manifestVersion") != MANIFEST_VERSION:
+        raise Exception(f"Unsupported manifest version in s3://{bucket}/{key} {header}")
+    return _Entries(header, _parse(lines))
+
+
+def _parse(lines):
+    for line in lines:
+        entry = json.loads(line)
+        entry['LastModified'] = datetime.datetime.fromisoformat(entry['LastModified'])
+        yield entry
+
+
+class _Entries:
+    """
+    Iterator over manifest entries that also carries the manifest header.
+    """
+
+    def __init__(self, header, entries):
+        self.header = header
+        self._entries = entries
+
+    def __iter__(self):
+        return self._entries
+
+    def __next__(self):
+        return next(self._entries)
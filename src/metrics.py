@@ -0,0 +1,168 @@
+import math
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+CloudWatch metric harvesting for the results report.
+
+Every metric of every pipeline stage is fetched as a single data point covering
+the whole test window, packed up to MAX_QUERIES_PER_CALL queries into each
+get_metric_data call.  Each entry below is (name in the report, CloudWatch
+metric name, statistic).
+"""
+MAX_QUERIES_PER_CALL = 500
+
+LAMBDA_METRICS = [
+    ('Invocations', 'Invocations', 'Sum'),
+    ('Errors', 'Errors', 'Sum'),
+    ('Throttles', 'Throttles', 'Sum'),
+    ('MaxConcurrentExecutions', 'ConcurrentExecutions', 'Maximum'),
+    ('DurationP50', 'Duration', 'p50'),
+    ('DurationP90', 'Duration', 'p90'),
+    ('DurationP99', 'Duration', 'p99'),
+    ('DurationSum', 'Duration', 'Sum'),
+]
+
+RDS_METRICS = [
+    ('CPUUtilizationAverage', 'CPUUtilization', 'Average'),
+    ('CPUUtilizationMaximum', 'CPUUtilization', 'Maximum'),
+    ('DatabaseConnectionsMaximum', 'DatabaseConnections', 'Maximum'),
+    ('ReadIOPSAverage', 'ReadIOPS', 'Average'),
+    ('WriteIOPSAverage', 'WriteIOPS', 'Average'),
+    ('WriteIOPSMaximum', 'WriteIOPS', 'Maximum'),
+    ('CommitLatencyAverage', 'CommitLatency', 'Average'),
+    ('CommitLatencyMaximum', 'CommitLatency', 'Maximum'),
+]
+
+SQS_METRICS = [
+    ('AgeOfOldestMessageMaximum', 'ApproximateAgeOfOldestMessage', 'Maximum'),
+    ('MessagesSent', 'NumberOfMessagesSent', 'Sum'),
+]
+
+
+def build_queries(function_names, db_instance_identifier, queue_names):
+    """
+    :return: (queries for get_metric_data, dict of query id -> (group, resource, report name, statistic))
+    """
+    queries = []
+    labels = {}
+
+    def _add(group, resource, namespace, dimension, metrics):
+        for name, metric_name, stat in metrics:
+            query_id = f"q{len(queries)}"
+            labels[query_id] = (group, resource, name, stat)
+            queries.append({
+                'Id': query_id,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': namespace,
+                        'MetricName': metric_name,
+                        'Dimensions': [
+                            {
+                                'Name': dimension,
+                                'Value': resource
+                            }]
+                    },
+                    'Period': 60,
+                    'Stat': stat,
+                },
+                'ReturnData': True
+            })
+
+    for function_name in function_names:
+        _add('lambda', function_name, 'AWS/Lambda', 'FunctionName', LAMBDA_METRICS)
+    _add('rds', db_instance_identifier, 'AWS/RDS', 'DBInstanceIdentifier', RDS_METRICS)
+    for queue_name in queue_names:
+        _add('sqs', queue_name, 'AWS/SQS', 'QueueName', SQS_METRICS)
+    return queries, labels
+
+
+def get_metric_data(cloudwatch_client, queries, start_time, end_time):
+    """
+    Fetch one data point per query for the whole window, MAX_QUERIES_PER_CALL
+    queries per call, following NextToken.
+    :return: dict of query id -> list of values
+    """
+    window = max(60, (end_time - start_time).total_seconds())
+    period = int(math.ceil(window / 60) * 60)
+    values = {query['Id']: [] for query in queries}
+    calls = 0
+    for index in range(0, len(queries), MAX_QUERIES_PER_CALL):
+        batch = [dict(query, MetricStat=dict(query['MetricStat'], Period=period))
+                 for query in queries[index:index + MAX_QUERIES_PER_CALL]]
+        kwargs = {
+            'MetricDataQueries': batch,
+            'StartTime': start_time,
+            'EndTime': end_time,
+            'ScanBy': 'TimestampAscending'
+        }
+        while True:
+            response = cloudwatch_client.get_metric_data(**kwargs)
+            calls += 1
+            for result in response['MetricDataResults']:
+                values[result['Id']].extend(result['Values'])
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+    logger.info(f"fetched {len(queries)} metrics with {calls} get_metric_data calls")
+    return values
+
+
+def _aggregate(stat, values):
+    if not values:
+        return None
+    if stat == 'Sum':
+        return sum(values)
+    if stat == 'Average':
+        return sum(values) / len(values)
+    # Maximum, and the worst of the percentiles if the window was split
+    return max(values)
+
+
+def harvest(cloudwatch_client, function_names, db_instance_identifier, queue_names, start_time, end_time):
+    """
+    :return: dict of group ('lambda', 'rds', 'sqs') -> resource -> report name -> value
+    """
+    queries, labels = build_queries(function_names, db_instance_identifier, queue_names)
+    values = get_metric_data(cloudwatch_client, queries, start_time, end_time)
+    harvested = {}
+    for query_id, (group, resource, name, stat) in labels.items():
+        harvested.setdefault(group, {}).setdefault(resource, {})[name] = _aggregate(stat, values[query_id])
+    return harvested
+
+
+def stage_table(harvested, function_names, stage):
+    """
+    One row per pipeline stage, in pipeline order, and the stage that spent the
+    most time busy (sum of durations), which is the likely bottleneck.
+    """
+    rows = []
+    for function_name in function_names:
+        metrics = harvested.get('lambda', {}).get(function_name, {})
+        busy_ms = metrics.get('DurationSum') or 0
+        rows.append({
+            "stage": function_name.split(f"-{stage}-")[0],
+            "function": function_name,
+            "invocations": metrics.get('Invocations') or 0,
+            "errors": metrics.get('Errors') or 0,
+            "throttles": metrics.get('Throttles') or 0,
+            "maxConcurrentExecutions": metrics.get('MaxConcurrentExecutions'),
+            "durationP50Ms": metrics.get('DurationP50'),
+            "durationP90Ms": metrics.get('DurationP90'),
+            "durationP99Ms": metrics.get('DurationP99'),
+            "busySeconds": round(busy_ms / 1000, 3)
+        })
+    total_busy = sum(row["busySeconds"] for row in rows)
+    for row in rows:
+        row["shareOfBusyTime"] = round(row["busySeconds"] / total_busy, 4) if total_busy else 0
+    bottleneck = max(rows, key=lambda row: row["busySeconds"]) if rows else None
+    return {
+        "stages": rows,
+        "bottleneck": bottleneck["stage"] if bottleneck and bottleneck["busySeconds"] > 0 else None,
+        "throttledStages": [row["stage"] for row in rows if row["throttles"] > 0],
+        "erroringStages": [row["stage"] for row in rows if row["errors"] > 0]
+    }
@@ -1,5 +1,9 @@
+import json
+import time
+import uuid
+
 from psycopg2 import connect
-from psycopg2 import OperationalError, DataError, IntegrityError
+from psycopg2 import OperationalError, DataError, IntegrityError, InterfaceError
 
 
 # allows for logging information
@@ -8,10 +12,45 @@ import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+"""
+Connections handed out by get_rds are kept here, keyed by their connection
+parameters, so a warm lambda container reuses its connection across
+invocations instead of opening (and leaking) a new one every time.
+"""
+_pool = {}
+
+CONNECT_ATTEMPTS = 4
+CONNECT_BACKOFF_SECONDS = 1
+
+# Rows fetched per round trip when streaming through a server side cursor
+DEFAULT_ITERSIZE = 2000
+
+# json(b)_build_object takes at most 100 arguments, so 50 named queries per object
+MAX_QUERIES_PER_OBJECT = 50
+
+
+def get_rds(db_host, db_user, db_name, db_password, connect_timeout=65):
+    """
+    Get a pooled connection, checking that it is still healthy and reconnecting
+    (with backoff) if it isn't.  Use it as a context manager; leaving the block
+    keeps the connection open for the next invocation.
+    """
+    key = (db_host, db_user, db_name, db_password)
+    rds = _pool.get(key)
+    if rds is not None and rds.is_healthy():
+        logger.debug(f"reusing pooled connection to {db_host}/{db_name} as {db_user}")
+        return rds
+    if rds is not None:
+        logger.info(f"pooled connection to {db_host}/{db_name} as {db_user} is unhealthy, reconnecting")
+        rds.close_quietly()
+    rds = RDS(db_host, db_user, db_name, db_password, connect_timeout=connect_timeout, pooled=True)
+    _pool[key] = rds
+    return rds
+
 
 class RDS:
 
-    def __init__(self, db_host, db_user, db_name, db_password, connect_timeout=65):
+    def __init__(self, db_host, db_user, db_name, db_password, connect_timeout=65, pooled=False):
         """
         connect to the database resource.
         wait for 50 seconds before giving up on getting a connection
@@ -24,16 +63,53 @@ class RDS:
             'connect_timeout': connect_timeout
             # keyword argument from https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-PARAMKEYWORDS
         }
+        self.pooled = pooled
         logger.info("created RDS instance %s" % self.connection_parameters)
         self.conn, self.cursor = self._connect()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # pooled connections stay open for the next invocation
+        if not self.pooled:
+            self.disconnect()
+        return False
+
     def _connect(self):
-        conn = connect(**self.connection_parameters)  # should raise a OperationalError if it can't get a connection
+        for attempt in range(1, CONNECT_ATTEMPTS + 1):
+            try:
+                # should raise a OperationalError if it can't get a connection
+                conn = connect(**self.connection_parameters)
+                break
+            except OperationalError as e:
+                if attempt == CONNECT_ATTEMPTS:
+                    raise
+                backoff = CONNECT_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.info(f"connection attempt {attempt} failed, retrying in {backoff}s: {repr(e)}")
+                time.sleep(backoff)
         # Interestingly, autocommit seemed necessary for create table too.
         conn.autocommit = True
         cursor = conn.cursor()
         return conn, cursor
 
+    def is_healthy(self):
+        if self.conn.closed:
+            return False
+        try:
+            self.cursor.execute('select 1')
+            self.cursor.fetchone()
+            return True
+        except (OperationalError, InterfaceError) as e:
+            logger.debug(f'Connection health check failed: {repr(e)}', exc_info=True)
+            return False
+
+    def close_quietly(self):
+        try:
+            self.conn.close()
+        except (OperationalError, InterfaceError) as e:
+            logger.debug(f'Error closing connection: {repr(e)}', exc_info=True)
+
     def disconnect(self):
         try:
             self.conn.close()
@@ -43,14 +119,79 @@ class RDS:
             # An exception should be thrown well before this.
             logger.debug(f'Error closing connection objection: {repr(e)}', exc_info=True)
             raise RuntimeError
+        finally:
+            for key, rds in list(_pool.items()):
+                if rds is self:
+                    del _pool[key]
 
-    def execute_sql(self, sql):
+    def execute_sql(self, sql, params=None):
         try:
-            self.cursor.execute(sql)
+            self.cursor.execute(sql, params)
             return self.cursor.fetchone()
         except (OperationalError, DataError, IntegrityError) as e:
             logger.debug(f'Error during SQL execution: {repr(e)}', exc_info=True)
             self.conn.rollback()
+            raise
+
+    def execute_update(self, sql, params=None):
+        """
+        Run a statement that returns no rows (delete, truncate, analyze...).
+        :return: the number of rows affected, -1 if that doesn't apply
+        """
+        try:
+            self.cursor.execute(sql, params)
+            return self.cursor.rowcount
+        except (OperationalError, DataError, IntegrityError) as e:
+            logger.debug(f'Error during SQL execution: {repr(e)}', exc_info=True)
+            self.conn.rollback()
+            raise
+
+    def execute_batch(self, queries):
+        """
+        Run several read-only queries in a single round trip.  Each query is
+        wrapped as a subquery that aggregates its rows to json, and all of them
+        are returned as one json object, so the results come back typed
+        (numbers as numbers, nulls as None) rather than as strings.
+        :param queries: dict of name -> select statement, a string or a psycopg2.sql composition
+        :return: dict of name -> list of rows, each row a dict of column -> value
+        """
+        queries = {name: query if isinstance(query, str) else query.as_string(self.conn)
+                   for name, query in queries.items()}
+        names = list(queries)
+        objects = []
+        for index in range(0, len(names), MAX_QUERIES_PER_OBJECT):
+            pairs = ", ".join(
+                f"'{name}', (select coalesce(jsonb_agg(to_jsonb(q)), '[]'::jsonb) "
+                f"from ({queries[name].strip().rstrip(';')}) q)"
+                for name in names[index:index + MAX_QUERIES_PER_OBJECT]
+            )
+            objects.append(f"jsonb_build_object({pairs})")
+        sql = f"select ({' || '.join(objects)})::text"
+        result = self.execute_sql(sql)
+        return json.loads(result[0])
+
+    def stream(self, sql, params=None, itersize=DEFAULT_ITERSIZE):
+        """
+        Stream the rows of a query through a named (server side) cursor,
+        fetching itersize rows per round trip, so memory stays flat however big
+        the result is.  Named cursors need a transaction, so autocommit is off
+        until the generator finishes or is closed.
+        """
+        self.conn.autocommit = False
+        cursor = self.conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.itersize = itersize
+        try:
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield row
+        except (OperationalError, DataError, IntegrityError) as e:
+            logger.debug(f'Error during SQL streaming: {repr(e)}', exc_info=True)
+            raise
+        finally:
+            if not self.conn.closed:
+                cursor.close()
+                self.conn.rollback()
+                self.conn.autocommit = True
 
     def alter_permissions(self, sql):
         try:
@@ -58,3 +199,4 @@ class RDS:
         except (OperationalError, DataError, IntegrityError) as e:
             logger.debug(f'Error during SQL execution: {repr(e)}', exc_info=True)
             self.conn.rollback()
+            raise
@@ -0,0 +1,130 @@
+import itertools
+import math
+import time
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Rate curves for replaying the reference data set into the trigger bucket.
+
+A replay profile is passed in the step function event, for example:
+
+    {"type": "constant", "rate": 20}
+    {"type": "ramp", "startRate": 1, "endRate": 100, "durationSeconds": 1800}
+    {"type": "step", "steps": [{"rate": 10, "durationSeconds": 600}, {"rate": 50, "durationSeconds": 600}]}
+    {"type": "replay", "speedup": 60}
+
+Rates are objects per second.  'replay' releases the objects in the order they
+originally arrived (S3 LastModified), with the gaps between them divided by
+'speedup'.  Any profile may also set 'stopAfterSeconds' to end the replay early.
+"""
+
+
+def _constant(profile, index):
+    return index / float(profile['rate'])
+
+
+def _ramp(profile, index):
+    start_rate = float(profile.get('startRate', 0))
+    end_rate = float(profile['endRate'])
+    duration = float(profile['durationSeconds'])
+    # objects released by the end of the ramp, the area under the rate line
+    ramp_total = (start_rate + end_rate) * duration / 2
+    if index > ramp_total:
+        if end_rate <= 0:
+            return None
+        return duration + (index - ramp_total) / end_rate
+    # solve start_rate * t + slope * t^2 / 2 = index for t
+    half_slope = (end_rate - start_rate) / (2 * duration)
+    if half_slope == 0:
+        return index / start_rate if start_rate > 0 else None
+    return (-start_rate + math.sqrt(start_rate ** 2 + 4 * half_slope * index)) / (2 * half_slope)
+
+
+def _step(profile, index):
+    elapsed = 0.0
+    released = 0.0
+    rate = 0.0
+    for step in profile['steps']:
+        rate = float(step['rate'])
+        duration = float(step['durationSeconds'])
+        if released + rate * duration > index:
+            return elapsed + (index - released) / rate
+        released += rate * duration
+        elapsed += duration
+    # keep going at the last rate once the steps run out
+    if rate <= 0:
+        return None
+    return elapsed + (index - released) / rate
+
+
+RATE_CURVES = {
+    'constant': _constant,
+    'ramp': _ramp,
+    'step': _step
+}
+
+
+def schedule(profile, objects):
+    """
+    Attach a release time to each object.
+    :param profile: the replay profile from the step function event
+    :param objects: iterable of objects in release order ('replay' needs them sorted by LastModified)
+    :return: generator of (seconds after the start of the replay, object)
+    """
+    shape = profile.get('type', 'constant')
+    stop_after = profile.get('stopAfterSeconds')
+    if shape == 'replay':
+        speedup = float(profile.get('speedup', 1))
+        first = None
+        scheduled = []
+        for obj in objects:
+            if first is None:
+                first = obj['LastModified']
+            scheduled.append(((obj['LastModified'] - first).total_seconds() / speedup, obj))
+    elif shape in RATE_CURVES:
+        scheduled = ((RATE_CURVES[shape](profile, index), obj) for index, obj in enumerate(objects))
+    else:
+        raise Exception(f"Unknown replay type {shape}, expected one of {['replay'] + list(RATE_CURVES)}")
+    for due, obj in scheduled:
+        if due is None or (stop_after is not None and due > float(stop_after)):
+            return
+        yield due, obj
+
+
+def paced(scheduled, started_at, deadline, progress):
+    """
+    Release objects from a schedule in real time, sleeping until each one is due.
+    Stops (leaving progress['done'] False, and progress['nextDueAt'] set to when
+    the next object is due) when the next object is not due before the deadline,
+    so the caller can hand the rest to another invocation.
+    :param scheduled: output of schedule(), already advanced past the objects released earlier
+    :param started_at: epoch seconds the replay started
+    :param deadline: epoch seconds after which nothing more is released
+    :param progress: dict updated in place with 'released', 'maxLagSeconds' and 'done'
+    """
+    progress['done'] = False
+    for due, obj in scheduled:
+        release_at = started_at + due
+        if release_at > deadline:
+            progress['nextDueAt'] = release_at
+            return
+        wait = release_at - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        else:
+            progress['maxLagSeconds'] = max(progress['maxLagSeconds'], round(-wait, 3))
+        progress['released'] += 1
+        yield obj
+    progress['done'] = True
+
+
+def resume(scheduled, offset):
+    """
+    Skip the objects already released by earlier invocations.
+    """
+    return itertools.islice(scheduled, offset, None)
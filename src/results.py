@@ -0,0 +1,130 @@
+import gzip
+import io
+import json
+import statistics
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+A results store that keeps every run, rather than the one TEST_RESULTS object
+that each run overwrites.
+
+Each run is a gzipped JSON lines file: a header line describing the run, then
+one line per numeric value in the report, named by its path through the report
+(list items are named by their 'stage', 'table_name' or 'queryId' when they have one):
+
+    {"resultsVersion": 1, "runId": ..., "startTime": ..., "configuration": {...}}
+    {"metric": "Throughput.steadyStateRowsPerSecond", "value": 812.5}
+    {"metric": "Pipeline.stages.aqts-capture-raw-load.durationP99Ms", "value": 1240.0}
+
+The index is a JSON lines file with one line per run, oldest first: the header
+plus the run's headline metrics, the ones regressions are checked on.
+"""
+RESULTS_VERSION = 1
+
+# Headline metrics, by the last part of their name, and which way is better
+HIGHER_IS_BETTER = ('averageRowsPerSecond', 'steadyStateRowsPerSecond', 'objectsPerSecond', 'maxSustainableRate')
+LOWER_IS_BETTER = ('ElapsedTimeInSeconds', 'tailDrainSeconds', 'durationP90Ms', 'durationP99Ms', 'costPer10kObjects')
+
+# Report entries that are lists of rows, and the field that names each row
+ROW_NAMES = ('stage', 'table_name', 'queryId')
+
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_WINDOW = 5
+
+
+def metric_rows(report, prefix=''):
+    """
+    :return: a generator of {metric, value} for every number in the report
+    """
+    if isinstance(report, dict):
+        for name, value in report.items():
+            yield from metric_rows(value, f"{prefix}{name}.")
+    elif isinstance(report, list):
+        for index, item in enumerate(report):
+            label = index
+            if isinstance(item, dict):
+                label = next((item[name] for name in ROW_NAMES if name in item), index)
+            yield from metric_rows(item, f"{prefix}{label}.")
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        yield {"metric": prefix.rstrip('.'), "value": report}
+
+
+def headline(rows):
+    return {
+        row["metric"]: row["value"] for row in rows
+        if row["metric"].split('.')[-1] in HIGHER_IS_BETTER + LOWER_IS_BETTER
+    }
+
+
+def write_run(s3_client, bucket, key, header, rows):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        gz.write((json.dumps(dict(header, resultsVersion=RESULTS_VERSION)) + '\n').encode('utf-8'))
+        for row in rows:
+            gz.write((json.dumps(row) + '\n').encode('utf-8'))
+    s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), ContentType='application/gzip')
+    logger.info(f"wrote results s3://{bucket}/{key}")
+
+
+def read_index(s3_client, bucket, key):
+    """
+    :return: the index entries, oldest run first
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.NoSuchKey:
+        return []
+    return [json.loads(line) for line in response['Body'].read().decode('utf-8').splitlines() if line]
+
+
+def add_to_index(s3_client, bucket, key, entry):
+    """
+    Add (or replace, if the run was recorded before) the run's index entry.
+    """
+    entries = [existing for existing in read_index(s3_client, bucket, key) if existing["runId"] != entry["runId"]]
+    entries.append(entry)
+    body = ''.join(json.dumps(existing) + '\n' for existing in entries)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode('utf-8'), ContentType='application/x-ndjson')
+    return entries
+
+
+def compare(current, previous, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW):
+    """
+    Compare a run's headline metrics with the median of the last 'window'
+    earlier runs that had the same configuration.  A metric has regressed when
+    it is more than 'threshold' (a share, 0.1 is 10%) worse than that median.
+    :param current: the run's index entry
+    :param previous: index entries of earlier runs, oldest first
+    :return: the comparison, with the regressed metrics
+    """
+    comparable = [
+        entry for entry in previous
+        if entry["runId"] != current["runId"] and entry.get("configuration") == current.get("configuration")
+    ][-window:]
+    regressions = []
+    compared = {}
+    for metric, value in current["metrics"].items():
+        history = [entry["metrics"][metric] for entry in comparable if entry["metrics"].get(metric) is not None]
+        if value is None or not history:
+            continue
+        baseline = statistics.median(history)
+        if not baseline:
+            continue
+        change = (value - baseline) / baseline
+        compared[metric] = {"value": value, "baseline": baseline, "change": round(change, 4)}
+        higher_is_better = metric.split('.')[-1] in HIGHER_IS_BETTER
+        if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+            regressions.append(dict(compared[metric], metric=metric))
+    return {
+        "runId": current["runId"],
+        "comparedWith": [entry["runId"] for entry in comparable],
+        "threshold": threshold,
+        "metrics": compared,
+        "regressions": regressions,
+        "regressed": bool(regressions)
+    }
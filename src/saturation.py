@@ -0,0 +1,152 @@
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Saturation search: find the highest rate the capture pipeline can take without
+breaking its service level objectives, instead of running full tests at
+different sizes by hand.
+
+The reference data set is released into the test bucket at a constant rate for
+'stepSeconds', then the step is judged on the CloudWatch metrics of its window
+and the alarms in ALARMS.  The rate goes up ('factor' times, or 'increment'
+objects per second more) each step that meets every objective, and the search
+stops at the first one that doesn't, at 'maxRate' or when the data set runs out.
+The profile is passed in the step function event as 'saturation', for example:
+
+    {"startRate": 5, "factor": 1.5, "stepSeconds": 300, "slo": {"maxDbCpuPercent": 80}}
+
+Each objective in 'slo' is a maximum, None switches it off.  The metrics of the
+last minute of a step may not have reached CloudWatch by the time it is judged,
+so steps shorter than a few minutes mostly measure the step before.
+"""
+DEFAULT_PROFILE = {
+    "startRate": 5,
+    "factor": 1.5,
+    "increment": None,
+    "stepSeconds": 300,
+    "maxRate": 1000,
+    "slo": {}
+}
+
+DEFAULT_SLO = {
+    # age of the oldest message in the trigger queue
+    "maxQueueAgeSeconds": 300,
+    # per pipeline stage
+    "maxThrottles": 0,
+    "maxErrorRate": 0.01,
+    # the writer
+    "maxDbCpuPercent": 85,
+    "maxCommitLatencyMs": 100,
+    # whether any of ALARMS going off breaks the objectives
+    "alarms": True
+}
+
+# Breaches that are a symptom of some stage falling behind rather than a stage of their own
+SYMPTOMS = ('queueAgeSeconds', 'alarms')
+
+
+def resolve(profile, max_step_seconds=None):
+    """
+    :param max_step_seconds: the longest step one invocation has time for, None for no limit
+    :return: the saturation profile with the defaults filled in
+    """
+    resolved = dict(DEFAULT_PROFILE)
+    resolved.update(profile or {})
+    resolved["slo"] = dict(DEFAULT_SLO, **(resolved["slo"] or {}))
+    unknown = set(resolved["slo"]) - set(DEFAULT_SLO)
+    if unknown:
+        raise Exception(f"Unknown saturation objectives {sorted(unknown)}, expected {sorted(DEFAULT_SLO)}")
+    if float(resolved["startRate"]) <= 0:
+        raise Exception(f"The saturation search has to start at a positive rate, not {resolved['startRate']}")
+    if not resolved["increment"] and float(resolved["factor"]) <= 1:
+        raise Exception(f"A saturation 'factor' of {resolved['factor']} would never raise the rate")
+    if max_step_seconds is not None and float(resolved["stepSeconds"]) > max_step_seconds:
+        raise Exception(f"A saturation step of {resolved['stepSeconds']} seconds doesn't fit in one invocation, "
+                        f"the most is {max_step_seconds}")
+    return resolved
+
+
+def next_rate(profile, rate):
+    if profile["increment"]:
+        return round(rate + float(profile["increment"]), 3)
+    return round(rate * float(profile["factor"]), 3)
+
+
+def _breach(stage, measure, observed, limit):
+    # how far over its limit, relative to the limit, a limit of zero counts the overshoot itself
+    over_by = (observed - limit) / limit if limit else observed
+    return {"stage": stage, "measure": measure, "observed": observed, "limit": limit, "overBy": round(over_by, 4)}
+
+
+def evaluate(stages, database, trigger_queue, queue, in_alarm, slo):
+    """
+    Judge a step against the objectives.
+    :param stages: metrics.stage_table of the step's window
+    :param database: the writer's harvested metrics over the window
+    :param trigger_queue: name of the trigger queue
+    :param queue: the trigger queue's harvested metrics over the window
+    :param in_alarm: the alarms that were in ALARM at some point during the step
+    :param slo: the objectives
+    :return: the step's observations, and its breaches with the worst first
+    """
+    breaches = []
+
+    def _check(stage, measure, observed, limit):
+        if observed is not None and limit is not None and observed > limit:
+            breaches.append(_breach(stage, measure, observed, limit))
+
+    for row in stages["stages"]:
+        _check(row["stage"], "throttles", row["throttles"], slo["maxThrottles"])
+        error_rate = round(row["errors"] / row["invocations"], 4) if row["invocations"] else 0
+        _check(row["stage"], "errorRate", error_rate, slo["maxErrorRate"])
+    _check("database", "cpuPercent", database.get('CPUUtilizationMaximum'), slo["maxDbCpuPercent"])
+    _check("database", "commitLatencyMs", database.get('CommitLatencyMaximum'), slo["maxCommitLatencyMs"])
+    _check(trigger_queue, "queueAgeSeconds", queue.get('AgeOfOldestMessageMaximum'), slo["maxQueueAgeSeconds"])
+    if slo["alarms"] and in_alarm:
+        breaches.append({"stage": None, "measure": "alarms", "observed": sorted(in_alarm), "limit": None,
+                         "overBy": None})
+    # a stage's own breach before a symptom, then the furthest over its limit
+    breaches.sort(key=lambda breach: (breach["measure"] in SYMPTOMS, -(breach["overBy"] or 0)))
+    observations = {
+        "throttles": sum(row["throttles"] for row in stages["stages"]),
+        "errors": sum(row["errors"] for row in stages["stages"]),
+        "dbCpuPercent": database.get('CPUUtilizationMaximum'),
+        "commitLatencyMs": database.get('CommitLatencyMaximum'),
+        "queueAgeSeconds": queue.get('AgeOfOldestMessageMaximum'),
+        "alarmsInAlarm": len(in_alarm),
+        "busiestStage": stages["bottleneck"]
+    }
+    return observations, breaches
+
+
+def saturated_stage(step):
+    """
+    The stage that saturated first: the stage of the step's worst breach, or the
+    step's busiest stage if all it broke were symptoms (queue age, alarms).
+    """
+    breach = step["breaches"][0]
+    if breach["measure"] in SYMPTOMS:
+        return step["observations"]["busiestStage"]
+    return breach["stage"]
+
+
+def summarize(steps, stop_reason):
+    """
+    :return: the highest rate that met every objective for a whole step, what was
+    actually released at it, and what broke the search off
+    """
+    passed = [step for step in steps if step["complete"] and not step["breaches"]]
+    best = max(passed, key=lambda step: step["rate"]) if passed else None
+    failed = next((step for step in steps if step["breaches"]), None)
+    return {
+        "stopReason": stop_reason,
+        "steps": len(steps),
+        "maxSustainableRate": best["rate"] if best else None,
+        "maxSustainableObjectsPerSecond": best["achievedRate"] if best else None,
+        "breachedAtRate": failed["rate"] if failed else None,
+        "saturatedStage": saturated_stage(failed) if failed else None,
+        "breaches": failed["breaches"] if failed else []
+    }
@@ -0,0 +1,123 @@
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Switching the capture trigger queue from the real bucket to the test bucket
+and back.
+
+Bucket notifications are edited rather than replaced: only the configurations
+that send to the trigger queue are added or taken out, whatever else the
+bucket notifies is left alone.  Queue URLs and ARNs are looked up once per
+container.
+
+SQS purges are asynchronous (they can take up to a minute) and only one is
+allowed per queue per minute, so a purge is never taken as proof that a queue
+is empty, its depth is.
+"""
+
+# A queue can only be purged once in this many seconds
+PURGE_INTERVAL_SECONDS = 60
+
+_queue_urls = {}
+_queue_arns = {}
+
+
+def queue_url(sqs_client, queue_name):
+    if queue_name not in _queue_urls:
+        _queue_urls[queue_name] = sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl']
+    return _queue_urls[queue_name]
+
+
+def queue_arn(sqs_client, queue_name):
+    if queue_name not in _queue_arns:
+        response = sqs_client.get_queue_attributes(
+            QueueUrl=queue_url(sqs_client, queue_name),
+            AttributeNames=['QueueArn']
+        )
+        _queue_arns[queue_name] = response['Attributes']['QueueArn']
+    return _queue_arns[queue_name]
+
+
+def queue_depth(sqs_client, queue_name):
+    """
+    :return: the messages in the queue, visible, in flight and delayed
+    """
+    response = sqs_client.get_queue_attributes(
+        QueueUrl=queue_url(sqs_client, queue_name),
+        AttributeNames=[
+            'ApproximateNumberOfMessages',
+            'ApproximateNumberOfMessagesNotVisible',
+            'ApproximateNumberOfMessagesDelayed'
+        ]
+    )
+    return sum(int(value) for value in response['Attributes'].values())
+
+
+def purge(sqs_client, queue_name):
+    """
+    :return: whether a purge was started, False if one from the last minute is still going
+    """
+    try:
+        sqs_client.purge_queue(QueueUrl=queue_url(sqs_client, queue_name))
+        return True
+    except sqs_client.exceptions.PurgeQueueInProgress:
+        logger.info(f"{queue_name} was purged less than {PURGE_INTERVAL_SECONDS}s ago")
+        return False
+
+
+def _notification_configuration(s3_client, bucket):
+    # everything the bucket notifies goes back in the put, topics, lambdas and EventBridge included,
+    # a configuration left out of it would be switched off
+    response = s3_client.get_bucket_notification_configuration(Bucket=bucket)
+    return {name: value for name, value in response.items() if name != 'ResponseMetadata'}
+
+
+def _same(configuration, other):
+    return (
+        configuration['QueueArn'] == other['QueueArn']
+        and sorted(configuration['Events']) == sorted(other['Events'])
+        and configuration.get('Filter') == other.get('Filter')
+    )
+
+
+def notifies(s3_client, bucket, arn):
+    """
+    :return: whether any of the bucket's configurations sends to the queue
+    """
+    configuration = _notification_configuration(s3_client, bucket)
+    return any(old['QueueArn'] == arn for old in configuration.get('QueueConfigurations', []))
+
+
+def add_queue_notifications(s3_client, bucket, queue_configurations):
+    """
+    Add queue configurations to the bucket's notifications, skipping any it already has.
+    :return: whether the bucket's notifications changed
+    """
+    configuration = _notification_configuration(s3_client, bucket)
+    existing = configuration.get('QueueConfigurations', [])
+    missing = [new for new in queue_configurations if not any(_same(new, old) for old in existing)]
+    if not missing:
+        logger.info(f"{bucket} already notifies {[new['QueueArn'] for new in queue_configurations]}")
+        return False
+    configuration['QueueConfigurations'] = existing + missing
+    s3_client.put_bucket_notification_configuration(Bucket=bucket, NotificationConfiguration=configuration)
+    return True
+
+
+def remove_queue_notifications(s3_client, bucket, arn):
+    """
+    Take every configuration that sends to the queue out of the bucket's notifications.
+    :return: the configurations taken out, to put back later as they were
+    """
+    configuration = _notification_configuration(s3_client, bucket)
+    existing = configuration.get('QueueConfigurations', [])
+    removed = [old for old in existing if old['QueueArn'] == arn]
+    if not removed:
+        logger.info(f"{bucket} doesn't notify {arn}")
+        return []
+    configuration['QueueConfigurations'] = [old for old in existing if old['QueueArn'] != arn]
+    s3_client.put_bucket_notification_configuration(Bucket=bucket, NotificationConfiguration=configuration)
+    return removed
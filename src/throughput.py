@@ -0,0 +1,90 @@
+import statistics
+import time
+
+# allows for logging information
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+"""
+Throughput of capture.json_data over the course of a run.
+
+Counting capture.json_data is a sequential scan of a very large table, so the
+sampler reads the table statistics instead: n_tup_ins (rows inserted since the
+statistics were reset, kept current by the stats collector) and reltuples
+(the planner's row estimate, as of the last vacuum/analyze).
+"""
+SAMPLE_SQL = """
+select s.n_tup_ins as inserts, c.reltuples::bigint as estimated_rows
+from pg_stat_user_tables s
+join pg_class c on c.oid = s.relid
+where s.schemaname = 'capture' and s.relname = 'json_data'
+"""
+
+# An interval counts towards steady state once it reaches this share of the peak rate
+STEADY_STATE_SHARE = 0.5
+
+
+def sample(rds):
+    result = rds.execute_sql(SAMPLE_SQL)
+    if result is None:
+        raise Exception("Could not read the capture.json_data statistics")
+    return {
+        "time": time.time(),
+        "inserts": result[0],
+        "estimatedRows": result[1]
+    }
+
+
+def from_rows(rows):
+    """
+    A sample from the rows of SAMPLE_SQL run as part of an RDS.execute_batch.
+    """
+    if not rows:
+        raise Exception("Could not read the capture.json_data statistics")
+    return {
+        "time": time.time(),
+        "inserts": rows[0]["inserts"],
+        "estimatedRows": rows[0]["estimated_rows"]
+    }
+
+
+def curve(samples):
+    """
+    Turn the samples into rows/sec per sampling interval, and describe the
+    shape: peak, steady state (median of the intervals at or above
+    STEADY_STATE_SHARE of the peak), how long it took to ramp up to steady
+    state, and how long the tail took to drain after it.
+    """
+    if len(samples) < 2:
+        return {"intervals": [], "samples": len(samples)}
+    start = samples[0]["time"]
+    intervals = []
+    for previous, current in zip(samples, samples[1:]):
+        seconds = current["time"] - previous["time"]
+        if seconds <= 0:
+            continue
+        rows = current["inserts"] - previous["inserts"]
+        intervals.append({
+            "offsetSeconds": round(current["time"] - start, 1),
+            "rows": rows,
+            "rowsPerSecond": round(rows / seconds, 3)
+        })
+    if not intervals:
+        return {"intervals": [], "samples": len(samples)}
+    peak = max(interval["rowsPerSecond"] for interval in intervals)
+    steady = [interval for interval in intervals if peak > 0 and interval["rowsPerSecond"] >= peak * STEADY_STATE_SHARE]
+    busy = [interval for interval in intervals if interval["rows"] > 0]
+    total_rows = samples[-1]["inserts"] - samples[0]["inserts"]
+    shape = {
+        "samples": len(samples),
+        "totalRows": total_rows,
+        "averageRowsPerSecond": round(total_rows / (samples[-1]["time"] - start), 3),
+        "peakRowsPerSecond": peak,
+        "steadyStateRowsPerSecond": statistics.median(i["rowsPerSecond"] for i in steady) if steady else 0,
+        "rampUpSeconds": steady[0]["offsetSeconds"] if steady else None,
+        "tailDrainSeconds": round(busy[-1]["offsetSeconds"] - steady[-1]["offsetSeconds"], 1) if steady else None,
+        "intervals": intervals
+    }
+    return shape
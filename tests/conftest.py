@@ -0,0 +1,28 @@
+import pytest
+
+from harness import fakes
+from src import clients, handler, switchover
+
+
+class FakeContext:
+
+    def __init__(self, remaining_seconds=900):
+        self.remaining_seconds = remaining_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int(self.remaining_seconds * 1000)
+
+
+@pytest.fixture
+def world():
+    """
+    A fresh, seeded World the handlers' clients and database point at, with
+    nothing cached from an earlier test.
+    """
+    world = fakes.install(fakes.World())
+    world.seed(handler)
+    for cache in (handler._secret_cache, handler._state_machine_arns, switchover._queue_urls,
+                  switchover._queue_arns):
+        cache.clear()
+    yield world
+    clients.set_factories()
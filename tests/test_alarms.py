@@ -0,0 +1,46 @@
+import datetime
+import json
+
+from src import alarms
+
+START = datetime.datetime(2020, 1, 1, 12, 0, 0)
+END = START + datetime.timedelta(minutes=10)
+
+
+def _update(minutes, old, new):
+    return {
+        "Timestamp": (START + datetime.timedelta(minutes=minutes)).replace(tzinfo=datetime.timezone.utc),
+        "HistorySummary": f"Alarm updated from {old} to {new}",
+        "HistoryData": json.dumps({"oldState": {"stateValue": old}, "newState": {"stateValue": new}})
+    }
+
+
+def test_quiet_alarm_passes():
+    result = alarms.summarize([], "OK", START, END)
+    assert result["result"] == "PASS"
+    assert result["secondsInAlarm"] == 0
+
+
+def test_alarm_that_was_in_alarm_all_along_fails():
+    result = alarms.summarize([], "ALARM", START, END)
+    assert result["result"] == "FAIL"
+    assert result["secondsInAlarm"] == 600
+
+
+def test_time_in_alarm_is_summed_between_transitions():
+    items = [_update(2, "OK", "ALARM"), _update(5, "ALARM", "OK"), _update(8, "OK", "ALARM")]
+    result = alarms.summarize(items, "ALARM", START, END)
+    assert result["result"] == "FAIL"
+    assert result["secondsInAlarm"] == 3 * 60 + 2 * 60
+    assert result["transitions"] == 3
+
+
+def test_alarm_already_in_alarm_at_the_start_counts_from_the_start():
+    result = alarms.summarize([_update(4, "ALARM", "OK")], "OK", START, END)
+    assert result["secondsInAlarm"] == 4 * 60
+
+
+def test_states_fall_back_on_the_summary():
+    item = dict(_update(1, "OK", "ALARM"), HistoryData="not json")
+    result = alarms.summarize([item], "ALARM", START, END)
+    assert result["secondsInAlarm"] == 9 * 60
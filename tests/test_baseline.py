@@ -0,0 +1,89 @@
+from psycopg2 import IntegrityError
+from psycopg2 import sql
+import pytest
+
+from src import baseline
+
+
+def _text(query):
+    # the statement as the server would see it, without a connection to quote with
+    if isinstance(query, sql.Composed):
+        return ''.join(_text(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return '.'.join(f'"{name}"' for name in query.strings)
+    if isinstance(query, sql.SQL):
+        return query.string
+    return query
+
+
+class ForeignKeyDatabase:
+    """
+    Deletes from a table fail while a table that references it still has rows to delete.
+    """
+
+    def __init__(self, references, updates=None):
+        self.references = references
+        self.updates = updates or {}
+        self.statements = []
+        self.reset = set()
+
+    def execute_batch(self, queries):
+        assert list(queries) == ["updates"]
+        return {"updates": [{"table_name": name, "updates": updates} for name, updates in self.updates.items()]}
+
+    def execute_update(self, statement, params=None):
+        text = _text(statement)
+        table = text.split('"capture".')[1].split()[0].strip('"')
+        if text.startswith('delete'):
+            blocking = [child for child in self.references.get(table, []) if child not in self.reset]
+            if blocking:
+                raise IntegrityError(f"{table} is still referenced from {blocking}")
+            self.reset.add(table)
+        self.statements.append(text)
+        return 1
+
+
+def _table(key_column="id", max_key=10, empty=False, updates=0):
+    return {"keyColumn": key_column, "maxKey": max_key, "empty": empty, "estimatedRows": 0, "updates": updates}
+
+
+def test_referenced_tables_are_reset_after_the_tables_that_reference_them():
+    rds = ForeignKeyDatabase({"json_data": ["ts_description"], "ts_description": ["ts_point"]})
+    tables = {"json_data": _table(), "ts_description": _table(), "ts_point": _table()}
+    result = baseline.reset(rds, tables)
+    deletes = [statement for statement in rds.statements if statement.startswith('delete')]
+    assert deletes == [
+        'delete from "capture"."ts_point" where "id" > %s',
+        'delete from "capture"."ts_description" where "id" > %s',
+        'delete from "capture"."json_data" where "id" > %s'
+    ]
+    assert result["deleted"] == {"ts_point": 1, "ts_description": 1, "json_data": 1}
+    # every reset table is analyzed once the deletes are through
+    assert rds.statements[3:] == [f'analyze "capture"."{name}"' for name in ("ts_point", "ts_description",
+                                                                             "json_data")]
+
+
+def test_a_table_without_a_key_is_emptied_if_it_was_empty():
+    rds = ForeignKeyDatabase({})
+    result = baseline.reset(rds, {"was_empty": _table(key_column=None, max_key=None, empty=True)})
+    assert rds.statements[0] == 'delete from "capture"."was_empty"'
+    assert result["deleted"] == {"was_empty": 1}
+
+
+def test_a_table_without_a_key_that_had_rows_fails_the_reset_before_anything_is_deleted():
+    rds = ForeignKeyDatabase({})
+    with pytest.raises(Exception, match=r"Can't reset \['keyless'\]"):
+        baseline.reset(rds, {"json_data": _table(), "keyless": _table(key_column=None, max_key=None)})
+    assert rds.statements == []
+
+
+def test_updates_since_the_baseline_are_reported():
+    rds = ForeignKeyDatabase({}, updates={"json_data": 12, "ts_point": 3, "unrecorded": 5})
+    result = baseline.reset(rds, {"json_data": _table(updates=2), "ts_point": _table(updates=3)})
+    assert result["updatedSinceBaseline"] == {"json_data": 10}
+
+
+def test_a_foreign_key_cycle_fails_the_reset():
+    rds = ForeignKeyDatabase({"a": ["b"], "b": ["a"]})
+    with pytest.raises(Exception, match="blocked by foreign keys"):
+        baseline.reset(rds, {"a": _table(), "b": _table()})
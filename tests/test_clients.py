@@ -0,0 +1,37 @@
+from src import clients
+
+
+class FakeClient:
+
+    def __init__(self, service, factory):
+        self.service = service
+        self.factory = factory
+
+
+def test_a_lazy_client_is_created_on_first_use_and_kept():
+    created = []
+
+    def factory(service, config):
+        created.append(service)
+        return FakeClient(service, 'first')
+
+    clients.set_factories(factory)
+    try:
+        lazy_client = clients.lazy('s3')
+        assert created == []
+        assert lazy_client.service == 's3'
+        assert lazy_client.factory == 'first'
+        assert created == ['s3']
+    finally:
+        clients.set_factories()
+
+
+def test_changing_the_factories_drops_clients_already_created():
+    clients.set_factories(lambda service, config: FakeClient(service, 'first'))
+    try:
+        lazy_client = clients.lazy('sqs')
+        assert lazy_client.factory == 'first'
+        clients.set_factories(lambda service, config: FakeClient(service, 'second'))
+        assert lazy_client.factory == 'second'
+    finally:
+        clients.set_factories()
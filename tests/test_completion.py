@@ -0,0 +1,49 @@
+from src import handler
+
+
+def _poll(state):
+    state["completion"] = handler.wait_for_test_to_finish(state, None)
+    return state["completion"]
+
+
+def test_the_run_is_complete_once_everything_has_stayed_settled(world):
+    state = {}
+    assert _poll(state)["settledPolls"] == 0  # nothing to compare json_data with yet
+    for settled_polls in range(1, handler.REQUIRED_SETTLED_POLLS):
+        completion = _poll(state)
+        assert completion["settledPolls"] == settled_polls and completion["status"] == "RUNNING"
+    assert _poll(state)["status"] == "COMPLETE"
+    assert state["completion"]["complete"]
+
+
+def _settle_then(state, move):
+    _poll(state)
+    assert _poll(state)["settledPolls"] == 1
+    move()
+    completion = _poll(state)
+    assert completion["settledPolls"] == 0 and completion["status"] == "RUNNING"
+    return completion
+
+
+def test_a_message_on_a_queue_starts_the_count_again(world):
+    completion = _settle_then({}, lambda: world.queues.update({handler.ERROR_QUEUE: 1}))
+    assert completion["queues"][handler.ERROR_QUEUE] == 1
+
+
+def test_a_running_capture_execution_starts_the_count_again(world):
+    completion = _settle_then({}, lambda: world.running_executions.update({handler.CAPTURE_STATE_MACHINE: {"x"}}))
+    assert completion["runningExecutions"] == 1
+
+
+def test_json_data_growing_starts_the_count_again(world):
+    completion = _settle_then({}, lambda: world.database.capture(handler.TEST_BUCKET, "000001/a.json"))
+    assert completion["jsonDataInserts"] == 1
+
+
+def test_a_run_that_never_settles_times_out(world):
+    world.queues[handler.CAPTURE_TRIGGER_QUEUE] = 5
+    state = {"maxWaitSeconds": 60}
+    started = _poll(state)["waitStartedAt"]
+    state["completion"]["waitStartedAt"] = started - 61
+    completion = _poll(state)
+    assert completion["status"] == "TIMED_OUT" and completion["complete"]
@@ -0,0 +1,73 @@
+import pytest
+
+from src import concurrency
+
+FUNCTION = "aqts-capture-ts-loader-test-loadTimeSeries"
+
+
+def test_no_profile_changes_nothing():
+    assert concurrency.resolve(None) == {}
+    assert concurrency.resolve("baseline") == {"name": "baseline"}
+
+
+def test_a_named_profile_is_looked_up_and_overridden_per_stage():
+    resolved = concurrency.resolve({"name": "large-memory", "qualifier": "live",
+                                    "functions": {"aqts-capture-ts-loader": {"reservedConcurrency": 20}}})
+    assert resolved["qualifier"] == "live"
+    assert resolved["functions"]["aqts-capture-ts-loader"] == {"memorySize": 2048, "reservedConcurrency": 20}
+    assert resolved["functions"]["aqts-capture-raw-load"] == {"memorySize": 1024}
+    # the named profile itself is left alone
+    assert concurrency.PROFILES["large-memory"]["functions"]["aqts-capture-ts-loader"] == {"memorySize": 2048}
+
+
+def test_an_unknown_profile_is_refused():
+    with pytest.raises(Exception, match="Unknown concurrency profile"):
+        concurrency.resolve("huge")
+
+
+def test_a_stage_s_settings_are_the_default_with_its_own_on_top():
+    profile = {"default": {"reservedConcurrency": 10, "memorySize": 512},
+               "functions": {"aqts-capture-ts-loader": {"reservedConcurrency": None}}}
+    assert concurrency.settings_for(profile, "aqts-capture-ts-loader") == {"reservedConcurrency": None,
+                                                                          "memorySize": 512}
+    assert concurrency.settings_for(profile, "aqts-capture-raw-load") == {"reservedConcurrency": 10,
+                                                                         "memorySize": 512}
+
+
+def test_unknown_settings_and_provisioned_concurrency_without_a_qualifier_are_refused():
+    with pytest.raises(Exception, match="Unknown concurrency settings"):
+        concurrency.settings_for({"default": {"timeout": 30}}, "aqts-capture-raw-load")
+    with pytest.raises(Exception, match="needs a 'qualifier'"):
+        concurrency.settings_for({"default": {"provisionedConcurrency": 5}}, "aqts-capture-raw-load")
+
+
+def test_settings_are_applied_and_snapshotted(world):
+    world.functions[FUNCTION] = {'MemorySize': 512, 'Environment': {}}
+    lambda_client = world.client('lambda')
+    waited = []
+    changed = concurrency.apply(lambda_client, FUNCTION,
+                                {"memorySize": 2048, "reservedConcurrency": 20, "provisionedConcurrency": 5},
+                                "live", waited.append)
+    assert changed == {"memorySize": 2048, "reservedConcurrency": 20, "provisionedConcurrency": 5}
+    # before the memory update, and after it
+    assert waited == [FUNCTION, FUNCTION]
+    assert concurrency.snapshot(lambda_client, FUNCTION, "live") == {
+        "memorySize": 2048, "reservedConcurrency": 20, "provisionedConcurrency": 5}
+    assert concurrency.provisioned_status(lambda_client, FUNCTION, "live") == 'READY'
+
+
+def test_none_takes_a_setting_off_even_if_it_was_never_set(world):
+    world.functions[FUNCTION] = {'MemorySize': 512, 'Environment': {}, 'ReservedConcurrency': 10}
+    lambda_client = world.client('lambda')
+    changed = concurrency.apply(lambda_client, FUNCTION,
+                                {"memorySize": None, "reservedConcurrency": None, "provisionedConcurrency": None},
+                                "live")
+    assert changed == {"reservedConcurrency": None, "provisionedConcurrency": None}
+    assert concurrency.snapshot(lambda_client, FUNCTION, "live") == {
+        "memorySize": 512, "reservedConcurrency": None, "provisionedConcurrency": None}
+    assert concurrency.provisioned_status(lambda_client, FUNCTION, "live") is None
+
+
+def test_provisioned_concurrency_is_left_alone_without_a_qualifier(world):
+    world.functions[FUNCTION] = {'MemorySize': 512, 'Environment': {}}
+    assert concurrency.apply(world.client('lambda'), FUNCTION, {"provisionedConcurrency": 5}) == {}
@@ -0,0 +1,132 @@
+import threading
+
+from src import copier, dataset
+
+
+class FakeS3:
+
+    def __init__(self, failing=(), pages=()):
+        self.failing = set(failing)
+        self.pages = pages
+        self.copied = []
+        self.multipart = []
+        self.lock = threading.Lock()
+
+    def copy_object(self, CopySource, Bucket, Key):
+        if CopySource['Key'] in self.failing or Key in self.failing:
+            raise Exception(f"cannot copy {CopySource['Key']}")
+        with self.lock:
+            self.copied.append(Key)
+
+    def copy(self, CopySource, Bucket, Key, Config=None):
+        with self.lock:
+            self.multipart.append(Key)
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, **kwargs):
+        return iter(self.pages)
+
+
+def _objects(count, size=10):
+    return [{"Key": f"key-{index:03d}", "Size": size} for index in range(count)]
+
+
+def test_every_object_is_copied():
+    s3 = FakeS3()
+    stats = copier.copy_objects(s3, 'src', 'dest', _objects(50), max_workers=4)
+    assert stats["keys"] == 50
+    assert stats["bytes"] == 500
+    assert stats["failedKeys"] == 0
+    assert sorted(s3.copied) == [obj["Key"] for obj in _objects(50)]
+
+
+def test_failures_are_counted_and_reported():
+    stats = copier.copy_objects(FakeS3(failing={"key-020"}), 'src', 'dest', _objects(50), max_workers=4)
+    assert stats["keys"] == 49
+    assert stats["failedKeys"] == 1
+    assert stats["failures"][0]["key"] == "key-020"
+
+
+def test_the_copies_of_one_key_are_tracked_apart():
+    copy = dataset.copy_prefix(1) + "key-005"
+    objects = list(dataset.multiply(_objects(10), {"multiplier": 2}))
+    stats = copier.copy_objects(FakeS3(failing={copy}), 'src', 'dest', objects, max_workers=4)
+    assert stats["keys"] == 19
+    assert stats["failures"] == [{"key": copy, "error": repr(Exception("cannot copy key-005"))}]
+    # the first copy of key-005 went through, the watermark still stops before the key
+    assert stats["lastKey"] == "key-004"
+
+
+def test_watermark_reaches_the_last_key():
+    stats = copier.copy_objects(FakeS3(), 'src', 'dest', _objects(50), max_workers=4)
+    assert stats["complete"] is True
+    assert stats["lastKey"] == "key-049"
+
+
+def test_watermark_stops_before_a_failed_key():
+    stats = copier.copy_objects(FakeS3(failing={"key-020"}), 'src', 'dest', _objects(50), max_workers=4)
+    assert stats["complete"] is False
+    assert stats["lastKey"] == "key-019"
+
+
+def test_checkpoints_only_move_forward(monkeypatch):
+    monkeypatch.setattr(copier, 'CHECKPOINT_INTERVAL', -1)
+    watermarks = []
+    copier.copy_objects(FakeS3(), 'src', 'dest', _objects(40), max_workers=2,
+                        checkpoint=lambda stats: watermarks.append(stats["lastKey"]))
+    assert len(watermarks) > 1
+    assert watermarks[-1] == "key-039"
+    reached = [key for key in watermarks if key is not None]
+    assert reached == sorted(reached)
+
+
+def test_deadline_stops_new_copies():
+    stats = copier.copy_objects(FakeS3(), 'src', 'dest', _objects(10), deadline=0)
+    assert stats["complete"] is False
+    assert stats["keys"] == 0
+    assert stats["lastKey"] is None
+
+
+def test_large_objects_go_through_the_managed_transfer():
+    s3 = FakeS3()
+    objects = _objects(2) + [{"Key": "big", "Size": copier.MULTIPART_THRESHOLD}]
+    copier.copy_objects(s3, 'src', 'dest', objects, max_workers=2)
+    assert s3.multipart == ["big"]
+    assert sorted(s3.copied) == ["key-000", "key-001"]
+
+
+def test_listing_follows_every_page():
+    pages = [{"Contents": _objects(3)}, {}, {"Contents": [{"Key": "last", "Size": 1}]}]
+    assert [obj["Key"] for obj in copier.list_objects(FakeS3(pages=pages), 'src')] == [
+        "key-000", "key-001", "key-002", "last"
+    ]
+
+
+def test_shards_cover_every_key_once():
+    objects = _objects(23)
+    shards = copier.plan_shards(objects, keys_per_shard=5)
+    assert [shard["keys"] for shard in shards] == [5, 5, 5, 5, 3]
+    # each shard lists its own range, starting after its startAfter key
+    keys = [obj["Key"] for shard in shards
+            for obj in copier.shard_objects((obj for obj in objects if obj["Key"] > shard["startAfter"]), shard)]
+    assert keys == [obj["Key"] for obj in objects]
+
+
+def test_a_copy_is_recognised_by_size_and_etag():
+    source = {"Key": "a", "Size": 10, "ETag": '"abc"'}
+    assert copier.is_already_copied(source, {"Size": 10, "ETag": '"abc"'})
+    assert not copier.is_already_copied(source, {"Size": 10, "ETag": '"def"'})
+    assert not copier.is_already_copied(source, {"Size": 11, "ETag": '"abc"'})
+    assert not copier.is_already_copied(source, None)
+    # a multipart copy has its own ETag, only the size can be compared
+    assert copier.is_already_copied(source, {"Size": 10, "ETag": '"def-2"'})
+
+
+def test_a_shard_is_trimmed_out_of_the_whole_stream():
+    objects = _objects(23)
+    shards = copier.plan_shards(objects, keys_per_shard=5)
+    assert [obj["Key"] for obj in copier.shard_objects(iter(objects), shards[1])] == [
+        "key-005", "key-006", "key-007", "key-008", "key-009"
+    ]
@@ -0,0 +1,62 @@
+import datetime
+
+from src import cost
+
+START = datetime.datetime(2020, 10, 1, 12, 0, tzinfo=datetime.timezone.utc)
+END = START + datetime.timedelta(hours=2)
+
+
+def _instance(identifier, instance_class="db.r5.large", created_at=None):
+    instance = {'DBInstanceIdentifier': identifier, 'DBInstanceClass': instance_class}
+    if created_at is not None:
+        instance['InstanceCreateTime'] = created_at
+    return instance
+
+
+def test_an_instance_created_during_the_run_is_counted_from_its_creation():
+    hours = cost.instance_hours([_instance("writer", created_at=START + datetime.timedelta(minutes=30))], START, END)
+    assert hours == {"writer": {"instanceClass": "db.r5.large", "hours": 1.5}}
+
+
+def test_a_warm_cluster_is_counted_from_the_start_of_the_run():
+    hours = cost.instance_hours([_instance("writer", created_at=START - datetime.timedelta(days=3)),
+                                 _instance("reader")], START, END)
+    assert hours["writer"]["hours"] == 2
+    assert hours["reader"]["hours"] == 2
+
+
+def test_an_instance_created_after_the_results_step_costs_nothing():
+    hours = cost.instance_hours([_instance("late", created_at=END + datetime.timedelta(minutes=5))], START, END)
+    assert hours["late"]["hours"] == 0
+
+
+def test_instance_prices_are_overridden_per_class():
+    prices = cost.price_table({"auroraInstanceHour": {"db.r5.large": 1.0}, "lambdaGbSecond": 0.5})
+    assert prices["auroraInstanceHour"]["db.r5.large"] == 1.0
+    assert prices["auroraInstanceHour"]["db.r5.xlarge"] == cost.PRICES["auroraInstanceHour"]["db.r5.xlarge"]
+    assert prices["lambdaGbSecond"] == 0.5
+    assert cost.PRICES["auroraInstanceHour"]["db.r5.large"] == 0.29
+
+
+def test_efficiency_prices_the_run():
+    instances = {"writer": {"instanceClass": "db.r5.large", "hours": 2}}
+    functions = {"transform": {"memorySize": 1024, "invocations": 1000000, "gbSeconds": 1000}}
+    result = cost.efficiency(7200, 20000, 400000, instances, functions, 100, cost.price_table(
+        {"lambdaGbSecond": 0.001}))
+    assert result["cost"] == {"database": 0.58, "databaseIo": 0.144, "lambda": 1.2, "total": 1.924}
+    assert result["objectsPerDbHour"] == 10000
+    assert result["costPer10kObjects"] == 0.962
+    assert result["unpricedInstanceClasses"] == []
+
+
+def test_an_unpriced_instance_class_leaves_the_cost_out():
+    instances = {"writer": {"instanceClass": "db.x2g.large", "hours": 2},
+                 "reader": {"instanceClass": "db.r5.large", "hours": 2}}
+    result = cost.efficiency(7200, 20000, 400000, instances, {}, None, cost.price_table())
+    assert result["unpricedInstanceClasses"] == ["db.x2g.large"]
+    assert result["cost"]["database"] is None
+    assert result["cost"]["total"] is None
+    assert result["costPer10kObjects"] is None
+    assert result["objectsPerDollar"] is None
+    assert result["dbHours"] == 4
+    assert result["objectsPerDbHour"] == 5000
@@ -0,0 +1,40 @@
+from src import dataset
+
+
+def _entries(count):
+    return [{"Key": f"key-{index}", "Type": "ts-corrected" if index % 2 else "ts-description", "Size": index}
+            for index in range(count)]
+
+
+def test_fraction_is_a_deterministic_sample():
+    entries = _entries(2000)
+    first = [entry["Key"] for entry in dataset.select(entries, {"fraction": 0.25})]
+    second = [entry["Key"] for entry in dataset.select(entries, {"fraction": 0.25})]
+    assert first == second
+    assert 400 < len(first) < 600
+
+
+def test_the_seed_picks_another_sample():
+    entries = _entries(200)
+    assert list(dataset.select(entries, {"fraction": 0.5})) != list(dataset.select(entries, {"fraction": 0.5,
+                                                                                             "seed": 7}))
+
+
+def test_a_larger_fraction_keeps_the_smaller_sample():
+    entries = _entries(500)
+    small = {entry["Key"] for entry in dataset.select(entries, {"fraction": 0.1})}
+    large = {entry["Key"] for entry in dataset.select(entries, {"fraction": 0.3})}
+    assert small <= large
+
+
+def test_types_and_sizes_filter():
+    selected = list(dataset.select(_entries(10), {"types": ["ts-corrected"], "minSize": 3, "maxSize": 7}))
+    assert [entry["Key"] for entry in selected] == ["key-3", "key-5", "key-7"]
+
+
+def test_multiply_puts_the_extra_copies_under_their_own_prefix():
+    copies = list(dataset.multiply(_entries(2), {"multiplier": 3}))
+    assert [copy.get("DestKey") for copy in copies] == [
+        None, "load-test-copy-1/key-0", "load-test-copy-2/key-0",
+        None, "load-test-copy-1/key-1", "load-test-copy-2/key-1"
+    ]
@@ -0,0 +1,113 @@
+import psycopg2
+
+from src import dbstats
+
+
+class StatsDatabase:
+    """
+    Answers the snapshot queries from canned rows.
+    """
+
+    def __init__(self, installed=True, statements=(), readable=True, tables=(), bgwriter=None, resettable=True):
+        self.installed = installed
+        self.statements = list(statements)
+        self.readable = readable
+        self.tables = list(tables)
+        self.bgwriter = bgwriter or {}
+        self.resettable = resettable
+
+    def execute_batch(self, queries):
+        answers = {
+            "extension": [{"installed": self.installed}],
+            "tables": self.tables,
+            "bgwriter": [self.bgwriter]
+        }
+        if "statements" in queries and not self.readable:
+            raise psycopg2.ProgrammingError("pg_stat_statements must be loaded via shared_preload_libraries")
+        answers["statements"] = self.statements
+        return {name: answers[name] for name in queries}
+
+    def execute_update(self, statement, params=None):
+        if not self.resettable:
+            raise psycopg2.ProgrammingError("must be owner of extension pg_stat_statements")
+        return 0
+
+    def execute_sql(self, statement, params=None):
+        return (None,)
+
+
+def _statement(queryid, calls, total_time, hit=0, read=0, **row):
+    return dict({"userid": 10, "queryid": queryid, "query": f"select {queryid}", "calls": calls,
+                 "total_time": total_time, "rows": calls, "shared_blks_hit": hit, "shared_blks_read": read}, **row)
+
+
+def _table(name, **counters):
+    row = {column: 0 for column in dbstats.TABLE_COUNTERS}
+    row.update(table_name=name, n_live_tup=100, n_dead_tup=0)
+    row.update(counters)
+    return row
+
+
+def test_statements_are_diffed_against_the_start():
+    start = dbstats.snapshot(StatsDatabase(statements=[_statement(1, 10, 100.0), _statement(2, 5, 5.0)]))
+    end = dbstats.snapshot(StatsDatabase(statements=[
+        _statement(1, 30, 400.0, hit=90, read=10),
+        _statement(2, 5, 5.0),
+        _statement(3, 2, 50.0)
+    ]))
+    statements = dbstats.compare(start, end)["statements"]
+    assert statements["reset"] is False
+    # statement 2 wasn't called during the run
+    assert statements["statements"] == 2
+    assert statements["calls"] == 22
+    assert statements["totalTimeMs"] == 350.0
+    assert [delta["queryId"] for delta in statements["topByTotalTime"]] == ["1", "3"]
+    assert [delta["queryId"] for delta in statements["topByMeanTime"]] == ["3", "1"]
+    assert statements["topByTotalTime"][0]["meanTimeMs"] == 15.0
+    assert statements["hitRatio"] == 0.9
+
+
+def test_the_postgres_13_column_names_are_read_too():
+    row = _statement(1, 4, None, total_exec_time=8.0)
+    end = dbstats.snapshot(StatsDatabase(statements=[row]))
+    start = dict(dbstats.snapshot(StatsDatabase()), statementsReset=True)
+    statements = dbstats.compare(start, end)["statements"]
+    assert statements["reset"] is True
+    assert statements["topByTotalTime"][0]["totalTimeMs"] == 8.0
+
+
+def test_without_pg_stat_statements_there_are_no_statement_statistics():
+    assert dbstats.snapshot(StatsDatabase(installed=False))["statements"] is None
+    assert dbstats.snapshot(StatsDatabase(readable=False))["statements"] is None
+    start = dbstats.snapshot(StatsDatabase(installed=False, tables=[_table("capture.json_data")]))
+    end = dbstats.snapshot(StatsDatabase(installed=False, tables=[_table("capture.json_data", n_tup_ins=5)]))
+    result = dbstats.compare(start, end)
+    assert result["statements"] is None
+    assert result["tables"][0]["inserts"] == 5
+
+
+def test_a_reset_the_user_is_not_allowed_is_reported():
+    assert dbstats.reset(StatsDatabase())
+    assert not dbstats.reset(StatsDatabase(resettable=False))
+
+
+def test_tables_are_diffed_and_the_most_sequentially_read_come_first():
+    start = dbstats.snapshot(StatsDatabase(tables=[
+        _table("capture.json_data", seq_scan=1, seq_tup_read=10, n_dead_tup=5),
+        _table("capture.untouched")
+    ], bgwriter={"checkpoints_timed": 3, "buffers_alloc": 10, "stats_reset": "2020-10-01"}))
+    end = dbstats.snapshot(StatsDatabase(tables=[
+        _table("capture.json_data", seq_scan=2, seq_tup_read=20, n_tup_ins=50, heap_blks_hit=30, heap_blks_read=10,
+               n_dead_tup=25),
+        _table("capture.ts_point", seq_scan=5, seq_tup_read=5000, idx_scan=2),
+        _table("capture.untouched")
+    ], bgwriter={"checkpoints_timed": 4, "buffers_alloc": 25, "stats_reset": "2020-10-01"}))
+    result = dbstats.compare(start, end)
+    assert [table["table_name"] for table in result["tables"]] == ["capture.ts_point", "capture.json_data"]
+    json_data = result["tables"][1]
+    assert json_data["seqScans"] == 1
+    assert json_data["inserts"] == 50
+    assert json_data["heapHitRatio"] == 0.75
+    assert json_data["deadTuplesAdded"] == 20
+    assert json_data["indexHitRatio"] is None
+    assert result["bgwriter"] == {"checkpoints_timed": 1, "buffers_alloc": 15}
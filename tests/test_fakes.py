@@ -0,0 +1,20 @@
+import pytest
+
+from harness import fakes
+from src import baseline
+
+
+def test_record_and_reset_against_the_fake_database():
+    database = fakes.FakeDatabase(fakes.World())
+    database.capture('bucket', 'before')
+    recorded = baseline.record(database)
+    assert recorded["json_data"]["keyColumn"] == "json_data_id"
+    assert recorded["json_data"]["maxKey"] == 1
+    database.capture('bucket', 'during')
+    assert baseline.reset(database, recorded)["deleted"] == {"json_data": 1}
+    assert [key for key, _ in database.json_data] == ["s3://bucket/before"]
+
+
+def test_the_fake_database_refuses_sql_it_does_not_know():
+    with pytest.raises(NotImplementedError):
+        fakes.FakeDatabase(fakes.World()).execute_batch({"unknown": "select 1"})
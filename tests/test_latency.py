@@ -0,0 +1,68 @@
+from src import latency
+
+
+def _entry(key, copied_at=100.0, size=10, object_type="ts-corrected"):
+    return {"Key": key, "Size": size, "Type": object_type, "copiedAt": copied_at}
+
+
+def test_stored_keys_are_matched_with_or_without_the_bucket_in_front():
+    copied = {"a.json": _entry("a.json"), "runs/run-1/b.json": _entry("runs/run-1/b.json", 110.0)}
+    latencies, matched = latency.match(copied, [
+        ("s3://test-bucket/a.json", 103.0),
+        ("runs/run-1/b.json", 115.5)
+    ], "test-bucket")
+    assert matched == 2
+    assert latencies == {("ts-corrected", "<100KB"): [3.0, 5.5]}
+
+
+def test_rows_of_other_files_and_repeats_are_left_out():
+    copied = {"a.json": _entry("a.json")}
+    latencies, matched = latency.match(copied, [
+        ("s3://test-bucket/not-ours.json", 101.0),
+        (None, 101.0),
+        ("s3://test-bucket/a.json", None),
+        ("s3://test-bucket/a.json", 102.0),
+        ("s3://test-bucket/a.json", 150.0)
+    ], "test-bucket")
+    assert matched == 1
+    assert latencies == {("ts-corrected", "<100KB"): [2.0]}
+
+
+def test_a_row_stored_before_the_copy_finished_counts_as_no_latency():
+    latencies, _ = latency.match({"a.json": _entry("a.json", 100.0)}, [("a.json", 99.5)], "test-bucket")
+    assert latencies == {("ts-corrected", "<100KB"): [0]}
+
+
+def test_files_are_grouped_by_type_and_size():
+    copied = {
+        "small.json": _entry("small.json", size=1024, object_type=None),
+        "big.json": _entry("big.json", size=5 * 1024 * 1024),
+        "huge.json": _entry("huge.json", size=200 * 1024 * 1024)
+    }
+    latencies, _ = latency.match(copied, [(key, 101.0) for key in copied], "test-bucket")
+    assert sorted(latencies) == [("other", "<100KB"), ("ts-corrected", "1MB-10MB"), ("ts-corrected", ">100MB")]
+    assert latency.size_bucket(100 * 1024) == '100KB-1MB'
+
+
+def test_percentiles_and_histogram():
+    described = latency.describe([float(value) for value in range(1, 101)])
+    assert described["objects"] == 100
+    assert described["p50Seconds"] == 51
+    assert described["p95Seconds"] == 96
+    assert described["p99Seconds"] == 100
+    assert described["maxSeconds"] == 100
+    assert described["histogram"]["<=1s"] == 1
+    assert described["histogram"]["<=2s"] == 1
+    assert described["histogram"]["<=5s"] == 3
+    assert described["histogram"]["<=60s"] == 30
+    assert described["histogram"]["<=120s"] == 40
+    assert described["histogram"][">3600s"] == 0
+    assert sum(described["histogram"].values()) == 100
+
+
+def test_the_summary_counts_the_files_that_never_showed_up():
+    summary = latency.summarize({("ts-corrected", "<100KB"): [1.0, 3.0], ("other", "<100KB"): [2.0]}, 5, 3)
+    assert summary["unmatchedObjects"] == 2
+    assert summary["overall"]["objects"] == 3
+    assert [(group["type"], group["objects"]) for group in summary["groups"]] == [("other", 1), ("ts-corrected", 2)]
+    assert latency.summarize({}, 4, 0)["overall"] is None
@@ -0,0 +1,96 @@
+import datetime
+
+import pytest
+
+from src import handler
+
+
+def _add_instances(world, cluster, count):
+    for n in range(1, count + 1):
+        world.instances[f"{cluster}-instance{n}"] = {
+            'cluster': cluster, 'class': handler.DB_INSTANCE_CLASS, 'writer': n == 1,
+            'created': datetime.datetime.now(datetime.timezone.utc)}
+
+
+def test_a_clone_is_made_of_the_real_cluster(world):
+    assert handler.restore_db_cluster({"clone": True}, None) == {
+        "restoreType": "clone", "source": handler.CLONE_SOURCE_CLUSTER}
+    assert handler.DB_CLUSTER_IDENTIFIER in world.clusters
+    assert 'rds.restore_db_cluster_from_snapshot' not in world.calls
+
+
+def test_the_snapshot_is_restored_when_the_cluster_to_clone_is_not_there(world):
+    restored = handler.restore_db_cluster({"clone": "nwcapture-gone", "snapshotIdentifier": "snapshot-1"}, None)
+    assert restored == {"restoreType": "snapshot", "source": "snapshot-1"}
+    assert world.calls['rds.restore_db_cluster_to_point_in_time'] == 1
+    assert world.clusters[handler.DB_CLUSTER_IDENTIFIER]['EngineVersion'] == handler.ENGINE_VERSION
+
+
+def test_no_cluster_is_neither_available_nor_a_failure(world):
+    status = handler.check_load_db({}, None)
+    assert status["clusterStatus"] is None
+    assert not status["clusterAvailable"] and not status["instancesAvailable"]
+    assert status["instancesDeleted"]
+
+
+def test_the_instances_are_available_once_every_one_the_profile_asks_for_is(world):
+    handler.restore_db_cluster({}, None)
+    event = {"database": {"readerCount": 1}}
+    _add_instances(world, handler.DB_CLUSTER_IDENTIFIER, 1)
+    status = handler.check_load_db(event, None)
+    assert status["clusterAvailable"] and not status["instancesAvailable"]
+    assert not status["instancesDeleted"]
+    _add_instances(world, handler.DB_CLUSTER_IDENTIFIER, 2)
+    status = handler.check_load_db(event, None)
+    assert status["instancesAvailable"]
+    assert status["instances"] == {f"{handler.DB_CLUSTER_IDENTIFIER}-instance1": 'available',
+                                   f"{handler.DB_CLUSTER_IDENTIFIER}-instance2": 'available'}
+
+
+def test_only_a_keep_warm_run_reuses_an_available_cluster(world):
+    handler.restore_db_cluster({}, None)
+    _add_instances(world, handler.DB_CLUSTER_IDENTIFIER, 1)
+    assert not handler.check_load_db({}, None)["reusable"]
+    assert handler.check_load_db({"keepWarm": True}, None)["reusable"]
+    world.clusters[handler.DB_CLUSTER_IDENTIFIER]['Status'] = 'modifying'
+    assert not handler.check_load_db({"keepWarm": True}, None)["reusable"]
+
+
+def test_a_cluster_that_failed_to_restore_is_an_error(world):
+    handler.restore_db_cluster({}, None)
+    world.clusters[handler.DB_CLUSTER_IDENTIFIER]['Status'] = 'incompatible-restore'
+    with pytest.raises(Exception, match="incompatible-restore"):
+        handler.check_load_db({}, None)
+
+
+def test_what_the_database_profile_leaves_out_comes_from_the_defaults():
+    assert handler._database_profile(None) == handler.DATABASE_DEFAULTS
+    assert handler._database_profile({"database": None}) == handler.DATABASE_DEFAULTS
+    profile = handler._database_profile({"database": {"instanceClass": "db.r5.4xlarge", "readerCount": "2"}})
+    assert profile == dict(handler.DATABASE_DEFAULTS, instanceClass="db.r5.4xlarge", readerCount=2)
+
+
+def test_a_reader_count_that_is_not_a_count_is_refused():
+    with pytest.raises(ValueError):
+        handler._database_profile({"database": {"readerCount": "two"}})
+    with pytest.raises(Exception, match="-1 readers"):
+        handler._database_profile({"database": {"readerCount": -1}})
+
+
+def test_the_writer_is_instance1_and_the_readers_follow():
+    assert handler._db_instance_identifiers(handler._database_profile({}), handler.DB_CLUSTER_IDENTIFIER) == [
+        handler.DB_INSTANCE_IDENTIFIER]
+    assert handler._db_instance_identifiers(handler._database_profile({"database": {"readerCount": 2}}),
+                                            "nwcapture-load-run-1") == [
+        "nwcapture-load-run-1-instance1", "nwcapture-load-run-1-instance2", "nwcapture-load-run-1-instance3"]
+
+
+def test_the_instances_are_created_with_the_profile_s_class_once(world):
+    handler.restore_db_cluster({}, None)
+    event = {"database": {"instanceClass": "db.r5.4xlarge", "readerCount": 1}}
+    handler.create_db_instance(event, None)
+    handler.create_db_instance(event, None)
+    assert {name: (instance['class'], instance['writer']) for name, instance in world.instances.items()} == {
+        handler.DB_INSTANCE_IDENTIFIER: ("db.r5.4xlarge", True),
+        f"{handler.DB_CLUSTER_IDENTIFIER}-instance2": ("db.r5.4xlarge", False)}
+    assert handler.check_load_db(event, None)["instancesAvailable"]
@@ -0,0 +1,55 @@
+import datetime
+
+from src import handler
+from src import manifest
+
+MODIFIED = datetime.datetime(2020, 10, 1, tzinfo=datetime.timezone.utc)
+
+
+def _object(key, etag='"a"', size=10):
+    return {'Key': key, 'ETag': etag, 'Size': size, 'LastModified': MODIFIED}
+
+
+def test_unchanged_keys_reuse_the_previous_entry_and_only_new_or_changed_ones_are_rebuilt():
+    previous_entries, _ = manifest.build([_object('1/TimeSeriesCorrectedData.json'),
+                                          _object('2/FieldVisitReadings.json'),
+                                          _object('3/FieldVisitData.json')])
+    previous = {entry['Key']: entry for entry in previous_entries}
+    entries, changes = manifest.build([_object('1/TimeSeriesCorrectedData.json'),
+                                       _object('2/FieldVisitReadings.json', etag='"b"'),
+                                       _object('4/Other.json')], previous)
+    assert changes == {"added": 1, "changed": 1, "removed": 1, "unchanged": 1}
+    assert entries[0] is previous['1/TimeSeriesCorrectedData.json']
+    assert entries[1]['ETag'] == '"b"'
+    assert [entry['Type'] for entry in entries] == ['ts-corrected', 'field-visit-readings', 'other']
+    # the caller's previous manifest is left as it was
+    assert len(previous) == 3
+
+
+def test_a_new_size_with_the_same_etag_is_a_change():
+    previous = {'1/a.json': manifest.build([_object('1/a.json')])[0][0]}
+    assert manifest.build([_object('1/a.json', size=11)], previous)[1]["changed"] == 1
+
+
+def _refresh(world):
+    world.calls.pop('s3.put_object', None)
+    return handler.refresh_manifest({}, None)
+
+
+def test_the_manifest_is_only_rewritten_when_the_reference_bucket_changed(world):
+    world.seed_reference_bucket(handler.SRC_BUCKET, 5)
+    first = _refresh(world)
+    assert first["changes"]["added"] == 5
+    assert first["manifest"]["objects"] == 5
+    assert world.calls['s3.put_object'] == 1
+
+    unchanged = _refresh(world)
+    assert unchanged == {"manifest": first["manifest"], "changes": dict(first["changes"], added=0, unchanged=5)}
+    assert 's3.put_object' not in world.calls
+
+    world.client('s3').put_object(Bucket=handler.SRC_BUCKET, Key='000099/FieldVisitData.json', Body=b'{}')
+    added = _refresh(world)
+    assert added["changes"] == {"added": 1, "changed": 0, "removed": 0, "unchanged": 5}
+    assert added["manifest"]["objects"] == 6
+    assert world.calls['s3.put_object'] == 1
+    assert [entry['Key'] for entry in handler._reference_objects()][-1] == '000099/FieldVisitData.json'
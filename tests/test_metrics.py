@@ -0,0 +1,73 @@
+import datetime
+
+from src import metrics
+
+START = datetime.datetime(2020, 10, 1, 12, 0)
+
+
+class PagingCloudWatch:
+    """
+    Answers each get_metric_data call a page of `page_size` results at a time.
+    """
+
+    def __init__(self, page_size=None):
+        self.page_size = page_size
+        self.calls = []
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy, NextToken=None):
+        self.calls.append({"ids": [query['Id'] for query in MetricDataQueries], "token": NextToken,
+                           "periods": {query['MetricStat']['Period'] for query in MetricDataQueries}})
+        offset = int(NextToken or 0)
+        page = MetricDataQueries[offset:offset + self.page_size] if self.page_size else MetricDataQueries
+        response = {'MetricDataResults': [{'Id': query['Id'], 'Values': [int(query['Id'][1:])]} for query in page]}
+        if offset + len(page) < len(MetricDataQueries):
+            response['NextToken'] = str(offset + len(page))
+        return response
+
+
+def _queries(count):
+    return [{'Id': f"q{n}", 'MetricStat': {'Period': 60}} for n in range(count)]
+
+
+def test_queries_are_sent_500_at_a_time_with_the_whole_window_as_one_period():
+    cloudwatch = PagingCloudWatch()
+    values = metrics.get_metric_data(cloudwatch, _queries(1201), START, START + datetime.timedelta(minutes=90))
+    assert [len(call["ids"]) for call in cloudwatch.calls] == [500, 500, 201]
+    assert all(call["periods"] == {5400} for call in cloudwatch.calls)
+    assert values["q1200"] == [1200]
+    assert len(values) == 1201
+
+
+def test_next_token_is_followed_until_every_result_is_in():
+    cloudwatch = PagingCloudWatch(page_size=200)
+    values = metrics.get_metric_data(cloudwatch, _queries(501), START, START + datetime.timedelta(seconds=10))
+    assert [(len(call["ids"]), call["token"]) for call in cloudwatch.calls] == [
+        (500, None), (500, "200"), (500, "400"), (1, None)]
+    # a window under a minute is still asked for as one minute
+    assert cloudwatch.calls[0]["periods"] == {60}
+    assert all(values[f"q{n}"] == [n] for n in range(501))
+
+
+def _lambda(invocations=10, errors=0, throttles=0, duration_sum=0):
+    return {'Invocations': invocations, 'Errors': errors, 'Throttles': throttles, 'DurationSum': duration_sum,
+            'MaxConcurrentExecutions': 2, 'DurationP50': 10, 'DurationP90': 20, 'DurationP99': 30}
+
+
+def test_the_stage_that_spent_the_most_time_busy_is_the_bottleneck():
+    functions = ["aqts-capture-raw-load-TEST-iowCapture", "aqts-capture-ts-loader-TEST-loadTimeSeries"]
+    harvested = {'lambda': {functions[0]: _lambda(duration_sum=1000, throttles=3),
+                            functions[1]: _lambda(duration_sum=3000, errors=1)}}
+    table = metrics.stage_table(harvested, functions, "TEST")
+    assert [row["stage"] for row in table["stages"]] == ["aqts-capture-raw-load", "aqts-capture-ts-loader"]
+    assert [row["shareOfBusyTime"] for row in table["stages"]] == [0.25, 0.75]
+    assert table["bottleneck"] == "aqts-capture-ts-loader"
+    assert table["throttledStages"] == ["aqts-capture-raw-load"]
+    assert table["erroringStages"] == ["aqts-capture-ts-loader"]
+
+
+def test_stages_without_metrics_have_no_bottleneck():
+    table = metrics.stage_table({}, ["aqts-capture-raw-load-TEST-iowCapture"], "TEST")
+    assert table["stages"][0]["invocations"] == 0
+    assert table["stages"][0]["busySeconds"] == 0 and table["stages"][0]["shareOfBusyTime"] == 0
+    assert table["bottleneck"] is None
+    assert metrics.stage_table({}, [], "TEST")["bottleneck"] is None
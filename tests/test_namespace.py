@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from src import handler
+
+
+def _run(run_id, **event):
+    return dict(event, run={"id": run_id})
+
+
+def test_the_run_id_is_lower_cased_with_runs_of_other_characters_collapsed_to_one_dash():
+    assert handler._namespace(_run("Nightly__Run--2020.10.01_")) == "nightly-run-2020-10-01"
+
+
+def test_the_warm_environment_and_lambdas_invoked_by_hand_have_no_namespace():
+    assert handler._namespace(_run("nightly", keepWarm=True)) == ''
+    assert handler._namespace(_run("nightly", teardown=True)) == ''
+    assert handler._namespace({}) == ''
+    assert handler._namespace({"namespace": "given"}) == "given"
+
+
+def test_a_long_run_id_is_cut_short_with_a_hash_that_keeps_it_unique():
+    first = handler._namespace(_run("a" * 40 + "-first"))
+    second = handler._namespace(_run("a" * 40 + "-second"))
+    assert len(first) == handler.MAX_NAMESPACE_LENGTH
+    assert first != second
+    assert first[:27] == second[:27] == "a" * 27
+    profile = handler._database_profile({"database": {"readerCount": 15}})
+    identifiers = handler._db_instance_identifiers(profile, handler._resources({"namespace": first})["cluster"])
+    assert max(len(identifier) for identifier in identifiers) <= 63
+
+
+def test_a_run_s_endpoint_is_worked_out_from_the_warm_environment_s(world):
+    assert handler._load_db_address({"namespace": "run-1"}) == "nwcapture-load-run-1.local"
+    assert handler._load_db_address({}) == "nwcapture-load.local"
+
+
+def test_a_run_s_endpoint_is_not_guessed_from_a_foreign_address(world):
+    world.secrets[handler.NWCAPTURE_LOAD]['DATABASE_ADDRESS'] = 'somewhere-else.local'
+    assert handler._load_db_address({}) == 'somewhere-else.local'
+    with pytest.raises(Exception, match="can't be worked out"):
+        handler._load_db_address({"namespace": "run-1"})
+
+
+def test_the_cluster_create_time_is_read_from_the_run_s_cluster(world):
+    world.clusters[f"{handler.DB_CLUSTER_IDENTIFIER}-run-1"] = {
+        'Status': 'available', 'ClusterCreateTime': datetime.datetime(2020, 10, 1), 'EngineVersion': '11.7'}
+    assert handler._cluster_create_time({"namespace": "run-1"}) == "2020-10-01 00:00:00"
+
+
+def _running(world, *run_ids):
+    world.running_executions[handler.LOAD_TEST_STATE_MACHINE] = set(run_ids)
+
+
+def test_the_lease_goes_to_the_runs_in_the_order_they_asked(world):
+    _running(world, "run-1", "run-2")
+    assert handler.acquire_pipeline(_run("run-1"), None)["acquired"]
+    waiting = handler.acquire_pipeline(_run("run-2"), None)
+    assert waiting == {"acquired": False, "holder": "run-1", "ahead": 1}
+    # asking again doesn't lose the run its place
+    assert handler.acquire_pipeline(_run("run-2"), None)["ahead"] == 1
+    handler.release_pipeline(_run("run-1"), None)
+    assert handler.acquire_pipeline(_run("run-2"), None)["acquired"]
+
+
+def test_the_lease_of_a_run_that_is_no_longer_running_expires(world):
+    _running(world, "run-1", "run-2")
+    handler.acquire_pipeline(_run("run-1"), None)
+    assert not handler.acquire_pipeline(_run("run-2"), None)["acquired"]
+    _running(world, "run-2")
+    assert handler.acquire_pipeline(_run("run-2"), None) == {"acquired": True, "holder": "run-2", "ahead": 0}
+    assert list(handler._pipeline_lease_requests().values()) == ["run-2"]
+
+
+def test_a_run_only_gives_up_its_own_lease(world):
+    _running(world, "run-1", "run-2")
+    handler.acquire_pipeline(_run("run-1"), None)
+    handler.acquire_pipeline(_run("run-2"), None)
+    handler.release_pipeline(_run("run-2"), None)
+    assert list(handler._pipeline_lease_requests().values()) == ["run-1"]
+    # a lambda invoked by hand always gets the pipeline, and has no lease to give up
+    assert handler.acquire_pipeline({}, None)["acquired"]
+    handler.release_pipeline({}, None)
+    assert list(handler._pipeline_lease_requests().values()) == ["run-1"]
@@ -0,0 +1,177 @@
+from psycopg2 import OperationalError
+from psycopg2 import sql
+import pytest
+
+from src import rds
+
+
+class FakeCursor:
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.rowcount = 0
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        if self.connection.broken:
+            raise OperationalError("server closed the connection unexpectedly")
+        self.connection.statements.append((sql, params))
+
+    def fetchone(self):
+        return self.connection.rows[0] if self.connection.rows else None
+
+    def __iter__(self):
+        return iter(self.connection.rows)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+        self.autocommit = False
+        self.rows = []
+        self.statements = []
+        self.cursors = []
+        self.rollbacks = 0
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def _connect(**parameters):
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(rds, 'connect', _connect)
+    monkeypatch.setattr(rds, '_pool', {})
+    return opened
+
+
+def test_a_healthy_connection_is_reused(connections):
+    first = rds.get_rds('host', 'user', 'db', 'password')
+    with first:
+        pass
+    assert rds.get_rds('host', 'user', 'db', 'password') is first
+    assert len(connections) == 1
+    assert connections[0].autocommit is True
+
+
+def test_a_closed_connection_is_replaced(connections):
+    first = rds.get_rds('host', 'user', 'db', 'password')
+    connections[0].closed = True
+    second = rds.get_rds('host', 'user', 'db', 'password')
+    assert second is not first
+    assert len(connections) == 2
+
+
+def test_a_connection_that_fails_the_health_check_is_closed_and_replaced(connections):
+    first = rds.get_rds('host', 'user', 'db', 'password')
+    connections[0].broken = True
+    assert rds.get_rds('host', 'user', 'db', 'password') is not first
+    assert connections[0].closed is True
+
+
+def test_other_credentials_get_their_own_connection(connections):
+    assert rds.get_rds('host', 'user', 'db', 'password') is not rds.get_rds('host', 'postgres', 'db', 'password')
+
+
+def test_connecting_backs_off_and_gives_up(monkeypatch):
+    attempts = []
+    sleeps = []
+
+    def _connect(**parameters):
+        attempts.append(parameters)
+        raise OperationalError("could not connect")
+
+    monkeypatch.setattr(rds, 'connect', _connect)
+    monkeypatch.setattr(rds.time, 'sleep', sleeps.append)
+    with pytest.raises(OperationalError):
+        rds.RDS('host', 'user', 'db', 'password')
+    assert len(attempts) == rds.CONNECT_ATTEMPTS
+    assert sleeps == [rds.CONNECT_BACKOFF_SECONDS * 2 ** attempt for attempt in range(rds.CONNECT_ATTEMPTS - 1)]
+
+
+def test_an_unpooled_connection_is_closed_after_use(connections):
+    with rds.RDS('host', 'user', 'db', 'password'):
+        pass
+    assert connections[0].closed is True
+
+
+def test_disconnecting_takes_the_connection_out_of_the_pool(connections):
+    pooled = rds.get_rds('host', 'user', 'db', 'password')
+    pooled.disconnect()
+    assert rds._pool == {}
+
+
+def test_a_batch_is_one_round_trip_with_typed_rows(connections):
+    database = rds.RDS('host', 'user', 'db', 'password')
+    connections[0].rows = [('{"one": [{"n": 1}], "none": []}',)]
+    assert database.execute_batch({"one": "select 1 as n;", "none": "select 1 where false"}) == {
+        "one": [{"n": 1}], "none": []
+    }
+    statement, _ = connections[0].statements[-1]
+    assert statement.startswith("select (jsonb_build_object('one', ")
+    assert "from (select 1 as n) q" in statement
+
+
+def test_a_large_batch_is_split_over_several_json_objects(connections):
+    database = rds.RDS('host', 'user', 'db', 'password')
+    connections[0].rows = [('{}',)]
+    database.execute_batch({f"q{index}": "select 1" for index in range(rds.MAX_QUERIES_PER_OBJECT + 1)})
+    statement, _ = connections[0].statements[-1]
+    assert statement.count("jsonb_build_object(") == 2
+    assert " || " in statement
+
+
+def test_a_batch_takes_compositions(connections):
+    database = rds.RDS('host', 'user', 'db', 'password')
+    connections[0].rows = [('{"one": [{"n": 1}]}',)]
+    database.execute_batch({"one": sql.SQL("select {} as n").format(sql.SQL("1"))})
+    assert "from (select 1 as n) q" in connections[0].statements[-1][0]
+
+
+def test_an_error_rolls_back_and_raises(connections):
+    database = rds.RDS('host', 'user', 'db', 'password')
+    connections[0].broken = True
+    with pytest.raises(OperationalError):
+        database.execute_sql("select 1")
+    assert connections[0].rollbacks == 1
+
+
+def test_a_stream_closes_its_cursor_when_abandoned(connections):
+    database = rds.RDS('host', 'user', 'db', 'password')
+    connections[0].rows = [(1,), (2,), (3,)]
+    rows = database.stream("select n from t", itersize=2)
+    assert next(rows) == (1,)
+    assert connections[0].autocommit is False
+    rows.close()
+    cursor = connections[0].cursors[-1]
+    assert cursor.name.startswith("stream_")
+    assert cursor.itersize == 2
+    assert cursor.closed is True
+    assert connections[0].rollbacks == 1
+    assert connections[0].autocommit is True
+
+
+def test_a_stream_yields_every_row(connections):
+    database = rds.RDS('host', 'user', 'db', 'password')
+    connections[0].rows = [(1,), (2,)]
+    assert list(database.stream("select n from t")) == [(1,), (2,)]
+    assert connections[0].cursors[-1].closed is True
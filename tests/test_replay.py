@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+from src import replay
+
+
+def _due(profile, count):
+    return [due for due, _ in replay.schedule(profile, range(count))]
+
+
+def test_constant_releases_evenly():
+    assert _due({"type": "constant", "rate": 4}, 5) == [0, 0.25, 0.5, 0.75, 1.0]
+
+
+def test_ramp_releases_the_area_under_the_rate_line():
+    profile = {"type": "ramp", "startRate": 1, "endRate": 9, "durationSeconds": 10}
+    due = _due(profile, 60)
+    assert due == sorted(due)
+    # (1 + 9) / 2 * 10 objects by the end of the ramp
+    assert due[50] == pytest.approx(10)
+    # then on at the end rate
+    assert due[59] == pytest.approx(10 + 9 / 9)
+
+
+def test_flat_ramp_is_a_constant_rate():
+    assert _due({"type": "ramp", "startRate": 2, "endRate": 2, "durationSeconds": 10}, 3) == [0, 0.5, 1.0]
+
+
+def test_step_changes_rate_at_each_boundary():
+    profile = {"type": "step", "steps": [{"rate": 1, "durationSeconds": 2}, {"rate": 10, "durationSeconds": 1}]}
+    due = _due(profile, 15)
+    assert due[:3] == [0, 1, pytest.approx(2)]
+    assert due[2:12] == pytest.approx([2 + index / 10 for index in range(10)])
+    # past the last step it keeps going at the last rate
+    assert due[14] == pytest.approx(3.2)
+
+
+def test_replay_keeps_the_original_gaps_divided_by_speedup():
+    start = datetime.datetime(2020, 1, 1)
+    objects = [{"LastModified": start + datetime.timedelta(seconds=seconds)} for seconds in (0, 60, 180)]
+    assert [due for due, _ in replay.schedule({"type": "replay", "speedup": 60}, objects)] == [0, 1, 3]
+
+
+def test_stop_after_seconds_ends_the_schedule():
+    assert _due({"type": "constant", "rate": 1, "stopAfterSeconds": 2}, 10) == [0, 1, 2]
+
+
+def test_unknown_type_is_rejected():
+    with pytest.raises(Exception, match="Unknown replay type"):
+        _due({"type": "sine"}, 1)
+
+
+def test_paced_stops_at_the_deadline_and_resumes():
+    progress = {"released": 0, "maxLagSeconds": 0}
+    started_at = 1000.0
+    scheduled = replay.schedule({"type": "constant", "rate": 1}, range(5))
+    # everything up to the deadline is overdue, so nothing sleeps
+    released = list(replay.paced(scheduled, started_at - 100, started_at - 98, progress))
+    assert released == [0, 1, 2]
+    assert progress["done"] is False
+    assert progress["nextDueAt"] == started_at - 97
+    resumed = replay.resume(replay.schedule({"type": "constant", "rate": 1}, range(5)), progress["released"])
+    assert [obj for _, obj in resumed] == [3, 4]
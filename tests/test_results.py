@@ -0,0 +1,41 @@
+from src import results
+
+
+def _entry(run_id, configuration="small", **metrics):
+    return {"runId": run_id, "configuration": {"database": configuration}, "metrics": metrics}
+
+
+def test_throughput_drop_past_the_threshold_regresses():
+    previous = [_entry(f"run-{index}", **{"Throughput.steadyStateRowsPerSecond": 100}) for index in range(3)]
+    comparison = results.compare(_entry("now", **{"Throughput.steadyStateRowsPerSecond": 85}), previous)
+    assert comparison["regressed"] is True
+    assert comparison["regressions"][0]["metric"] == "Throughput.steadyStateRowsPerSecond"
+    assert comparison["metrics"]["Throughput.steadyStateRowsPerSecond"]["change"] == -0.15
+
+
+def test_drop_within_the_threshold_does_not_regress():
+    previous = [_entry("run-1", **{"Throughput.steadyStateRowsPerSecond": 100})]
+    comparison = results.compare(_entry("now", **{"Throughput.steadyStateRowsPerSecond": 95}), previous)
+    assert comparison["regressed"] is False
+
+
+def test_lower_is_better_metrics_regress_when_they_rise():
+    previous = [_entry("run-1", **{"Pipeline.durationP99Ms": 1000})]
+    comparison = results.compare(_entry("now", **{"Pipeline.durationP99Ms": 1200}), previous)
+    assert [regression["metric"] for regression in comparison["regressions"]] == ["Pipeline.durationP99Ms"]
+
+
+def test_only_runs_of_the_same_configuration_in_the_window_are_compared():
+    previous = [_entry("other", configuration="large", objectsPerSecond=1000)]
+    previous += [_entry(f"run-{index}", objectsPerSecond=index) for index in range(1, 9)]
+    previous += [_entry("now", objectsPerSecond=1)]
+    comparison = results.compare(_entry("now", objectsPerSecond=6), previous, window=3)
+    assert comparison["comparedWith"] == ["run-6", "run-7", "run-8"]
+    assert comparison["metrics"]["objectsPerSecond"]["baseline"] == 7
+
+
+def test_metrics_without_history_or_baseline_are_skipped():
+    previous = [_entry("run-1", objectsPerSecond=0, maxSustainableRate=None)]
+    comparison = results.compare(_entry("now", objectsPerSecond=5, maxSustainableRate=10), previous)
+    assert comparison["metrics"] == {}
+    assert comparison["regressed"] is False
@@ -0,0 +1,102 @@
+import copy
+import json
+
+import pytest
+
+from harness import run_local
+from src import handler
+from src import results
+
+
+def _start(world, **state):
+    world.seed_reference_bucket(handler.SRC_BUCKET, 20)
+    state["run"] = {"id": "run-1", "startedAt": "2020-10-01T12:00:00Z"}
+    world.running_executions[handler.LOAD_TEST_STATE_MACHINE] = {"run-1"}
+    return state
+
+
+def _assert_pipeline_switched_back(world, real_notifications):
+    assert world.notifications[handler.REAL_BUCKET] == real_notifications
+    assert not world.notifications.get(handler.TEST_BUCKET, {}).get('QueueConfigurations')
+    assert {function['Environment']['DB_HOST'] for function in world.functions.values()
+            if 'DB_HOST' in function['Environment']} == {'nwcapture-qa.local'}
+    assert handler._pipeline_lease_requests() == {}
+
+
+def test_a_run_switches_the_pipeline_over_and_back(world):
+    real_notifications = copy.deepcopy(world.notifications[handler.REAL_BUCKET])
+    state = _start(world)
+    run_local.run(handler, state)
+    assert state["completion"]["complete"]
+    assert "failure" not in state
+    _assert_pipeline_switched_back(world, real_notifications)
+
+
+def test_a_failed_step_is_cleaned_up_after_and_fails_the_run(world, monkeypatch):
+    real_notifications = copy.deepcopy(world.notifications[handler.REAL_BUCKET])
+
+    def _compare_results(event, context):
+        raise Exception("no previous results to compare with")
+
+    monkeypatch.setattr(handler, 'compare_results', _compare_results)
+    state = _start(world)
+    with pytest.raises(Exception, match="no previous results"):
+        run_local.run(handler, state)
+    assert state["failure"]["Cause"] == "no previous results to compare with"
+    _assert_pipeline_switched_back(world, real_notifications)
+    assert handler._resources(state)["cluster"] not in world.clusters
+
+
+def test_the_cleanup_leaves_a_real_bucket_that_was_never_switched_alone(world):
+    real_notifications = copy.deepcopy(world.notifications[handler.REAL_BUCKET])
+    handler.remove_notification_from_test_bucket({"failure": {"Error": "Exception"}}, None)
+    assert world.notifications[handler.REAL_BUCKET] == real_notifications
+
+
+def test_a_failed_cluster_is_only_news_to_a_run_that_has_not_failed_yet(world):
+    handler.restore_db_cluster({}, None)
+    world.clusters[handler.DB_CLUSTER_IDENTIFIER]['Status'] = 'failed'
+    with pytest.raises(Exception, match="failed state"):
+        handler.check_load_db({}, None)
+    assert handler.check_load_db({"failure": {"Error": "Exception"}}, None)["clusterStatus"] == 'failed'
+
+
+def test_a_reused_warm_cluster_is_reset_and_the_reset_stored_with_the_results(world):
+    run_local.run(handler, _start(world, keepWarm=True))
+    rows_after_first_run = len(world.database.json_data)
+    state = {"keepWarm": True, "run": {"id": "run-2", "startedAt": "2020-10-01T13:00:00Z"}}
+    world.running_executions[handler.LOAD_TEST_STATE_MACHINE] = {"run-2"}
+    run_local.run(handler, state)
+    assert state["baselineReset"]["deleted"] == {"json_data": rows_after_first_run}
+    results = json.loads(world.buckets[handler.STATE_BUCKET][handler._resources(state)["resultsKey"]]['Body'])
+    assert results["BaselineReset"] == state["baselineReset"]
+
+
+def test_the_copy_plan_is_replaced_by_its_summary(world):
+    state = _start(world, keysPerShard=8)
+    run_local.run(handler, state)
+    assert state["copy"]["shards"] == 3
+    assert state["copy"]["keys"] == state["copy"]["plannedKeys"] == 20
+    assert state["copy"]["incompleteShards"] == []
+
+
+def test_a_shard_without_a_finished_checkpoint_is_reported(world):
+    world.seed_reference_bucket(handler.SRC_BUCKET, 20)
+    plan = handler.plan_copy_shards({"keysPerShard": 8}, None)
+    handler.copy_s3({"shard": plan["shards"][0], "copyId": plan["copyId"], "createdAt": plan["createdAt"]}, None)
+    summary = handler.summarize_copy({"copy": plan}, None)
+    assert summary["keys"] == 8
+    assert summary["incompleteShards"] == [shard["shardId"] for shard in plan["shards"][1:]]
+
+
+def test_warm_runs_are_only_compared_with_other_warm_runs(world):
+    run_local.run(handler, _start(world))
+    state = {"keepWarm": True, "run": {"id": "run-2", "startedAt": "2020-10-01T13:00:00Z"}}
+    world.running_executions[handler.LOAD_TEST_STATE_MACHINE] = {"run-2"}
+    run_local.run(handler, state)
+    index = results.read_index(world.client('s3'), handler.STATE_BUCKET, handler.RESULTS_INDEX_KEY)
+    configurations = {entry["runId"]: entry["configuration"] for entry in index}
+    assert configurations["run-1"]["keepWarm"] is False
+    assert configurations["run-2"]["keepWarm"] is True
+    assert configurations["run-1"]["clone"] is configurations["run-2"]["clone"] is None
+    assert state["comparison"]["comparedWith"] == []
@@ -0,0 +1,121 @@
+import pytest
+
+from src import handler, saturation
+from tests.conftest import FakeContext
+
+
+def _stages(bottleneck="capture", **row):
+    return {"stages": [dict({"stage": "capture", "throttles": 0, "errors": 0, "invocations": 100}, **row)],
+            "bottleneck": bottleneck}
+
+
+def _evaluate(stages=None, database=None, queue=None, in_alarm=(), **slo):
+    return saturation.evaluate(stages or _stages(), database or {}, "trigger", queue or {}, list(in_alarm),
+                               saturation.resolve({"slo": slo})["slo"])
+
+
+def _step(rate, breaches=(), complete=True, busiest="capture"):
+    return {"rate": rate, "achievedRate": rate * 0.99, "complete": complete, "breaches": list(breaches),
+            "observations": {"busiestStage": busiest}}
+
+
+def test_a_step_within_every_objective_has_no_breaches():
+    observations, breaches = _evaluate(database={'CPUUtilizationMaximum': 40, 'CommitLatencyMaximum': 5},
+                                       queue={'AgeOfOldestMessageMaximum': 10})
+    assert breaches == []
+    assert observations["dbCpuPercent"] == 40
+    assert observations["busiestStage"] == "capture"
+
+
+def test_breaches_are_worst_first_with_symptoms_last():
+    _, breaches = _evaluate(
+        stages=_stages(throttles=3, errors=5),
+        database={'CPUUtilizationMaximum': 90, 'CommitLatencyMaximum': 300},
+        queue={'AgeOfOldestMessageMaximum': 3000},
+        in_alarm=["errors"]
+    )
+    assert [(breach["stage"], breach["measure"]) for breach in breaches] == [
+        ("capture", "errorRate"),
+        ("capture", "throttles"),
+        ("database", "commitLatencyMs"),
+        ("database", "cpuPercent"),
+        ("trigger", "queueAgeSeconds"),
+        (None, "alarms")
+    ]
+
+
+def test_an_objective_set_to_none_is_off():
+    _, breaches = _evaluate(database={'CPUUtilizationMaximum': 99}, maxDbCpuPercent=None, alarms=False,
+                            in_alarm=["errors"])
+    assert breaches == []
+
+
+def test_unknown_objectives_are_refused():
+    with pytest.raises(Exception, match="Unknown saturation objectives"):
+        saturation.resolve({"slo": {"maxCpu": 50}})
+
+
+def test_the_rate_grows_by_factor_or_increment():
+    assert saturation.next_rate(saturation.resolve({"factor": 2}), 5) == 10
+    assert saturation.next_rate(saturation.resolve({"increment": 3}), 5) == 8
+
+
+def test_the_best_rate_is_the_highest_complete_step_without_breaches():
+    breach = {"stage": "database", "measure": "cpuPercent", "overBy": 0.1}
+    summary = saturation.summarize([_step(5), _step(10), _step(15, complete=False), _step(20, [breach])],
+                                   "SLO_BREACHED")
+    assert summary["maxSustainableRate"] == 10
+    assert summary["breachedAtRate"] == 20
+    assert summary["saturatedStage"] == "database"
+    assert summary["steps"] == 4
+
+
+def test_a_symptom_only_breach_blames_the_busiest_stage():
+    breach = {"stage": "trigger", "measure": "queueAgeSeconds", "overBy": 2}
+    summary = saturation.summarize([_step(5, [breach], busiest="transform")], "SLO_BREACHED")
+    assert summary["maxSustainableRate"] is None
+    assert summary["saturatedStage"] == "transform"
+
+
+def _saturation_step(world, objects=100, context=None, **profile):
+    world.seed_reference_bucket(handler.SRC_BUCKET, objects)
+    # a pipeline fast enough that the metrics only breach the objectives the test lowers
+    world.capacity = 10 ** 6
+    profile = dict({"startRate": 20, "stepSeconds": 0.5}, **profile)
+    return handler.saturation_step({"run": {"id": "run-1"}, "saturation": profile}, context)
+
+
+def test_a_sustained_step_raises_the_rate(world):
+    state = _saturation_step(world, factor=2)
+    assert not state["done"]
+    assert state["rate"] == 40
+    assert state["steps"][0]["complete"]
+    assert state["offset"] == state["steps"][0]["released"] > 0
+
+
+def test_a_breached_step_stops_the_search(world):
+    state = _saturation_step(world, slo={"maxCommitLatencyMs": 1})
+    assert state["done"]
+    assert state["summary"]["stopReason"] == "SLO_BREACHED"
+    assert state["summary"]["saturatedStage"] == "database"
+    assert state["summary"]["maxSustainableRate"] is None
+
+
+def test_the_search_stops_at_the_ceiling(world):
+    state = _saturation_step(world, maxRate=25)
+    assert state["summary"]["stopReason"] == "MAX_RATE"
+    assert state["summary"]["maxSustainableRate"] == 20
+
+
+def test_the_search_stops_when_the_data_set_runs_out(world):
+    state = _saturation_step(world, objects=3)
+    assert state["summary"]["stopReason"] == "DATASET_EXHAUSTED"
+    assert state["steps"][0]["released"] == 3
+    assert not state["steps"][0]["complete"]
+
+
+def test_a_step_the_invocation_cut_short_is_not_sustained(world):
+    context = FakeContext(remaining_seconds=handler.COPY_DEADLINE_MARGIN + 0.25)
+    state = _saturation_step(world, context=context, stepSeconds=1, maxRate=25)
+    assert not state["steps"][0]["complete"]
+    assert state["summary"]["maxSustainableRate"] is None
@@ -0,0 +1,44 @@
+from src import handler
+
+
+class _RecordingWaiter:
+
+    def __init__(self, name, waits):
+        self.name = name
+        self.waits = waits
+
+    def wait(self, **kwargs):
+        self.waits.append((self.name, kwargs["FunctionName"]))
+
+
+def _record_waits(world, monkeypatch):
+    waits = []
+    monkeypatch.setattr(world.client('lambda'), 'get_waiter', lambda name: _RecordingWaiter(name, waits))
+    return waits
+
+
+def test_only_the_functions_whose_environment_changes_are_updated(world, monkeypatch):
+    already_switched, *others = handler.LAMBDA_FUNCTIONS
+    world.functions[already_switched]['Environment'] = {'DB_HOST': 'nwcapture-load.local', 'DB_PASSWORD': 'Password123'}
+    waits = _record_waits(world, monkeypatch)
+    assert handler._replace_secrets(handler.NWCAPTURE_LOAD) == {"updated": sorted(others),
+                                                                "unchanged": [already_switched]}
+    assert world.calls['lambda.update_function_configuration'] == len(others)
+    assert {function['Environment']['DB_HOST'] for function in world.functions.values()
+            if 'DB_HOST' in function['Environment']} == {'nwcapture-load.local'}
+    # each update waits for one in progress and then for its own to finish
+    assert sorted(waits) == sorted([('function_updated', name) for name in others] * 2)
+
+
+def test_nothing_is_updated_or_waited_on_when_every_function_matches(world, monkeypatch):
+    waits = _record_waits(world, monkeypatch)
+    assert handler._replace_secrets(handler.NWCAPTURE_REAL) == {"updated": [],
+                                                                "unchanged": sorted(handler.LAMBDA_FUNCTIONS)}
+    assert 'lambda.update_function_configuration' not in world.calls
+    assert waits == []
+
+
+def test_a_db_address_overrides_the_secret_s(world):
+    handler._replace_secrets(handler.NWCAPTURE_LOAD, db_address='nwcapture-load-reader.local')
+    function = world.functions[handler.LAMBDA_FUNCTIONS[0]]
+    assert function['Environment'] == {'DB_HOST': 'nwcapture-load-reader.local', 'DB_PASSWORD': 'Password123'}
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from src import handler, switchover
+
+QUEUE = {'QueueArn': 'arn:aws:sqs:local:000000000000:trigger', 'Events': ['s3:ObjectCreated:*']}
+OTHER_QUEUE = {'QueueArn': 'arn:aws:sqs:local:000000000000:other', 'Events': ['s3:ObjectRemoved:*']}
+TOPIC = {'TopicArn': 'arn:aws:sns:local:000000000000:topic', 'Events': ['s3:ObjectCreated:*']}
+
+
+def test_adding_a_queue_keeps_the_bucket_s_other_notifications(world):
+    world.notifications['bucket'] = {'TopicConfigurations': [TOPIC], 'QueueConfigurations': [OTHER_QUEUE],
+                                     'EventBridgeConfiguration': {}}
+    assert switchover.add_queue_notifications(world.client('s3'), 'bucket', [QUEUE])
+    assert world.notifications['bucket'] == {'TopicConfigurations': [TOPIC],
+                                             'QueueConfigurations': [OTHER_QUEUE, QUEUE],
+                                             'EventBridgeConfiguration': {}}
+
+
+def test_adding_a_queue_twice_changes_nothing(world):
+    s3_client = world.client('s3')
+    switchover.add_queue_notifications(s3_client, 'bucket', [QUEUE])
+    assert not switchover.add_queue_notifications(s3_client, 'bucket', [dict(QUEUE, Events=QUEUE['Events'])])
+    assert world.notifications['bucket'] == {'QueueConfigurations': [QUEUE]}
+
+
+def test_removing_a_queue_takes_out_only_its_configurations(world):
+    world.notifications['bucket'] = {'TopicConfigurations': [TOPIC], 'QueueConfigurations': [QUEUE, OTHER_QUEUE],
+                                     'EventBridgeConfiguration': {}}
+    removed = switchover.remove_queue_notifications(world.client('s3'), 'bucket', QUEUE['QueueArn'])
+    assert removed == [QUEUE]
+    assert world.notifications['bucket'] == {'TopicConfigurations': [TOPIC], 'QueueConfigurations': [OTHER_QUEUE],
+                                             'EventBridgeConfiguration': {}}
+    assert switchover.remove_queue_notifications(world.client('s3'), 'bucket', QUEUE['QueueArn']) == []
+
+
+def test_the_queues_have_to_read_empty_on_consecutive_polls(world):
+    drain = handler.check_queues_drained({}, None)
+    assert drain["emptyPolls"] == 1
+    assert not drain["drained"]
+    drain = handler.check_queues_drained({"queueDrain": drain}, None)
+    assert drain["emptyPolls"] == handler.REQUIRED_SETTLED_POLLS
+    assert drain["drained"]
+
+
+def test_a_queue_with_messages_starts_the_count_again_and_is_purged(world):
+    world.queues[handler.CAPTURE_TRIGGER_QUEUE] = 5
+    drain = handler.check_queues_drained({"queueDrain": {"emptyPolls": 1}}, None)
+    assert drain["emptyPolls"] == 0
+    assert drain["queues"][handler.CAPTURE_TRIGGER_QUEUE] == 5
+    assert world.queues[handler.CAPTURE_TRIGGER_QUEUE] == 0
+
+
+def test_a_queue_purged_less_than_a_minute_ago_is_not_purged_again(world):
+    world.queues[handler.ERROR_QUEUE] = 2
+    drain = handler.check_queues_drained({"queuePurge": {"purgedAt": time.time()}}, None)
+    assert not drain["drained"]
+    assert world.queues[handler.ERROR_QUEUE] == 2
+
+
+def test_queues_that_never_drain_fail_the_run(world):
+    world.queues[handler.ERROR_QUEUE] = 2
+    started_at = time.time() - handler.MAX_DRAIN_SECONDS - 1
+    with pytest.raises(Exception, match="Queues still had messages"):
+        handler.check_queues_drained({"queueDrain": {"waitStartedAt": started_at, "purgedAt": time.time()}}, None)
+
+
+def test_a_capture_execution_left_running_keeps_the_queues_from_draining(world):
+    world.running_executions[handler.CAPTURE_STATE_MACHINE] = {"before-the-switch"}
+    drain = handler.check_queues_drained({"queueDrain": {"emptyPolls": 1}}, None)
+    assert drain["runningExecutions"] == 1
+    assert drain["emptyPolls"] == 0
+    assert not drain["drained"]
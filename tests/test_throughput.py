@@ -0,0 +1,42 @@
+import pytest
+
+from src import throughput
+
+
+def _samples(*points):
+    return [{"time": time, "inserts": inserts} for time, inserts in points]
+
+
+def test_the_curve_has_the_ramp_up_steady_state_and_tail_of_the_run():
+    shape = throughput.curve(_samples((0, 0), (10, 100), (20, 600), (30, 1100), (40, 1500), (50, 1520), (60, 1520)))
+    assert [interval["rowsPerSecond"] for interval in shape["intervals"]] == [10, 50, 50, 40, 2, 0]
+    assert shape["totalRows"] == 1520
+    assert shape["averageRowsPerSecond"] == 25.333
+    assert shape["peakRowsPerSecond"] == 50
+    assert shape["steadyStateRowsPerSecond"] == 50
+    assert shape["rampUpSeconds"] == 20
+    assert shape["tailDrainSeconds"] == 10
+
+
+def test_a_sample_that_did_not_move_the_clock_forward_is_skipped():
+    shape = throughput.curve(_samples((0, 0), (10, 100), (10, 150), (20, 300)))
+    assert [interval["offsetSeconds"] for interval in shape["intervals"]] == [10, 20]
+    assert shape["intervals"][-1]["rowsPerSecond"] == 15
+
+
+def test_an_idle_run_has_no_steady_state():
+    shape = throughput.curve(_samples((0, 500), (10, 500), (20, 500)))
+    assert shape["peakRowsPerSecond"] == 0
+    assert shape["steadyStateRowsPerSecond"] == 0
+    assert shape["rampUpSeconds"] is None and shape["tailDrainSeconds"] is None
+
+
+def test_too_few_samples_make_no_curve():
+    assert throughput.curve(_samples((0, 0))) == {"intervals": [], "samples": 1}
+    assert throughput.curve(_samples((0, 0), (0, 10))) == {"intervals": [], "samples": 2}
+
+
+def test_a_sample_needs_the_statistics_row():
+    assert throughput.from_rows([{"inserts": 10, "estimated_rows": 9}])["inserts"] == 10
+    with pytest.raises(Exception, match="capture.json_data statistics"):
+        throughput.from_rows([])